@@ -0,0 +1,87 @@
+import hashlib
+import os
+import pickle
+import time
+
+# Bump when the file layout (header + payload) changes
+CHECKPOINT_FORMAT = 1
+
+DEFAULT_CHECKPOINT_DIR = "/homeassistant/meshcore_checkpoints"
+
+
+def checkpoint_path(directory, app_name):
+    return os.path.join(directory or DEFAULT_CHECKPOINT_DIR, f"{app_name}.ckpt")
+
+
+# Contact attributes the checkpointed caches are derived from
+STAMP_ATTRIBUTES = ("pubkey_prefix", "name", "friendly_name", "adv_name", "adv_lat", "adv_lon", "node_type")
+
+
+def _stamp_row(state_data):
+    attrs = (state_data or {}).get("attributes", {})
+    return tuple(attrs.get(k) for k in STAMP_ATTRIBUTES)
+
+
+def contact_changed(old, new):
+    """True if a contact state change touches any stamped attribute"""
+    return _stamp_row(old) != _stamp_row(new)
+
+
+def contact_stamp(all_states):
+    """Fingerprint of the contact sensors (pubkey, name, location) - changes when contacts do"""
+    rows = []
+    for entity_id, state_data in all_states.items():
+        if not (entity_id.startswith("binary_sensor.meshcore_") and "_contact" in entity_id):
+            continue
+        rows.append("|".join(str(x) for x in (entity_id,) + _stamp_row(state_data)))
+    rows.sort()
+    return hashlib.blake2b("\n".join(rows).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def save_checkpoint(path, app_name, schema, state, stamp=None):
+    """Atomically write a pickled checkpoint: header then state"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = {"format": CHECKPOINT_FORMAT, "app": app_name, "schema": schema,
+              "stamp": stamp, "saved_at": time.time()}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def load_checkpoint(path, app_name, schema, newer_than=()):
+    """
+    Load a checkpoint written by save_checkpoint.
+    Returns (header, state), or (None, reason) if it is missing, from another
+    format/schema/app, unreadable, or older than any of the newer_than files
+    (e.g. JSON persistence written after the checkpoint).
+    """
+    if not os.path.exists(path):
+        return None, "missing"
+    try:
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+            if not isinstance(header, dict) or header.get("format") != CHECKPOINT_FORMAT:
+                return None, "format changed"
+            if header.get("app") != app_name or header.get("schema") != schema:
+                return None, "schema changed"
+            for other in newer_than:
+                if os.path.exists(other) and os.path.getmtime(other) > header.get("saved_at", 0) + 1:
+                    return None, f"older than {os.path.basename(other)}"
+            state = pickle.load(f)
+    except Exception as e:
+        return None, f"unreadable ({e})"
+    return header, state
+
+
+def select_for_restore(items, recency, max_age=None, limit=None, now=None):
+    """
+    Throttle restore replay: (key, value) pairs newest first, dropping those
+    last active more than max_age seconds ago and any beyond limit.
+    """
+    cutoff = (now or time.time()) - max_age if max_age else None
+    selected = [(k, v) for k, v in items if cutoff is None or (recency(v) or 0) >= cutoff]
+    selected.sort(key=lambda kv: recency(kv[1]) or 0, reverse=True)
+    return selected[:limit] if limit else selected
@@ -1,5 +1,6 @@
 import appdaemon.plugins.hass.hassapi as hass
 import time
+import meshcore_startup
 
 class MeshCoreCleanup(hass.Hass):
     """
@@ -12,11 +13,14 @@ class MeshCoreCleanup(hass.Hass):
     def initialize(self):
         self.log("MeshCoreCleanup initialized")
         
+        # MeshCoreHops app name - last message times are read from its memory
+        self.hops_app_name = self.args.get("hops_app", "meshcore_hops")
+        
         # Run daily at 3am
         self.run_daily(self.cleanup_old_contacts, "03:00:00")
         
-        # Also run 60 seconds after startup
-        self.run_in(self.cleanup_old_contacts, 60)
+        # Also run about a minute after startup, staggered against the exports
+        self.run_in(self.cleanup_old_contacts, 60 + meshcore_startup.startup_offset(self.name))
 
     def cleanup_old_contacts(self, kwargs=None):
         """Remove contact entities older than 30 days from HA and device"""
@@ -26,6 +30,10 @@ class MeshCoreCleanup(hass.Hass):
             threshold_sec = threshold_days * 24 * 3600
             
             all_states = self.get_state()
+            try:
+                hops_app = self.get_app(self.hops_app_name)
+            except Exception:
+                hops_app = None
             deleted_count = 0
             checked_count = 0
             skipped_active = 0
@@ -61,7 +69,10 @@ class MeshCoreCleanup(hass.Hass):
                 # Also check hops sensor for last_message_time
                 if pubkey_prefix:
                     hops_sensor = f"sensor.meshcore_hops_{pubkey_prefix}"
-                    hops_state = all_states.get(hops_sensor)
+                    if hops_app is not None:
+                        hops_state = hops_app.get_hops_sensor(hops_sensor)
+                    else:
+                        hops_state = all_states.get(hops_sensor)
                     if hops_state:
                         hops_attrs = hops_state.get("attributes", {})
                         hops_last_msg = hops_attrs.get("last_message_time")
@@ -0,0 +1,406 @@
+import threading
+from collections import OrderedDict
+import meshcore_geo
+
+# Prefix lengths precomputed in the candidate table (path hashes are usually 1 byte)
+PREFIX_LENGTHS = (2, 4, 6, 8, 10, 12)
+
+
+def is_contact_entity(entity_id):
+    return entity_id.startswith("binary_sensor.meshcore_") and "_contact" in entity_id
+
+
+def contact_from_state(state_data):
+    """Located contact from a contact sensor state, or None"""
+    attrs = (state_data or {}).get("attributes", {})
+    pubkey = attrs.get("pubkey_prefix", "").lower()
+    lat = attrs.get("adv_lat") or attrs.get("latitude")
+    lon = attrs.get("adv_lon") or attrs.get("longitude")
+    if not pubkey or lat is None or lon is None:
+        return None
+    return {
+        "name": attrs.get("adv_name") or attrs.get("friendly_name", "").replace(" Contact", ""),
+        "lat": float(lat),
+        "lon": float(lon),
+        "pubkey": pubkey,
+        "node_type": attrs.get("node_type_str", "Unknown"),
+        "last_advert": attrs.get("last_advert", 0) or 0
+    }
+
+
+def contacts_from_states(all_states):
+    """Located contacts from binary_sensor.meshcore_*_contact states: entity_id -> contact"""
+    contacts = {}
+    for entity_id, state_data in all_states.items():
+        if not is_contact_entity(entity_id):
+            continue
+        contact = contact_from_state(state_data)
+        if contact:
+            contacts[entity_id] = contact
+    return contacts
+
+
+def _same_contact(a, b):
+    return all(a[k] == b[k] for k in ("name", "lat", "lon", "node_type"))
+
+
+class ContactIndex:
+    """
+    Resolves path hashes to contacts.
+    The candidate table (prefix -> contacts) is patched per contact change
+    (update_entity) or rebuilt when a full refresh finds drift. Colliding prefixes are resolved from the neighbouring hops in
+    the same path: learned adjacency counts first, then distance to the
+    neighbours. Picks are cached per (prev, hash, next) triple and whole paths
+    per path_nodes tuple, so a familiar route resolves with one dict hit.
+    The index is shared by apps running on different AppDaemon threads; the
+    tables, adjacency and caches are only changed or iterated under its lock.
+    """
+
+    def __init__(self, my_pubkey="", cache_size=4096, max_link_km=meshcore_geo.MAX_PLAUSIBLE_LINK_KM,
+                 path_cache_size=1024):
+        self.my_pubkey = (my_pubkey or "").lower()
+        self.receiver_pubkeys = ()  # my other radios - also win a matching path hash
+        self.max_link_km = max_link_km
+        self.contacts = {}      # pubkey -> contact
+        self.entities = {}      # contact entity_id -> pubkey
+        self.candidates = {}    # prefix -> tuple of contacts
+        self._scanned = {}      # unusual-length prefix -> tuple of contacts
+        self.ambiguous = {}     # colliding prefix -> tuple of contacts
+        self.adjacency = {}     # (low pubkey, high pubkey) -> times seen as neighbours
+        self.generation = 0     # bumped whenever a resolution may change
+        self.maintained_by = None  # app keeping the table live from contact state changes
+
+        self.cache_size = cache_size
+        self._picks = OrderedDict()  # (prev, hash, next) -> pubkey or None
+        self.path_cache_size = path_cache_size
+        self._paths = OrderedDict()  # (path_nodes tuple, origin pubkey) -> (resolved contacts, learned)
+        self._paths_generation = 0
+        self.stats = {"path_hits": 0, "path_misses": 0, "pick_hits": 0, "pick_misses": 0,
+                      "rebuilds": 0, "updates": 0}
+        self._lock = threading.RLock()
+
+    # -------------------------------------------------------------------------
+    # Building
+    # -------------------------------------------------------------------------
+
+    def update(self, all_states):
+        """Full refresh from HA states; rebuilds only if contacts changed. Returns True on rebuild"""
+        by_entity = contacts_from_states(all_states)
+        contacts = {c["pubkey"]: c for c in by_entity.values()}
+        with self._lock:
+            if contacts.keys() == self.contacts.keys() and all(
+                    _same_contact(c, self.contacts[pk]) for pk, c in contacts.items()):
+                # Only adverts moved on - keep the tables, refresh the tie-breaker
+                for pubkey, contact in contacts.items():
+                    self.contacts[pubkey]["last_advert"] = contact["last_advert"]
+                self.entities = {eid: c["pubkey"] for eid, c in by_entity.items()}
+                return False
+            self.rebuild(contacts)
+            self.entities = {eid: c["pubkey"] for eid, c in by_entity.items()}
+            return True
+
+    def rebuild(self, contacts):
+        with self._lock:
+            self.contacts = contacts
+            table = {}
+            for pubkey, contact in contacts.items():
+                for length in PREFIX_LENGTHS:
+                    if len(pubkey) >= length:
+                        table.setdefault(pubkey[:length], []).append(contact)
+            self.candidates = {p: tuple(c) for p, c in table.items()}
+            self.ambiguous = {p: c for p, c in self.candidates.items() if len(c) > 1}
+
+            # Forget links to contacts that are gone
+            self.adjacency = {k: v for k, v in self.adjacency.items() if k[0] in contacts and k[1] in contacts}
+
+            self._invalidate()
+            self.stats["rebuilds"] += 1
+
+    def update_entity(self, entity_id, state_data):
+        """Apply one contact sensor change (state_data None = removed). Returns True if the table changed"""
+        with self._lock:
+            contact = contact_from_state(state_data)
+            old_pubkey = self.entities.get(entity_id)
+            old = self.contacts.get(old_pubkey) if old_pubkey else None
+
+            if contact and old and contact["pubkey"] == old_pubkey and _same_contact(contact, old):
+                old["last_advert"] = contact["last_advert"]
+                return False
+            if contact is None and old_pubkey is None:
+                return False
+
+            if old_pubkey:
+                self._remove(old_pubkey)
+                del self.entities[entity_id]
+            if contact:
+                if contact["pubkey"] in self.contacts:
+                    self._remove(contact["pubkey"])
+                self._add(contact)
+                self.entities[entity_id] = contact["pubkey"]
+
+            self._invalidate()
+            self.stats["updates"] += 1
+            return True
+
+    def _add(self, contact):
+        pubkey = contact["pubkey"]
+        self.contacts[pubkey] = contact
+        for length in PREFIX_LENGTHS:
+            if len(pubkey) >= length:
+                prefix = pubkey[:length]
+                found = self.candidates.get(prefix, ()) + (contact,)
+                self.candidates[prefix] = found
+                if len(found) > 1:
+                    self.ambiguous[prefix] = found
+
+    def _remove(self, pubkey):
+        self.contacts.pop(pubkey, None)
+        for length in PREFIX_LENGTHS:
+            prefix = pubkey[:length]
+            if len(pubkey) < length or prefix not in self.candidates:
+                continue
+            found = tuple(c for c in self.candidates[prefix] if c["pubkey"] != pubkey)
+            if found:
+                self.candidates[prefix] = found
+            else:
+                del self.candidates[prefix]
+            if len(found) > 1:
+                self.ambiguous[prefix] = found
+            else:
+                self.ambiguous.pop(prefix, None)
+
+    def _invalidate(self):
+        """Drop cached resolutions after the contact table changed"""
+        self._scanned.clear()
+        self._picks.clear()
+        self.generation += 1
+
+    def me(self):
+        """My own contact, if my_pubkey is set and located"""
+        return self.contacts.get(self.my_pubkey)
+
+    def set_receivers(self, pubkeys):
+        """Register my other radios' pubkeys"""
+        with self._lock:
+            pubkeys = tuple(sorted({pk.lower() for pk in pubkeys if pk} - {self.my_pubkey}))
+            if pubkeys != self.receiver_pubkeys:
+                self.receiver_pubkeys = pubkeys
+                self._invalidate()
+
+    def lookup(self, path_hash):
+        """All contacts matching a path hash (my own nodes win if one matches)"""
+        with self._lock:
+            key = path_hash.lower()
+            for own in (self.my_pubkey,) + self.receiver_pubkeys:
+                if own and own.startswith(key) and own in self.contacts:
+                    return (self.contacts[own],)
+            found = self.candidates.get(key)
+            if found is None:
+                found = self._scanned.get(key)
+            if found is None:
+                # Unusual length - scan once and remember until the table changes
+                found = tuple(c for p, c in self.contacts.items() if p.startswith(key) or key.startswith(p))
+                self._scanned[key] = found
+            return found
+
+    # -------------------------------------------------------------------------
+    # Learned adjacency
+    # -------------------------------------------------------------------------
+
+    def learn(self, pubkey_a, pubkey_b, count=1):
+        with self._lock:
+            if not pubkey_a or not pubkey_b or pubkey_a == pubkey_b:
+                return
+            key = (pubkey_a, pubkey_b) if pubkey_a < pubkey_b else (pubkey_b, pubkey_a)
+            if key not in self.adjacency and self._picks:
+                # A new neighbour of a colliding node can change earlier picks
+                if self._is_ambiguous(pubkey_a) or self._is_ambiguous(pubkey_b):
+                    self._picks.clear()
+                    self.generation += 1
+            self.adjacency[key] = self.adjacency.get(key, 0) + count
+
+    def seen_together(self, pubkey_a, pubkey_b):
+        key = (pubkey_a, pubkey_b) if pubkey_a < pubkey_b else (pubkey_b, pubkey_a)
+        return self.adjacency.get(key, 0)
+
+    def _is_ambiguous(self, pubkey):
+        return pubkey[:PREFIX_LENGTHS[0]] in self.ambiguous
+
+    def export_contacts(self):
+        """Copies of (contacts, entities) for the checkpoint"""
+        with self._lock:
+            return dict(self.contacts), dict(self.entities)
+
+    def export_adjacency(self):
+        with self._lock:
+            return [[a, b, n] for (a, b), n in self.adjacency.items()]
+
+    def load_adjacency(self, rows):
+        """Merge persisted adjacency (several apps may persist the same shared index)"""
+        with self._lock:
+            for row in rows or []:
+                try:
+                    a, b, count = row[0], row[1], int(row[2])
+                except (IndexError, TypeError, ValueError):
+                    continue
+                key = (a, b) if a < b else (b, a)
+                if count > self.adjacency.get(key, 0):
+                    self.learn(a, b, count - self.adjacency.get(key, 0))
+
+    def cache_stats(self):
+        with self._lock:
+            def rate(hits, misses):
+                return round(hits / (hits + misses), 3) if hits + misses else None
+            return dict(self.stats,
+                        generation=self.generation,
+                        contacts=len(self.contacts),
+                        colliding_prefixes=len(self.ambiguous),
+                        paths_cached=len(self._paths),
+                        path_hit_rate=rate(self.stats["path_hits"], self.stats["path_misses"]),
+                        pick_hit_rate=rate(self.stats["pick_hits"], self.stats["pick_misses"]))
+
+    # -------------------------------------------------------------------------
+    # Resolution
+    # -------------------------------------------------------------------------
+
+    def resolve(self, path_hash, prev=None, next_hop=None, origin=None):
+        """
+        Resolve one hash. prev is the resolved contact before it, next_hop the
+        next hash (or resolved contact) and origin a fallback reference point
+        when neither neighbour is known.
+        """
+        with self._lock:
+            candidates = self.lookup(path_hash)
+            if len(candidates) < 2:
+                return candidates[0] if candidates else None
+
+            prev_key = prev["pubkey"] if prev else None
+            if isinstance(next_hop, dict):
+                next_key = next_hop["pubkey"]
+            else:
+                next_key = next_hop.lower() if next_hop else None
+            key = (prev_key, path_hash.lower(), next_key)
+            if prev is None and not isinstance(next_hop, dict):
+                # No resolved neighbour - the pick is ranked from the origin, which differs per receiver
+                key += (origin.get("pubkey") if origin else None,)
+
+            if key in self._picks:
+                self._picks.move_to_end(key)
+                self.stats["pick_hits"] += 1
+                pubkey = self._picks[key]
+                return self.contacts.get(pubkey) if pubkey else None
+
+            self.stats["pick_misses"] += 1
+            pick = self._rank(candidates, prev, next_hop, origin)
+            self._picks[key] = pick["pubkey"]
+            while len(self._picks) > self.cache_size:
+                self._picks.popitem(last=False)
+            return pick
+
+    def resolve_path(self, path_nodes, origin=None, learn=True):
+        """
+        Resolve every hop of a path. origin is the receiving node, which is the
+        neighbour after the last hop. Resolved neighbours are learned the first
+        time a path is seen; repeats are served from the path cache. The cache
+        generation check, resolution, learning and insert happen under one hold
+        of the lock, so no thread stores a path resolved against an older
+        generation.
+        """
+        with self._lock:
+            key = (tuple(p.lower() for p in path_nodes), origin["pubkey"] if origin else None)
+            if self._paths_generation != self.generation:
+                self._paths.clear()
+                self._paths_generation = self.generation
+            cached = self._paths.get(key)
+            if cached is not None and (cached[1] or not learn):
+                self._paths.move_to_end(key)
+                self.stats["path_hits"] += 1
+                return list(cached[0])
+            self.stats["path_misses"] += 1
+
+            resolved = [None] * len(path_nodes)
+            # Unambiguous hops first, so both neighbours of a colliding hop are known where possible
+            for i, path_hash in enumerate(path_nodes):
+                candidates = self.lookup(path_hash)
+                if len(candidates) == 1:
+                    resolved[i] = candidates[0]
+
+            for i, path_hash in enumerate(path_nodes):
+                if resolved[i] is not None:
+                    continue
+                prev = resolved[i - 1] if i > 0 else None
+                if i + 1 < len(path_nodes):
+                    next_hop = resolved[i + 1] or path_nodes[i + 1]
+                else:
+                    next_hop = origin
+                resolved[i] = self.resolve(path_hash, prev, next_hop, origin)
+
+            if learn:
+                # Only plausible links are learned, so a wrong pick can't reinforce itself
+                for a, b in zip(resolved, resolved[1:]):
+                    if a and b and meshcore_geo.haversine_km(a["lat"], a["lon"], b["lat"], b["lon"]) <= self.max_link_km:
+                        self.learn(a["pubkey"], b["pubkey"])
+
+            # Learning may have invalidated earlier paths, but not this one
+            if self._paths_generation != self.generation:
+                self._paths.clear()
+                self._paths_generation = self.generation
+            self._paths[key] = (tuple(resolved), learn)
+            while len(self._paths) > self.path_cache_size:
+                self._paths.popitem(last=False)
+            return resolved
+
+    def _rank(self, candidates, prev, next_hop, origin):
+        """
+        Best candidate: fewest implausible links to its neighbours, then learned
+        adjacency, then total distance, then repeaters, then newest advert
+        """
+        neighbour_keys = []
+        refs = []
+        if prev:
+            neighbour_keys.append(prev["pubkey"])
+            refs.append(prev)
+        if isinstance(next_hop, dict):
+            neighbour_keys.append(next_hop["pubkey"])
+            refs.append(next_hop)
+        elif next_hop:
+            neighbour_keys.extend(c["pubkey"] for c in self.lookup(next_hop))
+        if not refs and origin:
+            refs.append(origin)
+
+        lats = [c["lat"] for c in candidates]
+        lons = [c["lon"] for c in candidates]
+        distance = [0.0] * len(candidates)
+        implausible = [0] * len(candidates)
+        for ref in refs:
+            for i, km in enumerate(meshcore_geo.distances_from(ref["lat"], ref["lon"], lats, lons)):
+                distance[i] += km
+                implausible[i] += km > self.max_link_km
+
+        def score(i):
+            c = candidates[i]
+            links = sum(self.seen_together(c["pubkey"], n) for n in neighbour_keys)
+            repeater = "repeater" in str(c.get("node_type", "")).lower()
+            return (implausible[i], -links, distance[i], not repeater, -c.get("last_advert", 0))
+
+        return candidates[min(range(len(candidates)), key=score)]
+
+
+# AppDaemon runs all apps in one interpreter, so the path map and the exports
+# share one index (one candidate table, one path cache)
+_shared_index = None
+
+
+def shared_index(my_pubkey="", **settings):
+    """Process-wide ContactIndex; non-empty settings from any app are applied"""
+    global _shared_index
+    if _shared_index is None:
+        _shared_index = ContactIndex()
+    with _shared_index._lock:
+        if my_pubkey and my_pubkey.lower() != _shared_index.my_pubkey:
+            _shared_index.my_pubkey = my_pubkey.lower()
+            _shared_index._invalidate()
+        for name, value in settings.items():
+            if value is not None:
+                setattr(_shared_index, name, value)
+    return _shared_index
@@ -0,0 +1,603 @@
+import json
+import re
+import unicodedata
+from datetime import datetime
+from meshcore_contacts import is_contact_entity
+
+# Rollup bucket layout (compact list, also the persisted form):
+# [hour_start, count, snr_n, snr_sum, snr_min, snr_max,
+#  rssi_n, rssi_sum, rssi_min, rssi_max, hop_counts]
+# hop_counts[i] = receptions with i hops, last slot is ROLLUP_MAX_HOPS+
+ROLLUP_MAX_HOPS = 8
+
+# Hop node activity halves every ACTIVITY_HALF_LIFE_HOURS without use
+ACTIVITY_HALF_LIFE_HOURS = 6
+
+NODE_TYPE_SUFFIX = re.compile(r'\s*\((Client|Repeater|Room Server|Room|Server)\)\s*$', re.IGNORECASE)
+
+
+# -----------------------------------------------------------------------------
+# Names
+# -----------------------------------------------------------------------------
+
+def sanitize_entity_name(name):
+    """Convert a name to a valid entity_id component - ASCII only"""
+    # First normalize accented chars to ASCII equivalents (é -> e)
+    normalized = unicodedata.normalize('NFKD', name)
+    # Keep only ASCII alphanumeric and spaces
+    sanitized = ''.join(c if (c.isalnum() and ord(c) < 128) or c == ' ' else '' for c in normalized)
+    sanitized = re.sub(r'\s+', '_', sanitized.strip())
+    sanitized = sanitized.lower()
+    # Remove any leading/trailing underscores
+    sanitized = sanitized.strip('_')
+    # Remove consecutive underscores
+    sanitized = re.sub(r'_+', '_', sanitized)
+    # Ensure it's not empty
+    if not sanitized:
+        sanitized = "unknown"
+    return sanitized
+
+
+def name_to_pubkey(all_states):
+    """Sender name variations -> pubkey_prefix for every contact sensor"""
+    names = {}
+    for entity_id, state_data in all_states.items():
+        if not is_contact_entity(entity_id):
+            continue
+        attrs = (state_data or {}).get("attributes", {})
+        pubkey = attrs.get("pubkey_prefix")
+        name = attrs.get("name") or attrs.get("friendly_name", "")
+        if pubkey and name:
+            # Clean name - remove " Contact" suffix and node type suffixes
+            original_clean = name.replace(" Contact", "").strip()
+            clean_name = NODE_TYPE_SUFFIX.sub('', original_clean).strip()
+            # Store multiple variations, and the original name in case messages include the suffix
+            for variant in (clean_name, original_clean):
+                names[variant] = pubkey
+                names[variant.lower()] = pubkey
+    return names
+
+
+def lookup_pubkey(names, sender_name):
+    """pubkey_prefix for a sender name from a name_to_pubkey map (None if unknown)"""
+    if sender_name in names:
+        return names[sender_name]
+    if sender_name.lower() in names:
+        return names[sender_name.lower()]
+    # Partial match (for names with emojis that might be stripped)
+    clean_sender = sanitize_entity_name(sender_name)
+    for name, pubkey in names.items():
+        if sanitize_entity_name(name) == clean_sender:
+            names[sender_name] = pubkey
+            return pubkey
+    return None
+
+
+def contact_location(all_states, pubkey_prefix=None, sender_name=None):
+    """Contact location (lat/lon) by pubkey_prefix, or by sender name if there is no pubkey"""
+    for entity_id, state_data in all_states.items():
+        if not is_contact_entity(entity_id):
+            continue
+        attrs = (state_data or {}).get("attributes", {})
+
+        # Match by pubkey if provided
+        if pubkey_prefix and attrs.get("pubkey_prefix") == pubkey_prefix:
+            lat = attrs.get("adv_lat") or attrs.get("latitude")
+            lon = attrs.get("adv_lon") or attrs.get("longitude")
+            if lat is not None and lon is not None:
+                return {"latitude": lat, "longitude": lon}
+
+        # Match by name if no pubkey
+        if sender_name and not pubkey_prefix:
+            contact_name = attrs.get("adv_name") or attrs.get("friendly_name", "")
+            contact_name = contact_name.replace(" Contact", "").replace(" (Client)", "").replace(" (Repeater)", "").replace(" (Room Server)", "").strip()
+            if contact_name == sender_name or sender_name in contact_name:
+                lat = attrs.get("adv_lat") or attrs.get("latitude")
+                lon = attrs.get("adv_lon") or attrs.get("longitude")
+                if lat is not None and lon is not None:
+                    return {"latitude": lat, "longitude": lon}
+
+    return {"latitude": None, "longitude": None}
+
+
+# -----------------------------------------------------------------------------
+# Receptions -> derived state
+# -----------------------------------------------------------------------------
+
+def distinct_new_paths(record, new_receptions):
+    """Paths (2+ nodes) taken by the new receptions that no earlier reception took"""
+    earlier = record["receptions"][:len(record["receptions"]) - len(new_receptions)]
+    seen = {tuple(r["path_nodes"]) for r in earlier}
+    paths = []
+    for reception in new_receptions:
+        path_nodes = reception["path_nodes"]
+        if len(path_nodes) < 2 or tuple(path_nodes) in seen:
+            continue
+        seen.add(tuple(path_nodes))
+        paths.append(reception)
+    return paths
+
+
+def path_links(path_nodes):
+    """Each consecutive pair in path_nodes represents a direct link"""
+    return [(path_nodes[i].lower(), path_nodes[i + 1].lower()) for i in range(len(path_nodes) - 1)]
+
+
+def record_direct_link(direct_links, node_a, node_b, timestamp):
+    """Count one sighting of the directed link node_a -> node_b; returns its entry"""
+    connections = direct_links.setdefault(node_a, {})
+    if node_b in connections:
+        connections[node_b]["last_seen"] = timestamp
+        connections[node_b]["count"] = connections[node_b].get("count", 0) + 1
+    else:
+        connections[node_b] = {"last_seen": timestamp, "count": 1}
+    return connections[node_b]
+
+
+def path_to_draw(record, new_receptions):
+    """The longest new reception of a message not drawn yet (None if nothing to draw)"""
+    if ": " not in record["text"]:
+        return None
+    earlier = record["receptions"][:len(record["receptions"]) - len(new_receptions)]
+    if any(len(r["path_nodes"]) >= 2 for r in earlier):
+        return None  # Late receptions - this message is already drawn
+    longest = max(new_receptions, key=lambda r: len(r["path_nodes"]))
+    return longest if len(longest["path_nodes"]) >= 2 else None
+
+
+def track_hop_node(hop_nodes_used, pubkey_prefix, coords, timestamp, recent_hours,
+                   half_life_hours=ACTIVITY_HALF_LIFE_HOURS):
+    """Count one use of a resolved hop node; returns (key, created)"""
+    key = coords.get("pubkey", pubkey_prefix).lower()
+    created = key not in hop_nodes_used
+    if created:
+        coords = {k: coords.get(k) for k in ("lat", "lon", "name", "pubkey", "node_type")}
+        hop_nodes_used[key] = {"coords": coords, "last_used": timestamp, "use_count": 1}
+    else:
+        hop_nodes_used[key]["last_used"] = timestamp
+        hop_nodes_used[key]["use_count"] += 1
+    count_recent_use(hop_nodes_used[key], timestamp, recent_hours)
+    add_activity(hop_nodes_used[key], timestamp, half_life_hours)
+    return key, created
+
+
+def count_recent_use(data, timestamp, recent_hours, count=1):
+    """Add uses to the node's hour bucket and drop buckets past recent_hours"""
+    hour = int(timestamp // 3600) * 3600
+    buckets = [b for b in data.get("use_buckets", []) if b[0] > hour - recent_hours * 3600]
+    if buckets and buckets[-1][0] == hour:
+        buckets[-1][1] += count
+    else:
+        buckets.append([hour, count])
+    data["use_buckets"] = buckets
+
+
+def recent_use_count(data, now, recent_hours):
+    """Uses within the last recent_hours (hour resolution)"""
+    cutoff = now - recent_hours * 3600
+    return sum(count for hour, count in data.get("use_buckets", []) if hour + 3600 > cutoff)
+
+
+def decayed_activity(data, timestamp, half_life_hours=ACTIVITY_HALF_LIFE_HOURS):
+    """
+    Activity score of a hop node at timestamp. The score is stored as of its
+    last update (activity, activity_at) and decayed on read, so it never needs
+    a sweep; each use adds 1.
+    """
+    activity = data.get("activity", 0.0)
+    if not activity:
+        return 0.0
+    elapsed = max(0.0, timestamp - data.get("activity_at", timestamp))
+    return activity * 0.5 ** (elapsed / (half_life_hours * 3600))
+
+
+def add_activity(data, timestamp, half_life_hours=ACTIVITY_HALF_LIFE_HOURS, amount=1.0):
+    """Decay the node's activity to timestamp and add amount; an earlier timestamp adds its share decayed to activity_at"""
+    at = data.get("activity_at", timestamp)
+    if timestamp >= at:
+        data["activity"] = decayed_activity(data, timestamp, half_life_hours) + amount
+        data["activity_at"] = timestamp
+    else:
+        data["activity"] = data.get("activity", 0.0) + amount * 0.5 ** ((at - timestamp) / (half_life_hours * 3600))
+        data["activity_at"] = at
+
+
+def new_rollup_bucket(hour_start):
+    return [hour_start, 0, 0, 0.0, None, None, 0, 0.0, None, None, [0] * (ROLLUP_MAX_HOPS + 1)]
+
+
+def record_rollup(rollups, rollup_hours, node_key, sender_name, hops, snr, rssi, timestamp):
+    """Add one reception to the node's hourly rollup bucket (ring of rollup_hours slots)"""
+    if not node_key:
+        return
+    hour_start = int(timestamp // 3600) * 3600
+
+    node = rollups.get(node_key)
+    if node is None:
+        node = {"name": sender_name, "buckets": [None] * rollup_hours}
+        rollups[node_key] = node
+    node["name"] = sender_name
+
+    slot = (hour_start // 3600) % rollup_hours
+    bucket = node["buckets"][slot]
+    if bucket is None or bucket[0] != hour_start:
+        # Slot is empty or holds an hour that has rotated out of the window
+        bucket = new_rollup_bucket(hour_start)
+        node["buckets"][slot] = bucket
+
+    bucket[1] += 1
+    if snr is not None:
+        bucket[2] += 1
+        bucket[3] += snr
+        bucket[4] = snr if bucket[4] is None else min(bucket[4], snr)
+        bucket[5] = snr if bucket[5] is None else max(bucket[5], snr)
+    if rssi is not None:
+        bucket[6] += 1
+        bucket[7] += rssi
+        bucket[8] = rssi if bucket[8] is None else min(bucket[8], rssi)
+        bucket[9] = rssi if bucket[9] is None else max(bucket[9], rssi)
+    bucket[10][min(int(hops or 0), ROLLUP_MAX_HOPS)] += 1
+
+
+def merge_rollup_bucket(into, bucket):
+    """Fold bucket into another bucket of the same hour"""
+    into[1] += bucket[1]
+    for n, total, low, high in ((2, 3, 4, 5), (6, 7, 8, 9)):
+        into[n] += bucket[n]
+        into[total] += bucket[total]
+        into[low] = bucket[low] if into[low] is None else (into[low] if bucket[low] is None else min(into[low], bucket[low]))
+        into[high] = bucket[high] if into[high] is None else (into[high] if bucket[high] is None else max(into[high], bucket[high]))
+    into[10] = [a + b for a, b in zip(into[10], bucket[10])]
+
+
+def best_reception(receptions):
+    """Direct preferred, then highest SNR"""
+    best = None
+    for r in receptions:
+        if best is None:
+            best = r
+        elif r["hops"] == 0 and best["hops"] > 0:
+            best = r
+        elif r["hops"] == best["hops"] and (r["snr"] or 0) > (best["snr"] or 0):
+            best = r
+    return best
+
+
+# Hops sensor attributes that can be derived from other attributes (dropped in compact mode)
+DERIVABLE_HOPS_ATTRIBUTES = ("longest_path", "max_hops", "last_message_formatted", "last_seen_formatted")
+
+
+def apply_attribute_budget(attributes, max_receptions, message_text_length, compact=False, store_receptions=False):
+    """
+    Cap receptions/text and drop derivable fields of hops sensor attributes,
+    in place. With store_receptions the receptions are taken off the
+    attributes and returned (None otherwise).
+    """
+    stored = None
+    receptions = attributes.get("receptions")
+    if receptions is not None:
+        if store_receptions:
+            stored = attributes.pop("receptions")
+        elif max_receptions and len(receptions) > max_receptions:
+            attributes["receptions"] = receptions[:max_receptions]
+
+    text = attributes.get("last_message_text")
+    if text is not None:
+        if message_text_length > 0:
+            attributes["last_message_text"] = text[:message_text_length]
+        else:
+            del attributes["last_message_text"]
+
+    if compact:
+        for key in DERIVABLE_HOPS_ATTRIBUTES:
+            attributes.pop(key, None)
+    return stored
+
+
+def hops_sensor_attributes(record, pubkey, location, timestamp, receiver_name=None):
+    """
+    (state, attributes) of a sender's hops sensor for all receptions of a
+    message. receiver_name(tag) labels each reception with the radio that heard it.
+    """
+    receptions = record["receptions"]
+    best = best_reception(receptions)
+    # Also find the longest path (most interesting for mesh visualization)
+    longest_path = max(receptions, key=lambda r: r["hops"])
+
+    # Format receptions for attribute storage
+    receptions_formatted = []
+    for r in receptions:
+        formatted = {
+            "hops": r["hops"],
+            "snr": r["snr"],
+            "rssi": r["rssi"],
+            "path": ' → '.join(r["path_nodes"]) if r["path_nodes"] else "direct"
+        }
+        if receiver_name is not None:
+            formatted["receiver"] = receiver_name(r.get("receiver"))
+        receptions_formatted.append(formatted)
+
+    attributes = {
+        "friendly_name": f"{record['sender_name']} Hops",
+        "sender_name": record["sender_name"],
+        "pubkey_prefix": pubkey if pubkey else "",
+        "message_type": "channel",
+        "channel_idx": record["channel_idx"],
+        # Location data
+        "latitude": location["latitude"],
+        "longitude": location["longitude"],
+        # Best reception data
+        "path_length": best["hops"],
+        "snr": best["snr"] if best["snr"] is not None else 0,
+        "rssi": best["rssi"] if best["rssi"] is not None else 0,
+        # Use longest_path for path_nodes (for map visualization)
+        "path_nodes": longest_path["path_nodes"],
+        # Longest path data (for mesh visualization)
+        "max_hops": longest_path["hops"],
+        "longest_path": ' → '.join(longest_path["path_nodes"]) if longest_path["path_nodes"] else "direct",
+        # All receptions
+        "receptions": receptions_formatted,
+        "reception_count": len(receptions),
+        # Message info
+        "last_message_text": record["message_text"] or "",
+        "last_message_time": timestamp,
+        "last_message_formatted": datetime.fromtimestamp(timestamp).isoformat(),
+        "icon": "mdi:routes",
+        "unit_of_measurement": "hops",
+        "data_source": "rx_log_data"
+    }
+    # State is best/direct hop count
+    return best["hops"], attributes
+
+
+def hops_summary(hops_sensors_data, receptions_of):
+    """
+    (nodes, totals) of the aggregate hops summary: one entry per hops sensor,
+    newest first, and the summary sensor's direct_count, by_source,
+    last_sender and last_message_time. receptions_of(sensor_id) gives a
+    sensor's receptions.
+    """
+    nodes = []
+    by_source = {}
+    direct = 0
+    latest = None
+    for sensor_id, sensor_data in list(hops_sensors_data.items()):
+        attrs = sensor_data.get("attributes", {})
+        seen = attrs.get("last_message_time") or attrs.get("last_seen", 0)
+        source = attrs.get("data_source", "unknown")
+        by_source[source] = by_source.get(source, 0) + 1
+        if attrs.get("path_length", 0) == 0:
+            direct += 1
+        node = {
+            "sensor_id": sensor_id,
+            "sender_name": attrs.get("sender_name", ""),
+            "pubkey_prefix": attrs.get("pubkey_prefix", ""),
+            "hops": sensor_data.get("state", 0),
+            "snr": attrs.get("snr", 0),
+            "rssi": attrs.get("rssi", 0),
+            "path_nodes": attrs.get("path_nodes", []),
+            "receptions": receptions_of(sensor_id),
+            "latitude": attrs.get("latitude"),
+            "longitude": attrs.get("longitude"),
+            "last_seen": seen,
+            "data_source": source
+        }
+        nodes.append(node)
+        if latest is None or seen > latest["last_seen"]:
+            latest = node
+
+    nodes.sort(key=lambda n: n["last_seen"], reverse=True)
+    return nodes, {
+        "direct_count": direct,
+        "by_source": by_source,
+        "last_sender": latest["sender_name"] if latest else "",
+        "last_message_time": latest["last_seen"] if latest else 0
+    }
+
+
+# -----------------------------------------------------------------------------
+# Hop markers
+# -----------------------------------------------------------------------------
+
+def group_nodes_by_name(hop_nodes, safe_name):
+    """safe_name(name) -> [(pubkey, data, coords)] of the hop nodes that have a location"""
+    nodes_by_name = {}
+    for pubkey, data in hop_nodes.items():
+        coords = data.get("coords", {})
+        if not coords or not coords.get("lat") or not coords.get("lon"):
+            continue
+        nodes_by_name.setdefault(safe_name(coords.get("name", "Unknown")), []).append((pubkey, data, coords))
+    return nodes_by_name
+
+
+def needs_disambiguation(nodes):
+    """Whether nodes sharing a name are at different places (and need one marker each)"""
+    if len(nodes) <= 1:
+        return False
+    first_lat = nodes[0][2].get("lat", 0)
+    first_lon = nodes[0][2].get("lon", 0)
+    for _, _, coords in nodes[1:]:
+        if abs(coords.get("lat", 0) - first_lat) > 0.001 or abs(coords.get("lon", 0) - first_lon) > 0.001:
+            return True
+    return False
+
+
+def marker_layout(hop_nodes, safe_name, wants_entity):
+    """
+    pubkey -> device_tracker entity_id for every hop node that gets a marker.
+    wants_entity(pubkey, name) filters the nodes; same-named nodes at different
+    places get the pubkey prefix appended.
+    """
+    layout = {}
+    for name, nodes in group_nodes_by_name(hop_nodes, safe_name).items():
+        needs_dis = needs_disambiguation(nodes)
+        for pubkey, data, coords in nodes:
+            if not wants_entity(pubkey, coords.get("name")):
+                continue
+            layout[pubkey] = f"device_tracker.meshcore_hop_{name}_{pubkey[:6]}" if needs_dis else f"device_tracker.meshcore_hop_{name}"
+    return layout
+
+
+def hop_marker_attributes(coords, data, display_name):
+    """Attributes of a hop node's device_tracker; display_name(name) cleans the node name"""
+    node_type = coords.get("node_type", "Unknown")
+    if "repeater" in node_type.lower():
+        icon = "mdi:radio-tower"
+    elif "client" in node_type.lower():
+        icon = "mdi:cellphone-wireless"
+    elif "room" in node_type.lower():
+        icon = "mdi:forum"
+    else:
+        icon = "mdi:access-point"
+
+    name = display_name(coords.get("name", "Unknown"))
+    return {
+        "friendly_name": f"Hop: {name}",
+        "source_type": "gps",
+        "latitude": coords["lat"],
+        "longitude": coords["lon"],
+        "gps_accuracy": 50,
+        "source": "meshcore_hop",
+        "node_name": name,
+        "node_type": node_type,
+        "pubkey": data.get("pubkey", ""),
+        "use_count": data.get("use_count", 0),
+        "last_used": data.get("last_used", 0),
+        "icon": icon
+    }
+
+
+# -----------------------------------------------------------------------------
+# GeoJSON path layer
+# -----------------------------------------------------------------------------
+
+def path_feature(sender_name, path_coords, drawn_at, display_name):
+    """LineString feature of a drawn path; display_name(name) cleans node and sender names"""
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "LineString",
+            "coordinates": [[c["lon"], c["lat"]] for c in path_coords]
+        },
+        "properties": {
+            "sender": display_name(sender_name),
+            "hops": len(path_coords),
+            "nodes": [display_name(c.get("name", "Unknown")) for c in path_coords],
+            "pubkeys": [c.get("pubkey", "") for c in path_coords],
+            "drawn_at": drawn_at
+        }
+    }
+
+
+def expire_path_features(path_features, cutoff):
+    """Drop features drawn before cutoff, in place; returns how many were dropped"""
+    expired = [k for k, f in path_features.items() if f["properties"]["drawn_at"] < cutoff]
+    for k in expired:
+        del path_features[k]
+    return len(expired)
+
+
+def path_feature_collection(path_features, updated):
+    """The path layer, newest path first"""
+    return {
+        "type": "FeatureCollection",
+        "features": sorted(path_features.values(), key=lambda f: f["properties"]["drawn_at"], reverse=True),
+        "updated": updated
+    }
+
+
+# -----------------------------------------------------------------------------
+# Playback snapshots
+# -----------------------------------------------------------------------------
+
+def snapshot_hash(nodes):
+    """Create a simple hash to detect data changes"""
+    if not nodes:
+        return ""
+    try:
+        # Hash based on node count and first/last few nodes
+        return str(len(nodes)) + json.dumps(
+            [(n.get("name", ""), n.get("use_count", n.get("link_count", 0))) for n in nodes[:10]])
+    except Exception:
+        return ""
+
+
+def heatmap_snapshot_node(pubkey, data):
+    """Heatmap snapshot node of one hop_nodes_used entry (None if not located)"""
+    if not isinstance(data, dict):
+        return None
+    coords = data.get("coords", {})
+    if not (coords and coords.get("lat") and coords.get("lon")):
+        return None
+    return {
+        "name": coords.get("name", "Unknown"),
+        "lat": coords.get("lat"),
+        "lon": coords.get("lon"),
+        "use_count": data.get("use_count", 0),
+        "last_used": data.get("last_used", 0),
+        "node_type": coords.get("node_type", "Unknown"),
+        "pubkey": pubkey
+    }
+
+
+def heatmap_snapshot_nodes(hop_nodes_used):
+    """Heatmap snapshot nodes from raw hop_nodes_used (every located node, no threshold)"""
+    nodes = (heatmap_snapshot_node(pubkey, data) for pubkey, data in hop_nodes_used.items())
+    return [node for node in nodes if node]
+
+
+def index_resolver(index):
+    """resolve_link for directlinks_snapshot from a ContactIndex (both ends resolved together)"""
+    def resolve_link(from_prefix, to_prefix):
+        from_coords, to_coords = index.resolve_path([from_prefix, to_prefix], learn=False)
+        return from_coords or {}, to_coords or {}
+    return resolve_link
+
+
+def directlinks_snapshot(raw_links, resolve_link, current_time):
+    """
+    (nodes, links) of a direct links snapshot from raw direct_links (no
+    threshold). resolve_link(from prefix, to prefix) -> (from contact, to contact).
+    """
+    nodes = {}
+    all_links = []
+
+    def add_node(coords):
+        key = coords.get("pubkey")
+        if key not in nodes:
+            nodes[key] = {
+                "name": coords.get("name", "Unknown"),
+                "lat": coords.get("lat"),
+                "lon": coords.get("lon"),
+                "node_type": coords.get("node_type", "Unknown"),
+                "pubkey": key,
+                "link_count": 0,
+                "last_seen": coords.get("last_advert", current_time)
+            }
+
+    for from_prefix, targets in raw_links.items():
+        if not isinstance(targets, dict):
+            continue
+
+        for to_prefix, link_data in targets.items():
+            if not isinstance(link_data, dict):
+                continue
+            from_coords, to_coords = resolve_link(from_prefix, to_prefix)
+            if not from_coords.get("lat") or not to_coords.get("lat"):
+                continue
+            add_node(from_coords)
+            add_node(to_coords)
+            nodes[from_coords.get("pubkey")]["link_count"] += 1
+
+            all_links.append({
+                "from_name": from_coords.get("name", "Unknown"),
+                "from_lat": from_coords.get("lat"),
+                "from_lon": from_coords.get("lon"),
+                "to_name": to_coords.get("name", "Unknown"),
+                "to_lat": to_coords.get("lat"),
+                "to_lon": to_coords.get("lon"),
+                "count": link_data.get("count", 1),
+                "last_seen": link_data.get("last_seen", current_time)
+            })
+
+    return list(nodes.values()), all_links
@@ -1,8 +1,19 @@
 import appdaemon.plugins.hass.hassapi as hass
 import json
+import math
 import time
 import os
 from datetime import datetime
+from meshcore_graph import LinkGraph
+import meshcore_geo
+import meshcore_ingress
+import meshcore_contacts
+import meshcore_derive
+import meshcore_memory
+import meshcore_receivers
+import meshcore_receptions
+import meshcore_registry
+import meshcore_startup
 
 class MeshCoreDirectLinksExport(hass.Hass):
     """
@@ -16,23 +27,68 @@ class MeshCoreDirectLinksExport(hass.Hass):
 
         self.direct_links = {}
         self.persistence_file = "/homeassistant/www/meshcore_directlinks_persist.json"
+
+        # Links longer than this are flagged as implausible (likely prefix collisions)
+        self.max_link_km = float(self.args.get("max_link_km", meshcore_geo.MAX_PLAUSIBLE_LINK_KM))
+
+        # Receptions are collected per message in the shared fingerprint cache;
+        # each distinct path of a message is recorded once
+        self.collector = meshcore_receptions.shared_collector(
+            self.args.get("fingerprint_ttl"), self.args.get("fingerprint_cache_size"))
+        self.collector.subscribe(self, self.handle_message_receptions, int(self.args.get("collection_window", 3)))
+
+        # Path hash -> contact resolution, shared with the path map
+        self.contacts = meshcore_contacts.shared_index(self.args.get("my_pubkey", ""))
+        self.receivers = meshcore_receivers.shared_receivers(self.args.get("receivers"), self.args.get("my_pubkey", ""))
+        self.contacts.set_receivers(self.receivers.pubkeys())
         self.load_persisted_data()
 
+        # Links are published to the shared registry (copy-on-write) for the
+        # snapshot recorder: (from prefix, to prefix) -> {count, last_seen},
+        # committed at most every publish_delay seconds
+        self.published_links = meshcore_registry.CopyOnWriteMap(
+            meshcore_registry.shared_registry(), meshcore_registry.DIRECT_LINKS,
+            app=self, commit_delay=float(self.args.get("publish_delay", 1)))
+        self.publish_links(reload=True)
+
+        # Topology graph over direct_links, kept in sync by record_direct_link
+        self.graph = LinkGraph(route_cache_size=int(self.args.get("route_cache_size", 64)))
+        self.graph.load_links(self.direct_links)
+        self.graph_time_budget = float(self.args.get("graph_time_budget", 2.0))
+        self._topology_published_version = None
+
+        # prefix -> node info, refreshed by each export (used to name routes)
+        self.node_infos = {}
+
         # Debounce timer for export
         self._export_timer = None
 
-        # Export on startup
-        self.run_in(self.export_directlinks_data, 20)
+        # Export on startup - after the entity restore, staggered against the other exports
+        first_export = 30 + meshcore_startup.startup_offset(self.name)
+        self.run_in(self.export_directlinks_data, first_export)
 
         # Periodic export every 5 minutes
-        self.run_every(self.export_directlinks_data, "now+60", 300)
+        self.run_every(self.export_directlinks_data, f"now+{first_export + 300}", 300)
 
-        # Listen directly to raw meshcore events - no sensor state cascade
-        self.listen_event(self.handle_raw_event, "meshcore_raw_event")
+        # Listen directly to raw meshcore events - no sensor state cascade.
+        # The ingress queue collapses receptions of a message over the same path.
+        self.ingress = meshcore_ingress.ingress_queue(self, self.handle_raw_event, (meshcore_ingress.RX_LOG_DATA,))
 
         # Listen for threshold changes
         self.listen_state(self.export_directlinks_data, "input_number.meshcore_heatmap_threshold_hours")
 
+        # Memory budgets (memory_budgets: {structure: max items}), enforced periodically
+        self.memory = meshcore_memory.MemoryBudget(self.name, self.args.get("memory_budgets", {}))
+        memory_interval = int(self.args.get("memory_check_interval", 600))
+        self.run_every(self.enforce_memory_budgets, f"now+{memory_interval}", memory_interval)
+
+        # Route queries: /api/appdaemon/meshcore_route and meshcore_route_query events
+        self.register_endpoint(self.api_route, "meshcore_route")
+        self.listen_event(self.handle_route_query, "meshcore_route_query")
+
+    def terminate(self):
+        self.collector.unsubscribe(self.name)
+
     # -------------------------------------------------------------------------
     # Raw event handling
     # -------------------------------------------------------------------------
@@ -44,33 +100,42 @@ class MeshCoreDirectLinksExport(hass.Hass):
                 return
 
             payload = data.get("payload", {})
-            decrypted = payload.get("decrypted", {})
 
-            # Skip undecrypted packets
-            if not decrypted.get("decrypted"):
+            # Need at least 2 nodes to have a direct link
+            if len(payload.get("parsed", {}).get("path_nodes", [])) < 2:
                 return
 
-            parsed = payload.get("parsed", {})
-            path_nodes = parsed.get("path_nodes", [])
+            # Undecrypted packets are skipped by the collector
+            self.collector.add(payload, meshcore_receivers.receiver_of(data))
 
-            # Need at least 2 nodes to have a direct link
-            if len(path_nodes) < 2:
-                return
+        except Exception as e:
+            self.log(f"Error handling raw event: {e}", level="ERROR")
 
+    def handle_message_receptions(self, record, new_receptions):
+        """Record the links of each path this message took that wasn't seen yet"""
+        try:
             now_ts = time.time()
+            recorded = False
 
-            # Each consecutive pair in path_nodes represents a direct link
-            for i in range(len(path_nodes) - 1):
-                node_a = path_nodes[i].lower()
-                node_b = path_nodes[i + 1].lower()
-                self.record_direct_link(node_a, node_b, now_ts)
-                self.record_direct_link(node_b, node_a, now_ts)
+            for reception in meshcore_derive.distinct_new_paths(record, new_receptions):
+                path_nodes = reception["path_nodes"]
 
-            # Schedule debounced export
-            self._schedule_export()
+                # Each consecutive pair in path_nodes represents a direct link
+                for node_a, node_b in meshcore_derive.path_links(path_nodes):
+                    self.record_direct_link(node_a, node_b, now_ts)
+                    self.record_direct_link(node_b, node_a, now_ts)
+
+                # Learn which colliding nodes neighbour each other
+                self.contacts.resolve_path(path_nodes, origin=self.receivers.origin(reception["receiver"], self.contacts))
+                recorded = True
+
+            if recorded:
+                self.publish_links()
+                # Schedule debounced export
+                self._schedule_export()
 
         except Exception as e:
-            self.log(f"Error handling raw event: {e}", level="ERROR")
+            self.log(f"Error handling message receptions: {e}", level="ERROR")
 
     # -------------------------------------------------------------------------
     # Debounce
@@ -99,6 +164,7 @@ class MeshCoreDirectLinksExport(hass.Hass):
                 with open(self.persistence_file, 'r') as f:
                     data = json.load(f)
                     self.direct_links = data.get("direct_links", {})
+                    self.contacts.load_adjacency(data.get("adjacency", []))
                     self.log(f"Loaded {len(self.direct_links)} nodes with direct links from persistence")
         except Exception as e:
             self.log(f"Error loading persisted data: {e}", level="WARNING")
@@ -110,15 +176,21 @@ class MeshCoreDirectLinksExport(hass.Hass):
             max_age = 7 * 24 * 3600
 
             cleaned_links = {}
+            pruned = 0
             for node_a, connections in self.direct_links.items():
                 cleaned = {k: v for k, v in connections.items()
                            if (now_ts - v.get("last_seen", 0)) <= max_age}
+                pruned += len(connections) - len(cleaned)
                 if cleaned:
                     cleaned_links[node_a] = cleaned
             self.direct_links = cleaned_links
+            if pruned:
+                self.graph.load_links(self.direct_links)
+                self.publish_links(reload=True)
 
             data = {
                 "direct_links": self.direct_links,
+                "adjacency": self.contacts.export_adjacency(),
                 "saved_at": now_ts,
                 "saved_at_formatted": datetime.now().isoformat()
             }
@@ -132,13 +204,176 @@ class MeshCoreDirectLinksExport(hass.Hass):
     # -------------------------------------------------------------------------
 
     def record_direct_link(self, node_a, node_b, timestamp):
-        if node_a not in self.direct_links:
-            self.direct_links[node_a] = {}
-        if node_b in self.direct_links[node_a]:
-            self.direct_links[node_a][node_b]["last_seen"] = timestamp
-            self.direct_links[node_a][node_b]["count"] = self.direct_links[node_a][node_b].get("count", 0) + 1
+        link = meshcore_derive.record_direct_link(self.direct_links, node_a, node_b, timestamp)
+        self.graph.add_edge(node_a, node_b, link["count"])
+        self.published_links.set((node_a, node_b), dict(link))
+
+    def publish_links(self, reload=False):
+        """Publish staged link changes, debounced (reload: republish every link now)"""
+        if reload:
+            self.published_links.replace(((a, b), dict(info)) for a, connections in self.direct_links.items()
+                                         for b, info in connections.items())
+            self.published_links.commit()
         else:
-            self.direct_links[node_a][node_b] = {"last_seen": timestamp, "count": 1}
+            self.published_links.schedule()
+
+    def enforce_memory_budgets(self, kwargs=None):
+        """Cap the number of directed links, evicting the least recently seen"""
+        try:
+            links = {(a, b): info for a, connections in self.direct_links.items()
+                     for b, info in connections.items()}
+            if self.memory.enforce("direct_links", links, 20000, recency=lambda v: v.get("last_seen", 0)):
+                direct_links = {}
+                for (a, b), info in links.items():
+                    direct_links.setdefault(a, {})[b] = info
+                self.direct_links = direct_links
+                self.graph.load_links(self.direct_links)
+                self.publish_links(reload=True)
+
+            self.memory.track("graph_nodes", len(self.graph.nodes))
+            self.memory.track("route_trees", self.graph.cached_routes(), self.graph.route_cache_size)
+            self.memory.track("node_infos", len(self.node_infos))
+            self.memory.track("fingerprints", len(self.collector), self.collector.max_size)
+
+            meshcore_memory.publish_memory_sensor(self)
+        except Exception as e:
+            self.log(f"Error enforcing memory budgets: {e}", level="ERROR")
+
+    # -------------------------------------------------------------------------
+    # Topology
+    # -------------------------------------------------------------------------
+
+    def analyse_topology(self, node_info):
+        """Run (cached) graph analysis and resolve prefixes to node names"""
+        analysis = self.graph.analyse(self.graph_time_budget)
+
+        def describe(prefix):
+            info = node_info(prefix)
+            return {"prefix": prefix,
+                    "name": info["name"] if info else prefix,
+                    "pubkey": info["pubkey"] if info else prefix}
+
+        ranked = sorted(analysis["betweenness"].items(), key=lambda x: x[1], reverse=True)
+        topology = {
+            "version": analysis["version"],
+            "node_count": analysis["node_count"],
+            "edge_count": analysis["edge_count"],
+            "components": analysis["components"],
+            "complete": analysis["complete"],
+            "elapsed_ms": analysis["elapsed_ms"],
+            "articulation_points": [describe(p) for p in analysis["articulation_points"]],
+            "bridges": [{"from": describe(a), "to": describe(b), "dependent_pairs": pairs}
+                        for a, b, pairs in analysis["bridges"]],
+            "top_betweenness": [dict(describe(p), score=score) for p, score in ranked[:20]]
+        }
+
+        if analysis["version"] != self._topology_published_version:
+            self.publish_topology_sensor(topology)
+            self._topology_published_version = analysis["version"]
+        return topology
+
+    def publish_topology_sensor(self, topology):
+        try:
+            self.set_state(
+                "sensor.meshcore_topology",
+                state=str(len(topology["articulation_points"])),
+                attributes={
+                    "friendly_name": "MeshCore Topology Cut Vertices",
+                    "node_count": topology["node_count"],
+                    "edge_count": topology["edge_count"],
+                    "components": topology["components"],
+                    "cut_vertices": [n["name"] for n in topology["articulation_points"]][:20],
+                    "bridge_count": len(topology["bridges"]),
+                    "critical_links": [f"{b['from']['name']} ↔ {b['to']['name']} ({b['dependent_pairs']} pairs)"
+                                       for b in topology["bridges"][:10]],
+                    "top_betweenness": [f"{n['name']}: {n['score']}" for n in topology["top_betweenness"][:10]],
+                    "complete": topology["complete"],
+                    "elapsed_ms": topology["elapsed_ms"],
+                    "icon": "mdi:graph-outline",
+                    "last_updated": datetime.now().isoformat()
+                }
+            )
+        except Exception as e:
+            self.log(f"Error publishing topology sensor: {e}", level="ERROR")
+
+    # -------------------------------------------------------------------------
+    # Route queries
+    # -------------------------------------------------------------------------
+
+    def resolve_route_node(self, query):
+        """Map a node name, pubkey or path prefix to a graph node"""
+        if not query:
+            return None
+        key = str(query).strip().lower()
+        if key in self.graph.index:
+            return key
+
+        # Full pubkey or longer prefix - pick the longest matching path prefix
+        matches = [p for p in self.graph.index if key.startswith(p)]
+        if matches:
+            return max(matches, key=len)
+
+        for prefix, info in self.node_infos.items():
+            if info and info["name"].lower() == key:
+                return prefix
+        return None
+
+    def query_route(self, source, target, mode="shortest"):
+        """Answer 'how would a message from source reach target'"""
+        if mode not in LinkGraph.ROUTE_MODES:
+            mode = "shortest"
+        result = {"source": source, "target": target, "mode": mode,
+                  "found": False, "graph_version": self.graph.version}
+
+        source_prefix = self.resolve_route_node(source)
+        target_prefix = self.resolve_route_node(target)
+        if not source_prefix or not target_prefix:
+            result["error"] = "unknown source" if not source_prefix else "unknown target"
+            return result
+
+        route = self.graph.route(source_prefix, target_prefix, mode)
+        result["cache"] = dict(self.graph.route_stats)
+        if not route:
+            return result
+
+        path = []
+        for prefix in route["path"]:
+            info = self.node_infos.get(prefix) or {}
+            path.append({"prefix": prefix,
+                         "name": info.get("name", prefix),
+                         "pubkey": info.get("pubkey", prefix),
+                         "lat": info.get("lat"),
+                         "lon": info.get("lon")})
+        result.update({
+            "found": True,
+            "hops": route["hops"],
+            "cost": route["cost"],
+            "path": path
+        })
+        if mode == "reliable":
+            result["reliability"] = round(math.exp(-route["cost"]), 4)
+        return result
+
+    def api_route(self, data, kwargs):
+        """AppDaemon endpoint: /api/appdaemon/meshcore_route?source=..&target=..&mode=.."""
+        try:
+            data = data or {}
+            result = self.query_route(data.get("source"), data.get("target"), data.get("mode", "shortest"))
+            return result, 200 if "error" not in result else 404
+        except Exception as e:
+            self.log(f"Error answering route query: {e}", level="ERROR")
+            return {"error": str(e)}, 500
+
+    def handle_route_query(self, event_name, data, kwargs):
+        """Answer a meshcore_route_query event with a meshcore_route_result event"""
+        try:
+            result = self.query_route(data.get("source"), data.get("target"), data.get("mode", "shortest"))
+            self.fire_event("meshcore_route_result", **result)
+            if result["found"]:
+                self.log(f"Route {data.get('source')} → {data.get('target')}: "
+                         f"{' → '.join(n['name'] for n in result['path'])}")
+        except Exception as e:
+            self.log(f"Error handling route query: {e}", level="ERROR")
 
     # -------------------------------------------------------------------------
     # Export
@@ -150,51 +385,27 @@ class MeshCoreDirectLinksExport(hass.Hass):
         except Exception:
             return 168.0 * 3600  # 7 days default
 
-    def get_node_info(self, pubkey_prefix, all_states):
-        """Get node coordinates and info from contact sensors"""
-        matches = []
-        for entity_id, state_data in all_states.items():
-            if not (entity_id.startswith("binary_sensor.meshcore_") and "_contact" in entity_id):
-                continue
-            attrs = (state_data or {}).get("attributes", {})
-            pubkey = attrs.get("pubkey_prefix", "").lower()
-            if not pubkey or not pubkey.startswith(pubkey_prefix):
-                continue
-            lat = attrs.get("adv_lat") or attrs.get("latitude")
-            lon = attrs.get("adv_lon") or attrs.get("longitude")
-            if not lat or not lon:
-                continue
-            name = attrs.get("adv_name") or attrs.get("friendly_name", "").replace(" Contact", "")
-            node_type = attrs.get("node_type_str", "Unknown").lower()
-            last_advert = attrs.get("last_advert", 0) or 0
-            matches.append({"name": name, "lat": float(lat), "lon": float(lon),
-                            "pubkey": pubkey, "node_type": node_type, "last_advert": last_advert})
-
-        if not matches:
-            return None
-        if len(matches) == 1:
-            return matches[0]
-
-        repeaters = [m for m in matches if "repeater" in m["node_type"]]
-        if repeaters:
-            repeaters.sort(key=lambda x: x["last_advert"], reverse=True)
-            return repeaters[0]
-
-        matches.sort(key=lambda x: x["last_advert"], reverse=True)
-        return matches[0]
-
     def export_directlinks_data(self, *args, **kwargs):
         """Export direct links data to JSON file"""
         try:
-            all_states = self.get_state()
+            if not self.contacts.maintained_by:
+                self.contacts.update(self.get_state())
             now_ts = time.time()
             threshold_sec = self.get_threshold_seconds()
 
             node_data = {}
             link_data = []
 
+            # Resolve each prefix once per export
+            node_infos = {}
+
+            def node_info(prefix):
+                if prefix not in node_infos:
+                    node_infos[prefix] = self.contacts.resolve(prefix)
+                return node_infos[prefix]
+
             for node_a_prefix, connections in self.direct_links.items():
-                node_a_info = self.get_node_info(node_a_prefix, all_states)
+                node_a_info = node_info(node_a_prefix)
                 if not node_a_info:
                     continue
 
@@ -202,8 +413,10 @@ class MeshCoreDirectLinksExport(hass.Hass):
                     if (now_ts - link_info.get("last_seen", 0)) > threshold_sec:
                         continue
 
-                    node_b_info = self.get_node_info(node_b_prefix, all_states)
-                    if not node_b_info:
+                    # Resolve both ends together so colliding prefixes use the link itself
+                    node_a_info, node_b_info = self.contacts.resolve_path(
+                        [node_a_prefix, node_b_prefix], learn=False)
+                    if not node_a_info or not node_b_info:
                         continue
 
                     if node_a_info["pubkey"] not in node_data:
@@ -211,7 +424,7 @@ class MeshCoreDirectLinksExport(hass.Hass):
                             "name": node_a_info["name"],
                             "lat": node_a_info["lat"],
                             "lon": node_a_info["lon"],
-                            "node_type": node_a_info["node_type"],
+                            "node_type": node_a_info["node_type"].lower(),
                             "link_count": 0
                         }
                     node_data[node_a_info["pubkey"]]["link_count"] += 1
@@ -221,6 +434,7 @@ class MeshCoreDirectLinksExport(hass.Hass):
                     for existing in link_data:
                         if tuple(sorted([existing["from_pubkey"], existing["to_pubkey"]])) == link_key:
                             existing["count"] = max(existing["count"], link_info.get("count", 1))
+                            existing["last_seen"] = max(existing["last_seen"], link_info.get("last_seen", 0))
                             link_exists = True
                             break
 
@@ -234,13 +448,24 @@ class MeshCoreDirectLinksExport(hass.Hass):
                             "to_name": node_b_info["name"],
                             "to_lat": node_b_info["lat"],
                             "to_lon": node_b_info["lon"],
-                            "count": link_info.get("count", 1)
+                            "count": link_info.get("count", 1),
+                            "last_seen": link_info.get("last_seen", 0)
                         })
 
+            # Link lengths for all links in one pass
+            lengths = meshcore_geo.haversine_many(
+                [l["from_lat"] for l in link_data], [l["from_lon"] for l in link_data],
+                [l["to_lat"] for l in link_data], [l["to_lon"] for l in link_data])
+            implausible = 0
+            for link, km in zip(link_data, lengths):
+                link["distance_km"] = round(km, 2)
+                link["implausible"] = km > self.max_link_km
+                implausible += link["implausible"]
+
             nodes_list = sorted(
-                [{"name": v["name"], "lat": v["lat"], "lon": v["lon"],
+                [{"name": v["name"], "pubkey": pubkey, "lat": v["lat"], "lon": v["lon"],
                   "node_type": v["node_type"], "link_count": v["link_count"]}
-                 for v in node_data.values()],
+                 for pubkey, v in node_data.items()],
                 key=lambda x: x["link_count"], reverse=True
             )
 
@@ -249,19 +474,30 @@ class MeshCoreDirectLinksExport(hass.Hass):
             except Exception:
                 threshold_hours = 168.0
 
+            # Every graph node gets resolved for route naming
+            for prefix in self.graph.index:
+                node_info(prefix)
+            self.node_infos = node_infos
+
+            topology = self.analyse_topology(node_info)
+
             output_path = "/homeassistant/www/meshcore_directlinks_data.json"
             with open(output_path, 'w') as f:
                 json.dump({
                     "threshold_hours": threshold_hours,
                     "node_count": len(nodes_list),
                     "link_count": len(link_data),
+                    "implausible_link_count": implausible,
+                    "max_link_km": self.max_link_km,
                     "updated": time.time(),
                     "nodes": nodes_list,
-                    "links": link_data
+                    "links": link_data,
+                    "topology": topology
                 }, f, indent=2)
 
             self.save_persisted_data()
-            self.log(f"Exported {len(nodes_list)} nodes, {len(link_data)} direct links (threshold: {threshold_hours}h)")
+            self.log(f"Exported {len(nodes_list)} nodes, {len(link_data)} direct links "
+                     f"({implausible} implausible, threshold: {threshold_hours}h)")
 
         except Exception as e:
             self.log(f"Error exporting direct links data: {e}", level="ERROR")
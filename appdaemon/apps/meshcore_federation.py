@@ -0,0 +1,160 @@
+import appdaemon.plugins.hass.hassapi as hass
+import json
+import os
+import re
+import time
+import urllib.error
+import urllib.request
+import meshcore_geo
+import meshcore_merge
+import meshcore_startup
+
+# Export name -> file written by this instance's exporters (and fetched from others)
+EXPORT_FILES = {
+    "heatmap": "meshcore_heatmap_data.json",
+    "directlinks": "meshcore_directlinks_data.json",
+    "nodemap": "meshcore_nodemap_data.json"
+}
+
+FEDERATED_PREFIX = "meshcore_federated_"
+DEFAULT_FEDERATION_DIR = "/homeassistant/meshcore_federation"
+WWW_DIR = "/homeassistant/www"
+
+
+class MeshCoreFederation(hass.Hass):
+    """
+    Merges the heatmap, direct links and node map exports of several panel
+    instances into one dataset per map.
+    Other sites' exports are fetched from their /local/ URLs (sources arg) or
+    dropped into federation_dir/<site>/. Only sources whose files changed are
+    re-read, and a combined file is only rewritten when one of its inputs did.
+    Writes to /config/www/meshcore_federated_*_data.json
+    """
+
+    def initialize(self):
+        self.log("MeshCoreFederation initialized")
+
+        self.federation_dir = self.args.get("federation_dir", DEFAULT_FEDERATION_DIR)
+        self.site_name = self.args.get("site_name", "local")
+        self.include_local = self.args.get("include_local", True)
+        self.sources = self.args.get("sources", [])  # [{name, url}] - url of the other instance's /local/
+        self.fetch_timeout = float(self.args.get("fetch_timeout", 10))
+        self.max_link_km = float(self.args.get("max_link_km", meshcore_geo.MAX_PLAUSIBLE_LINK_KM))
+
+        # (site, export) -> {"version": (mtime_ns, size), "data": parsed export}
+        self.source_cache = {}
+
+        # site -> export -> {"etag", "last_modified"} from the last fetch
+        self.fetch_validators = {}
+
+        # Merge after the local exports have run, then every federation_interval seconds
+        interval = int(self.args.get("federation_interval", 300))
+        first_merge = 60 + meshcore_startup.startup_offset(self.name)
+        self.run_in(self.update_federation, first_merge)
+        self.run_every(self.update_federation, f"now+{first_merge + interval}", interval)
+
+    # -------------------------------------------------------------------------
+    # Sources
+    # -------------------------------------------------------------------------
+
+    def site_files(self):
+        """(site, export) -> path of every export to merge"""
+        files = {}
+        if self.include_local:
+            for export, filename in EXPORT_FILES.items():
+                files[(self.site_name, export)] = os.path.join(WWW_DIR, filename)
+        if os.path.isdir(self.federation_dir):
+            for site in sorted(os.listdir(self.federation_dir)):
+                site_dir = os.path.join(self.federation_dir, site)
+                if not os.path.isdir(site_dir):
+                    continue
+                for export, filename in EXPORT_FILES.items():
+                    files[(site, export)] = os.path.join(site_dir, filename)
+        return {key: path for key, path in files.items() if os.path.exists(path)}
+
+    def fetch_sources(self):
+        """Download the other sites' exports into federation_dir (conditional GETs)"""
+        for source in self.sources:
+            name = source.get("name")
+            url = (source.get("url") or "").rstrip("/")
+            if not name or not url:
+                continue
+            site = re.sub(r"[^a-zA-Z0-9_-]", "_", str(name))
+            site_dir = os.path.join(self.federation_dir, site)
+            validators = self.fetch_validators.setdefault(site, {})
+            for export, filename in EXPORT_FILES.items():
+                try:
+                    self.fetch_export(f"{url}/{filename}", os.path.join(site_dir, filename),
+                                      validators.setdefault(export, {}))
+                except Exception as e:
+                    self.log(f"Error fetching {export} from {name}: {e}", level="WARNING")
+
+    def fetch_export(self, url, path, validator):
+        headers = {}
+        if validator.get("etag"):
+            headers["If-None-Match"] = validator["etag"]
+        if validator.get("last_modified"):
+            headers["If-Modified-Since"] = validator["last_modified"]
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers),
+                                        timeout=self.fetch_timeout) as response:
+                body = response.read()
+                validator["etag"] = response.headers.get("ETag")
+                validator["last_modified"] = response.headers.get("Last-Modified")
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return False
+            raise
+
+        json.loads(body)  # don't replace a good copy with a broken one
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        return True
+
+    def refresh_sources(self):
+        """Re-read changed source files; returns the exports with changed inputs"""
+        changed, errors = meshcore_merge.refresh_sources(self.source_cache, self.site_files())
+        for (site, export), e in errors:
+            self.log(f"Skipping {site} {export} export: {e}", level="WARNING")
+        return changed
+
+    # -------------------------------------------------------------------------
+    # Merge
+    # -------------------------------------------------------------------------
+
+    def update_federation(self, kwargs=None):
+        try:
+            if self.sources:
+                self.fetch_sources()
+            changed = self.refresh_sources()
+            if not changed:
+                self.log("Federation: no source changed", level="DEBUG")
+                return
+
+            now = time.time()
+            for export in sorted(changed):
+                datasets = {site: entry["data"] for (site, name), entry in sorted(self.source_cache.items())
+                            if name == export}
+                if export == "heatmap":
+                    output = meshcore_merge.merge_heatmap(datasets)
+                elif export == "nodemap":
+                    output = meshcore_merge.merge_nodemap(datasets, now)
+                else:
+                    output = meshcore_merge.merge_directlinks(datasets, self.max_link_km)
+                output["sites"] = sorted(datasets)
+                output["updated"] = now
+                self.write_output(export, output)
+                self.log(f"Federated {export}: {output['node_count']} nodes from {len(datasets)} sites")
+
+        except Exception as e:
+            self.log(f"Error updating federation: {e}", level="ERROR")
+
+    def write_output(self, export, output):
+        path = os.path.join(WWW_DIR, FEDERATED_PREFIX + EXPORT_FILES[export][len("meshcore_"):])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(output, f, indent=2)
+        os.replace(tmp_path, path)
@@ -0,0 +1,66 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional - add it to the AppDaemon add-on's python_packages
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Longest plausible direct LoRa link; anything longer is most likely a
+# prefix collision resolved to the wrong node
+MAX_PLAUSIBLE_LINK_KM = 100.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in km"""
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_many(lats1, lons1, lats2, lons2):
+    """Element-wise great-circle distances in km for equal-length coordinate lists"""
+    if not lats1:
+        return []
+    if np is None:
+        return [haversine_km(a, b, c, d) for a, b, c, d in zip(lats1, lons1, lats2, lons2)]
+
+    p1 = np.radians(np.asarray(lats1, dtype=np.float64))
+    p2 = np.radians(np.asarray(lats2, dtype=np.float64))
+    dl = np.radians(np.asarray(lons2, dtype=np.float64) - np.asarray(lons1, dtype=np.float64))
+    a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).tolist()
+
+
+def distances_from(lat, lon, lats, lons):
+    """Distances in km from one point to each point in lats/lons"""
+    return haversine_many([lat] * len(lats), [lon] * len(lons), lats, lons)
+
+
+def segment_lengths(coords_list):
+    """
+    Segment lengths for many polylines in one pass.
+    coords_list is a list of polylines, each a list of {"lat", "lon"} dicts.
+    Returns a list of per-polyline segment length lists (km).
+    """
+    lats1, lons1, lats2, lons2, sizes = [], [], [], [], []
+    for coords in coords_list:
+        sizes.append(max(len(coords) - 1, 0))
+        for a, b in zip(coords, coords[1:]):
+            lats1.append(a["lat"])
+            lons1.append(a["lon"])
+            lats2.append(b["lat"])
+            lons2.append(b["lon"])
+
+    flat = haversine_many(lats1, lons1, lats2, lons2)
+    result = []
+    pos = 0
+    for size in sizes:
+        result.append(flat[pos:pos + size])
+        pos += size
+    return result
+
@@ -0,0 +1,312 @@
+import heapq
+import math
+import random
+import time
+from array import array
+from collections import OrderedDict
+
+
+class LinkGraph:
+    """
+    Undirected direct-link graph over node prefixes.
+    Nodes are integer-indexed and adjacency is kept in compact int arrays so
+    edges can be added incrementally as links are recorded. Topology analysis
+    is cached and only recomputed when an edge is added or removed.
+    """
+
+    ROUTE_MODES = ("shortest", "reliable")
+    COUNT_WEIGHTED_MODES = ("reliable",)  # modes whose edge cost depends on the link count
+
+    def __init__(self, route_cache_size=64):
+        self.index = {}       # prefix -> node id
+        self.nodes = []       # node id -> prefix
+        self.adjacency = []   # node id -> array('i') of neighbour ids
+        self.weights = {}     # (low id, high id) -> link count
+        self.version = 0      # bumped when an edge is added/removed
+        self._analysis = None
+
+        # Route cache: (source id, mode) -> shortest path tree {dist, prev}
+        # Trees are invalidated individually when an edge change affects them
+        self.route_cache_size = route_cache_size
+        self._route_trees = OrderedDict()
+        self.route_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    # -------------------------------------------------------------------------
+    # Building
+    # -------------------------------------------------------------------------
+
+    def node_id(self, prefix):
+        node = self.index.get(prefix)
+        if node is None:
+            node = len(self.nodes)
+            self.index[prefix] = node
+            self.nodes.append(prefix)
+            self.adjacency.append(array('i'))
+        return node
+
+    def add_edge(self, prefix_a, prefix_b, count=1):
+        """Add or update an edge; returns True if the topology changed"""
+        if prefix_a == prefix_b:
+            return False
+        a = self.node_id(prefix_a)
+        b = self.node_id(prefix_b)
+        key = (a, b) if a < b else (b, a)
+        if key in self.weights:
+            if count > self.weights[key]:
+                self.weights[key] = count
+                self._invalidate_routes(a, b, topology_changed=False)
+            return False
+        self.weights[key] = count
+        self.adjacency[a].append(b)
+        self.adjacency[b].append(a)
+        self.version += 1
+        self._invalidate_routes(a, b)
+        return True
+
+    def load_links(self, direct_links):
+        """Rebuild from a direct_links dict (prefix -> {prefix: {count, last_seen}})"""
+        self.index = {}
+        self.nodes = []
+        self.adjacency = []
+        self.weights = {}
+        for node_a, connections in direct_links.items():
+            for node_b, link_info in connections.items():
+                self.add_edge(node_a, node_b, link_info.get("count", 1))
+        self.version += 1
+        self._route_trees.clear()
+
+    def edge_count(self):
+        return len(self.weights)
+
+    def weight(self, prefix_a, prefix_b):
+        a = self.index.get(prefix_a)
+        b = self.index.get(prefix_b)
+        if a is None or b is None:
+            return 0
+        return self.weights.get((a, b) if a < b else (b, a), 0)
+
+    # -------------------------------------------------------------------------
+    # Analysis
+    # -------------------------------------------------------------------------
+
+    def analyse(self, time_budget=2.0):
+        """
+        Articulation points, bridges and betweenness centrality.
+        Cached per graph version. Betweenness is sampled over shuffled sources
+        and extrapolated if the time budget runs out (complete=False).
+        """
+        if self._analysis is not None and self._analysis["version"] == self.version:
+            return self._analysis
+
+        started = time.monotonic()
+        cut_vertices, bridges, components = self._articulation_points()
+        betweenness, complete = self._betweenness(started + time_budget)
+
+        self._analysis = {
+            "version": self.version,
+            "node_count": sum(1 for adj in self.adjacency if adj),
+            "edge_count": len(self.weights),
+            "components": components,
+            "articulation_points": sorted(self.nodes[v] for v in cut_vertices),
+            # (prefix_a, prefix_b, node pairs that depend on this link)
+            "bridges": sorted(((self.nodes[u], self.nodes[v], pairs) for u, v, pairs in bridges),
+                              key=lambda b: b[2], reverse=True),
+            "betweenness": {self.nodes[v]: score for v, score in enumerate(betweenness) if score > 0},
+            "complete": complete,
+            "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+            "computed_at": time.time()
+        }
+        return self._analysis
+
+    def _articulation_points(self):
+        """Iterative Tarjan DFS: cut vertices, bridges (with dependent pair counts), components"""
+        n = len(self.nodes)
+        adjacency = self.adjacency
+        disc = [-1] * n
+        low = [0] * n
+        size = [1] * n
+        cut_vertices = set()
+        bridges = []
+        components = 0
+        timer = 0
+
+        for root in range(n):
+            if disc[root] != -1 or not adjacency[root]:
+                continue
+            components += 1
+            disc[root] = low[root] = timer
+            timer += 1
+            root_children = 0
+            component_bridges = []
+            stack = [(root, -1, iter(adjacency[root]))]
+
+            while stack:
+                v, parent, neighbours = stack[-1]
+                descended = False
+                for w in neighbours:
+                    if disc[w] == -1:
+                        disc[w] = low[w] = timer
+                        timer += 1
+                        if v == root:
+                            root_children += 1
+                        stack.append((w, v, iter(adjacency[w])))
+                        descended = True
+                        break
+                    if w != parent and disc[w] < low[v]:
+                        low[v] = disc[w]
+                if descended:
+                    continue
+
+                stack.pop()
+                if not stack:
+                    break
+                u = stack[-1][0]
+                if low[v] < low[u]:
+                    low[u] = low[v]
+                size[u] += size[v]
+                if u != root and low[v] >= disc[u]:
+                    cut_vertices.add(u)
+                if low[v] > disc[u]:
+                    component_bridges.append((u, v))
+
+            if root_children > 1:
+                cut_vertices.add(root)
+            component_size = size[root]
+            for u, v in component_bridges:
+                bridges.append((u, v, size[v] * (component_size - size[v])))
+
+        return cut_vertices, bridges, components
+
+    def _betweenness(self, deadline):
+        """Brandes betweenness (unweighted), normalized to 0..1"""
+        n = len(self.nodes)
+        adjacency = self.adjacency
+        scores = [0.0] * n
+        sources = [v for v in range(n) if adjacency[v]]
+        random.shuffle(sources)
+        processed = 0
+
+        for s in sources:
+            if time.monotonic() > deadline:
+                break
+            order = []
+            preds = {s: []}
+            sigma = {s: 1}
+            dist = {s: 0}
+            queue = [s]
+            head = 0
+            while head < len(queue):
+                v = queue[head]
+                head += 1
+                order.append(v)
+                for w in adjacency[v]:
+                    if w not in dist:
+                        dist[w] = dist[v] + 1
+                        sigma[w] = 0
+                        preds[w] = []
+                        queue.append(w)
+                    if dist[w] == dist[v] + 1:
+                        sigma[w] += sigma[v]
+                        preds[w].append(v)
+            delta = dict.fromkeys(order, 0.0)
+            for w in reversed(order):
+                for v in preds[w]:
+                    delta[v] += sigma[v] / sigma[w] * (1 + delta[w])
+                if w != s:
+                    scores[w] += delta[w]
+            processed += 1
+
+        active = len(sources)
+        complete = processed == active
+        if processed and active > 2:
+            # Undirected pairs counted twice; extrapolate sampled sources
+            scale = (active / processed) / ((active - 1) * (active - 2))
+            scores = [round(score * scale, 4) for score in scores]
+        else:
+            scores = [0.0] * n
+        return scores, complete
+
+    # -------------------------------------------------------------------------
+    # Routing
+    # -------------------------------------------------------------------------
+
+    def edge_cost(self, count, mode):
+        """Edge cost: 1 per hop, or -log(reliability) with reliability = count / (count + 1)"""
+        if mode == "reliable":
+            return math.log1p(1.0 / max(count, 1))
+        return 1.0
+
+    def route(self, prefix_a, prefix_b, mode="shortest"):
+        """Best route between two prefixes: {path, hops, cost} or None"""
+        source = self.index.get(prefix_a)
+        target = self.index.get(prefix_b)
+        if source is None or target is None:
+            return None
+
+        key = (source, mode)
+        tree = self._route_trees.get(key)
+        if tree is not None:
+            self._route_trees.move_to_end(key)
+            self.route_stats["hits"] += 1
+        else:
+            self.route_stats["misses"] += 1
+            tree = self._dijkstra(source, mode)
+            self._route_trees[key] = tree
+            while len(self._route_trees) > self.route_cache_size:
+                self._route_trees.popitem(last=False)
+
+        if target not in tree["dist"]:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(tree["prev"][path[-1]])
+        path.reverse()
+        return {"path": [self.nodes[v] for v in path],
+                "hops": len(path) - 1,
+                "cost": round(tree["dist"][target], 4)}
+
+    def cached_routes(self):
+        return len(self._route_trees)
+
+    def _dijkstra(self, source, mode):
+        dist = {source: 0.0}
+        prev = {}
+        heap = [(0.0, source)]
+        while heap:
+            d, v = heapq.heappop(heap)
+            if d > dist[v]:
+                continue
+            for w in self.adjacency[v]:
+                count = self.weights[(v, w) if v < w else (w, v)]
+                nd = d + self.edge_cost(count, mode)
+                if nd < dist.get(w, math.inf):
+                    dist[w] = nd
+                    prev[w] = v
+                    heapq.heappush(heap, (nd, w))
+        return {"dist": dist, "prev": prev}
+
+    def _invalidate_routes(self, a, b, topology_changed=True):
+        """
+        Drop cached trees that a new/cheaper edge a-b could change. A count
+        change on an existing edge only affects modes weighted by count.
+        """
+        if not self._route_trees:
+            return
+        count = self.weights.get((a, b) if a < b else (b, a), 0)
+        stale = []
+        for key, tree in self._route_trees.items():
+            if not topology_changed and key[1] not in self.COUNT_WEIGHTED_MODES:
+                continue
+            prev = tree["prev"]
+            if prev.get(a) == b or prev.get(b) == a:
+                stale.append(key)
+                continue
+            cost = self.edge_cost(count, key[1])
+            dist = tree["dist"]
+            da = dist.get(a, math.inf)
+            db = dist.get(b, math.inf)
+            if da + cost < db or db + cost < da:
+                stale.append(key)
+        for key in stale:
+            del self._route_trees[key]
+        self.route_stats["invalidations"] += len(stale)
@@ -3,6 +3,7 @@ import json
 import os
 import time
 from datetime import datetime
+import meshcore_ingress
 
 class MeshCoreGreeter(hass.Hass):
     """
@@ -31,11 +32,14 @@ class MeshCoreGreeter(hass.Hass):
         # Your name for the greeting
         self.my_name = self.args.get("my_name", "MyRepeater")
         
+        # MeshCoreHops app name - hop counts are read from its in-memory data
+        self.hops_app_name = self.args.get("hops_app", "meshcore_hops")
+        
         # Listen for meshcore contact sensor changes only
         self.listen_state(self.handle_contact_change, "binary_sensor.meshcore_", attribute="all")
         
         # Also listen for meshcore events for first advertisement
-        self.listen_event(self.handle_new_contact_event, "meshcore_raw_event")
+        meshcore_ingress.listen_raw_events(self, self.handle_new_contact_event, ("EventType.NEW_CONTACT",))
         
         # Listen for test greeting event
         self.listen_event(self.handle_test_event, "meshcore_greeter_test")
@@ -171,7 +175,7 @@ class MeshCoreGreeter(hass.Hass):
         try:
             # Try pubkey-based sensor first
             sensor_id = f"sensor.meshcore_hops_{pubkey}"
-            state = self.get_state(sensor_id)
+            state = self.get_hops_state(sensor_id)
             
             if state and state not in ["unknown", "unavailable", None]:
                 try:
@@ -187,7 +191,7 @@ class MeshCoreGreeter(hass.Hass):
             safe_name = safe_name.strip('_')
             
             sensor_id = f"sensor.meshcore_hops_{safe_name}"
-            state = self.get_state(sensor_id)
+            state = self.get_hops_state(sensor_id)
             
             if state and state not in ["unknown", "unavailable", None]:
                 try:
@@ -201,6 +205,17 @@ class MeshCoreGreeter(hass.Hass):
             self.log(f"Error getting hop count: {e}", level="WARNING")
             return None
     
+    def get_hops_state(self, sensor_id):
+        """Get hops sensor state from MeshCoreHops memory, falling back to HA"""
+        try:
+            hops_app = self.get_app(self.hops_app_name)
+        except Exception:
+            hops_app = None
+        if hops_app is None:
+            return self.get_state(sensor_id)
+        sensor_data = hops_app.get_hops_sensor(sensor_id)
+        return str(sensor_data.get("state")) if sensor_data else None
+    
     def send_greeting(self, name, pubkey, hops):
         """Send welcome message on Public channel and notify HA"""
         try:
@@ -1,6 +1,9 @@
 import appdaemon.plugins.hass.hassapi as hass
 import json
 import time
+import meshcore_geo
+import meshcore_contacts
+import meshcore_startup
 
 class MeshCoreHeatmapExport(hass.Hass):
     """
@@ -11,11 +14,23 @@ class MeshCoreHeatmapExport(hass.Hass):
     def initialize(self):
         self.log("MeshCoreHeatmapExport initialized")
         
-        # Export on startup
-        self.run_in(self.export_heatmap_data, 10)
+        # Source apps - hop nodes and paths are read from their in-memory data
+        # (works in aggregate entity mode), falling back to HA entities
+        self.paths_app_name = self.args.get("paths_app", "meshcore_paths")
+        self.hops_app_name = self.args.get("hops_app", "meshcore_hops")
+        
+        # Path segments longer than this are flagged as implausible
+        self.max_link_km = float(self.args.get("max_link_km", meshcore_geo.MAX_PLAUSIBLE_LINK_KM))
+        
+        # Path hash -> contact resolution, shared with the path map
+        self.contacts = meshcore_contacts.shared_index()
+        
+        # Export on startup - after the entity restore, staggered against the other exports
+        first_export = 30 + meshcore_startup.startup_offset(self.name)
+        self.run_in(self.export_heatmap_data, first_export)
         
         # Export every 5 minutes
-        self.run_every(self.export_heatmap_data, "now+60", 300)
+        self.run_every(self.export_heatmap_data, f"now+{first_export + 300}", 300)
         
         # Export when hop entities sensor updates
         self.listen_state(self.export_heatmap_data, "sensor.meshcore_hop_entities")
@@ -31,6 +46,45 @@ class MeshCoreHeatmapExport(hass.Hass):
             threshold_hours = 168.0  # Default 7 days
         return threshold_hours * 3600
 
+    def get_source_app(self, name):
+        """Return a running app by name, or None"""
+        try:
+            return self.get_app(name)
+        except Exception:
+            return None
+
+    def get_hop_node_attributes(self, all_states):
+        """Hop node attributes from MeshCorePathMap memory or device_tracker entities"""
+        paths_app = self.get_source_app(self.paths_app_name)
+        if paths_app is None:
+            return [(state_data or {}).get("attributes", {}) for entity_id, state_data in all_states.items()
+                    if entity_id.startswith("device_tracker.meshcore_hop_")]
+        
+        hop_attrs = []
+        now_ts = time.time()
+        for pubkey, data in list(paths_app.hop_nodes_used.items()):
+            coords = data.get("coords", {})
+            hop_attrs.append({
+                "latitude": coords.get("lat"),
+                "longitude": coords.get("lon"),
+                "node_name": paths_app._normalize_display_name(coords.get("name", "Unknown")),
+                "pubkey": coords.get("pubkey") or pubkey,
+                "use_count": data.get("use_count", 0),
+                "recent_use_count": paths_app.recent_use_count(data, now_ts),
+                "activity": paths_app.activity(data, now_ts),
+                "last_used": data.get("last_used", 0),
+                "node_type": coords.get("node_type", "unknown")
+            })
+        return hop_attrs
+
+    def get_hops_sensor_attributes(self, all_states):
+        """Hops sensor attributes from MeshCoreHops memory or sensor.meshcore_hops_* entities"""
+        hops_app = self.get_source_app(self.hops_app_name)
+        if hops_app is None:
+            return [(state_data or {}).get("attributes", {}) for entity_id, state_data in all_states.items()
+                    if entity_id.startswith("sensor.meshcore_hops_")]
+        return [sensor_data.get("attributes", {}) for sensor_data in list(hops_app.hops_sensors_data.values())]
+
     def export_heatmap_data(self, *args, **kwargs):
         """Export hop node data to JSON file"""
         try:
@@ -42,74 +96,61 @@ class MeshCoreHeatmapExport(hass.Hass):
             threshold_sec = self.get_threshold_seconds()
             
             # Collect hop nodes
-            for entity_id, state_data in all_states.items():
-                if entity_id.startswith("device_tracker.meshcore_hop_"):
-                    attrs = state_data.get("attributes", {}) if state_data else {}
-                    
-                    lat = attrs.get("latitude")
-                    lon = attrs.get("longitude")
-                    name = attrs.get("node_name", "Unknown")
-                    use_count = attrs.get("use_count", 0)
-                    last_used = attrs.get("last_used", 0)
-                    node_type = attrs.get("node_type", "unknown")
-                    
-                    # Filter by threshold
-                    if not last_used or (now_ts - last_used) > threshold_sec:
-                        continue
-                    
-                    if lat and lon and use_count > 0:
-                        hop_data.append({
-                            "name": name,
-                            "lat": float(lat),
-                            "lon": float(lon),
-                            "use_count": int(use_count),
-                            "node_type": node_type.lower() if node_type else "unknown"
-                        })
-            
-            # Build pubkey prefix -> coords lookup from contact sensors
-            prefix_to_coords = {}
-            for entity_id, state_data in all_states.items():
-                if not (entity_id.startswith("binary_sensor.meshcore_") and "_contact" in entity_id):
+            for attrs in self.get_hop_node_attributes(all_states):
+                lat = attrs.get("latitude")
+                lon = attrs.get("longitude")
+                name = attrs.get("node_name", "Unknown")
+                use_count = attrs.get("use_count", 0)
+                last_used = attrs.get("last_used", 0)
+                node_type = attrs.get("node_type", "unknown")
+                
+                # Filter by threshold
+                if not last_used or (now_ts - last_used) > threshold_sec:
                     continue
-                attrs = state_data.get("attributes", {}) if state_data else {}
-                pubkey = attrs.get("pubkey_prefix", "").lower()
-                lat = attrs.get("adv_lat") or attrs.get("latitude")
-                lon = attrs.get("adv_lon") or attrs.get("longitude")
-                name = attrs.get("adv_name") or attrs.get("friendly_name", "").replace(" Contact", "")
-                if pubkey and lat is not None and lon is not None:
-                    for length in [2, 4, 6, 8, 10, 12, len(pubkey)]:
-                        if len(pubkey) >= length:
-                            short_key = pubkey[:length]
-                            if short_key not in prefix_to_coords:
-                                prefix_to_coords[short_key] = {
-                                    "lat": float(lat), "lon": float(lon), "name": name
-                                }
-
+                
+                if lat and lon and use_count > 0:
+                    hop_data.append({
+                        "name": name,
+                        "pubkey": (attrs.get("pubkey") or "").lower(),
+                        "lat": float(lat),
+                        "lon": float(lon),
+                        "use_count": int(use_count),
+                        "recent_use_count": int(attrs.get("recent_use_count", use_count)),
+                        "activity": round(float(attrs.get("activity", 0)), 3),
+                        "node_type": node_type.lower() if node_type else "unknown"
+                    })
+            
+            # Familiar paths resolve from the shared path cache. The path map keeps
+            # the contact table live; refresh it here only if the path map isn't running
+            if not self.contacts.maintained_by:
+                self.contacts.update(all_states)
+            origin = self.contacts.me()
+            
             # Collect recent paths from hops sensors
-            for entity_id, state_data in all_states.items():
-                if entity_id.startswith("sensor.meshcore_hops_"):
-                    attrs = state_data.get("attributes", {}) if state_data else {}
-                    
-                    last_message = attrs.get("last_message_time", 0)
-                    if not last_message or (now_ts - last_message) > threshold_sec:
-                        continue
-                    
-                    path_nodes = attrs.get("path_nodes", [])
-                    sender_name = attrs.get("sender_name", "Unknown")
+            for attrs in self.get_hops_sensor_attributes(all_states):
+                last_message = attrs.get("last_message_time", 0)
+                if not last_message or (now_ts - last_message) > threshold_sec:
+                    continue
+                
+                path_nodes = attrs.get("path_nodes", [])
+                sender_name = attrs.get("sender_name", "Unknown")
+                
+                if len(path_nodes) >= 2:
+                    path_coords = [{"lat": c["lat"], "lon": c["lon"], "name": c["name"]}
+                                   for c in self.contacts.resolve_path(path_nodes, origin=origin, learn=False) if c]
                     
-                    if len(path_nodes) >= 2:
-                        path_coords = []
-                        for node_prefix in path_nodes:
-                            coords = prefix_to_coords.get(node_prefix.lower())
-                            if coords:
-                                path_coords.append(coords)
-                        
-                        if len(path_coords) >= 2:
-                            path_data.append({
-                                "sender": sender_name,
-                                "coords": path_coords,
-                                "hops": len(path_coords)
-                            })
+                    if len(path_coords) >= 2:
+                        path_data.append({
+                            "sender": sender_name,
+                            "coords": path_coords,
+                            "hops": len(path_coords)
+                        })
+            
+            # Path lengths for all paths in one pass
+            for path, segments in zip(path_data, meshcore_geo.segment_lengths([p["coords"] for p in path_data])):
+                path["length_km"] = round(sum(segments), 2)
+                path["segments_km"] = [round(km, 2) for km in segments]
+                path["implausible"] = any(km > self.max_link_km for km in segments)
             
             # Sort by use_count descending
             hop_data.sort(key=lambda x: x["use_count"], reverse=True)
@@ -122,8 +163,11 @@ class MeshCoreHeatmapExport(hass.Hass):
             
             # Write to www folder with metadata
             output_path = "/homeassistant/www/meshcore_heatmap_data.json"
+            paths_app = self.get_source_app(self.paths_app_name)
             output_data = {
                 "threshold_hours": threshold_hours,
+                "recent_hours": paths_app.recent_hours if paths_app is not None else None,
+                "activity_half_life_hours": paths_app.activity_half_life_hours if paths_app is not None else None,
                 "node_count": len(hop_data),
                 "path_count": len(path_data),
                 "updated": time.time(),
@@ -133,7 +177,8 @@ class MeshCoreHeatmapExport(hass.Hass):
             with open(output_path, 'w') as f:
                 json.dump(output_data, f, indent=2)
             
-            self.log(f"Exported {len(hop_data)} hop nodes, {len(path_data)} paths to heatmap (threshold: {threshold_sec/3600}h)")
+            self.log(f"Exported {len(hop_data)} hop nodes, {len(path_data)} paths to heatmap (threshold: {threshold_sec/3600}h, "
+                     f"path cache hit rate: {self.contacts.cache_stats()['path_hit_rate']})")
             
         except Exception as e:
             self.log(f"Error exporting heatmap data: {e}", level="ERROR")
@@ -0,0 +1,494 @@
+import json
+import math
+import os
+import struct
+import time
+
+DEFAULT_HISTORY_DIR = "/homeassistant/www/meshcore_history"
+SEGMENT_SECONDS = 3600
+
+# Retention tiers: (dataset suffix, seconds per frame, default retention, segment seconds).
+# The first tier keeps every snapshot; each further tier holds one frame per
+# bucket, merged from the tier below.
+TIERS = (
+    ("", None, 24 * 3600, 3600),
+    ("_hourly", 3600, 30 * 86400, 86400),
+    ("_daily", 86400, 365 * 86400, 30 * 86400)
+)
+
+# Frame fields that only grow (lifetime counts, last-seen times) - a merged
+# frame keeps the highest value seen in its bucket
+MERGE_MAX_FIELDS = ("use_count", "link_count", "count", "last_used", "last_seen", "last_advert")
+
+
+def segment_file(dataset, segment_start):
+    return f"{dataset}_{segment_start}.ndjson"
+
+
+def index_file(dataset):
+    return f"{dataset}_index.json"
+
+
+def binary_file(dataset, segment_start):
+    return f"{dataset}_{segment_start}.bin"
+
+
+def downsample(frames, step):
+    """Keep the last frame of every step seconds (frames in time order)"""
+    if not step or step <= 0:
+        return frames
+    kept = {}
+    for frame in frames:
+        kept[int(frame["timestamp"] // step)] = frame
+    return list(kept.values())
+
+
+def _node_key(node):
+    return node.get("pubkey") or f"{node.get('name')}@{node.get('lat')},{node.get('lon')}"
+
+
+def _link_key(link):
+    return (link.get("from_name"), link.get("from_lat"), link.get("from_lon"),
+            link.get("to_name"), link.get("to_lat"), link.get("to_lon"))
+
+
+def _merge_items(items, newer, key):
+    merged = {key(item): item for item in items}
+    for item in newer:
+        k = key(item)
+        old = merged.get(k)
+        if old is None:
+            merged[k] = item
+            continue
+        merged[k] = dict(item, **{f: max(old.get(f) or 0, item.get(f) or 0) for f in MERGE_MAX_FIELDS if f in item})
+    return list(merged.values())
+
+
+def merge_frame(merged, frame, bucket):
+    """
+    Fold a frame into the downsampled frame of its bucket (None starts one).
+    Nodes and links are the union of the bucket's frames, so entries evicted
+    mid-bucket are kept; counts and times take their highest value. The frame
+    is stamped with the newest merged timestamp.
+    """
+    if merged is None:
+        return dict(frame, bucket=bucket, merged=1)
+    result = dict(frame, bucket=bucket, merged=merged.get("merged", 1) + 1)
+    result["nodes"] = _merge_items(merged.get("nodes", []), frame.get("nodes", []), _node_key)
+    if "links" in frame or "links" in merged:
+        result["links"] = _merge_items(merged.get("links", []), frame.get("links", []), _link_key)
+    return result
+
+
+# -----------------------------------------------------------------------------
+# Columnar binary segments
+# -----------------------------------------------------------------------------
+#
+# Optional companion of a segment's NDJSON file, read by the playback pages
+# with DataView. Little-endian throughout:
+#
+#   header  "MCH1", uint16 version, uint8 kind (0 heatmap, 1 direct links),
+#           uint8 reserved, uint32 base (segment start, unix seconds)
+#   node    uint8 1, uint16 id, uint16 length, UTF-8 JSON {name, lat, lon, node_type, pubkey}
+#   frame   uint8 2, float32 timestamp, uint16 node count n, uint16 link count m,
+#           n x uint16 node id, n x uint32 count, n x float32 last time,
+#           m x uint16 from id, m x uint16 to id, m x uint32 count, m x float32 last seen
+#
+# Each node is described once per segment, before the first frame using it.
+# Times are float32 seconds relative to base (NaN = unknown), which keeps
+# sub-second precision within a segment. Counts are use_count / link_count.
+
+BINARY_MAGIC = b"MCH1"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sHBBI")
+RECORD_NODE = 1
+RECORD_FRAME = 2
+KIND_HEATMAP = 0
+KIND_DIRECTLINKS = 1
+BINARY_MAX_ID = 0xFFFF  # node ids and per-frame node/link counts are uint16
+
+_NODE_FIELDS = ("name", "lat", "lon", "node_type", "pubkey")
+_KIND_FIELDS = {KIND_HEATMAP: ("use_count", "last_used"), KIND_DIRECTLINKS: ("link_count", "last_seen")}
+
+
+def _endpoint_key(item, prefix):
+    return f"{item.get(f'{prefix}name')}@{item.get(f'{prefix}lat')},{item.get(f'{prefix}lon')}"
+
+
+def _relative(value, base):
+    return value - base if value else math.nan
+
+
+def binary_header(kind, base):
+    return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, kind, 0, int(base))
+
+
+def encode_binary_frame(frame, kind, base, dictionary):
+    """
+    Records for one frame: node records for nodes not yet in the segment's
+    dictionary (key -> id, updated in place), then the frame record. Raises
+    OverflowError if the frame needs more than BINARY_MAX_ID nodes, links or
+    node ids; the dictionary may then be partly updated.
+    """
+    out = bytearray()
+
+    def node_id(key, node):
+        if key not in dictionary:
+            if len(dictionary) > BINARY_MAX_ID:
+                raise OverflowError(f"more than {BINARY_MAX_ID + 1} nodes in one binary segment")
+            dictionary[key] = len(dictionary)
+            entry = json.dumps({f: node.get(f) for f in _NODE_FIELDS}, separators=(",", ":")).encode()
+            out.extend(struct.pack("<BHH", RECORD_NODE, dictionary[key], len(entry)))
+            out.extend(entry)
+        return dictionary[key]
+
+    fields = _KIND_FIELDS.get(kind)
+    if fields is None:
+        raise ValueError(f"unknown binary frame kind {kind}")
+    count_field, time_field = fields
+    nodes = frame.get("nodes", [])
+    links = frame.get("links", []) if kind == KIND_DIRECTLINKS else []
+    if len(nodes) > BINARY_MAX_ID or len(links) > BINARY_MAX_ID:
+        raise OverflowError(f"more than {BINARY_MAX_ID} nodes or links in one frame")
+    ids = [node_id(_node_key(n), n) for n in nodes]
+    by_position = {_endpoint_key(n, ""): i for n, i in zip(nodes, ids)}
+
+    ends = []
+    for link in links:
+        for prefix in ("from_", "to_"):
+            key = _endpoint_key(link, prefix)
+            if key not in by_position:
+                by_position[key] = node_id(key, {f: link.get(f"{prefix}{f}") for f in _NODE_FIELDS})
+            ends.append(by_position[key])
+
+    n, m = len(nodes), len(links)
+    out.extend(struct.pack("<BfHH", RECORD_FRAME, frame["timestamp"] - base, n, m))
+    out.extend(struct.pack(f"<{n}H", *ids))
+    out.extend(struct.pack(f"<{n}I", *(int(x.get(count_field) or 0) for x in nodes)))
+    out.extend(struct.pack(f"<{n}f", *(_relative(x.get(time_field), base) for x in nodes)))
+    out.extend(struct.pack(f"<{m}H", *ends[0::2]))
+    out.extend(struct.pack(f"<{m}H", *ends[1::2]))
+    out.extend(struct.pack(f"<{m}I", *(int(x.get("count") or 0) for x in links)))
+    out.extend(struct.pack(f"<{m}f", *(_relative(x.get("last_seen"), base) for x in links)))
+    return bytes(out)
+
+
+def decode_binary_segment(data):
+    """(frames, dictionary key -> id) of a binary segment; a truncated last record is ignored"""
+    if len(data) < BINARY_HEADER.size:
+        return [], {}
+    magic, version, kind, _, base = BINARY_HEADER.unpack_from(data)
+    fields = _KIND_FIELDS.get(kind)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION or fields is None:
+        return [], {}
+    count_field, time_field = fields
+
+    def absolute(value):
+        return 0 if math.isnan(value) else base + value
+
+    nodes, dictionary, frames = {}, {}, []
+    pos = BINARY_HEADER.size
+    while pos < len(data):
+        record = data[pos]
+        if record == RECORD_NODE and pos + 5 <= len(data):
+            node, length = struct.unpack_from("<HH", data, pos + 1)
+            if pos + 5 + length > len(data):
+                break
+            nodes[node] = json.loads(data[pos + 5:pos + 5 + length])
+            dictionary[_node_key(nodes[node])] = node
+            pos += 5 + length
+        elif record == RECORD_FRAME and pos + 9 <= len(data):
+            ts, n, m = struct.unpack_from("<fHH", data, pos + 1)
+            if pos + 9 + n * 10 + m * 12 > len(data):
+                break
+            pos += 9
+            ids = struct.unpack_from(f"<{n}H", data, pos)
+            counts = struct.unpack_from(f"<{n}I", data, pos + n * 2)
+            times = struct.unpack_from(f"<{n}f", data, pos + n * 6)
+            pos += n * 10
+            from_ids = struct.unpack_from(f"<{m}H", data, pos)
+            to_ids = struct.unpack_from(f"<{m}H", data, pos + m * 2)
+            link_counts = struct.unpack_from(f"<{m}I", data, pos + m * 4)
+            link_times = struct.unpack_from(f"<{m}f", data, pos + m * 8)
+            pos += m * 12
+            frame = {
+                "timestamp": base + ts,
+                "nodes": [dict(nodes[i], **{count_field: c, time_field: absolute(t)})
+                          for i, c, t in zip(ids, counts, times)],
+                "threshold_hours": None
+            }
+            if kind == KIND_DIRECTLINKS:
+                frame["links"] = [dict({f"from_{f}": nodes[a].get(f) for f in ("name", "lat", "lon")},
+                                       **{f"to_{f}": nodes[b].get(f) for f in ("name", "lat", "lon")},
+                                       count=c, last_seen=absolute(t))
+                                  for a, b, c, t in zip(from_ids, to_ids, link_counts, link_times)]
+            else:
+                frame["paths"] = []
+            frames.append(frame)
+        else:
+            break
+    return frames, dictionary
+
+
+class SegmentStore:
+    """
+    Playback history of one dataset as hourly segment files plus an index.
+    Each segment is NDJSON (one frame per line) so a new frame is an append;
+    the index lists every segment's time range and frame count, so readers
+    only open the segments covering the range they show. Segments older than
+    retention seconds are deleted. With binary set, every segment also gets
+    a columnar .bin copy for the playback pages.
+    """
+
+    def __init__(self, directory, dataset, retention=24 * 3600, segment_seconds=SEGMENT_SECONDS, binary=False):
+        self.directory = directory
+        self.dataset = dataset
+        self.retention = retention
+        self.segment_seconds = segment_seconds
+        self.binary = binary
+        self.index_path = os.path.join(directory, index_file(dataset))
+        self.segments = []  # [{"start", "end", "first", "last", "count", "file", "bin"}], oldest first
+        self._last_frame = None
+        self._binary = None  # (segment start, bytes, key -> node id) of the binary segment being appended to
+
+    def load(self):
+        """Read the index; returns False if there is none yet"""
+        if not os.path.exists(self.index_path):
+            return False
+        with open(self.index_path, "r") as f:
+            self.segments = json.load(f).get("segments", [])
+        # Segments removed by hand are dropped from the index
+        self.segments = [s for s in self.segments if os.path.exists(os.path.join(self.directory, s["file"]))]
+        return True
+
+    def __len__(self):
+        return sum(s["count"] for s in self.segments)
+
+    def last_frame(self):
+        """The newest frame (read from the end of the current segment once)"""
+        if self._last_frame is None and self.segments:
+            frames = self._read_segment(self.segments[-1])
+            self._last_frame = frames[-1] if frames else None
+        return self._last_frame
+
+    def append(self, frame):
+        """Append a frame to its hourly segment and update the index"""
+        self._append(frame)
+        self.prune(frame["timestamp"])
+        self.write_index()
+
+    def extend(self, frames):
+        """Append several frames (in time order) with a single index write"""
+        for frame in frames:
+            self._append(frame)
+        if frames:
+            self.prune(frames[-1]["timestamp"])
+        self.write_index()
+
+    def _append(self, frame):
+        ts = frame["timestamp"]
+        segment_start = int(ts // self.segment_seconds) * self.segment_seconds
+        if not self.segments or self.segments[-1]["start"] != segment_start:
+            self.segments.append({
+                "start": segment_start,
+                "end": segment_start + self.segment_seconds,
+                "first": ts,
+                "last": ts,
+                "count": 0,
+                "file": segment_file(self.dataset, segment_start)
+            })
+        segment = self.segments[-1]
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, segment["file"]), "a") as f:
+            f.write(json.dumps(frame, separators=(",", ":")) + "\n")
+        if self.binary:
+            self._append_binary(segment, frame)
+        segment["last"] = ts
+        segment["count"] += 1
+        self._last_frame = frame
+
+    def _append_binary(self, segment, frame):
+        """
+        Append the frame to the segment's .bin, rewritten whole through a temp
+        file so a crash never leaves a torn record. A .bin missing earlier
+        frames of the segment (binary turned on mid-segment) is rebuilt from
+        the NDJSON first. A segment that outgrows the format's uint16 ids and
+        counts drops its .bin and stays NDJSON only.
+        """
+        if "bin" in segment and segment["bin"] is None:
+            return
+        path = os.path.join(self.directory, binary_file(self.dataset, segment["start"]))
+        frames = [frame]
+        if self._binary is None or self._binary[0] != segment["start"]:
+            data = b""
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+            decoded, dictionary = decode_binary_segment(data)
+            if len(decoded) == segment["count"]:
+                self._binary = (segment["start"], bytearray(data), dictionary)
+            else:
+                # The NDJSON already holds this frame, after the segment's count earlier ones
+                self._binary = (segment["start"], bytearray(), {})
+                frames = self._read_segment(segment)[:segment["count"]] + frames
+        _, data, dictionary = self._binary
+        try:
+            for item in frames:
+                kind = KIND_DIRECTLINKS if "links" in item else KIND_HEATMAP
+                record = encode_binary_frame(item, kind, segment["start"], dictionary)
+                if not data:
+                    data.extend(binary_header(kind, segment["start"]))
+                data.extend(record)
+        except (OverflowError, struct.error):
+            segment["bin"] = None
+            self._binary = None
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        segment["bin"] = os.path.basename(path)
+
+    def prune(self, now=None):
+        """Delete segments entirely older than the retention window"""
+        cutoff = (now or time.time()) - self.retention
+        while self.segments and self.segments[0]["end"] <= cutoff:
+            segment = self.segments.pop(0)
+            for name in (segment["file"], segment.get("bin")):
+                try:
+                    if name:
+                        os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def write_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "dataset": self.dataset,
+                "segment_seconds": self.segment_seconds,
+                "retention_seconds": self.retention,
+                "first": self.segments[0]["first"] if self.segments else None,
+                "last": self.segments[-1]["last"] if self.segments else None,
+                "count": len(self),
+                "segments": self.segments,
+                "updated": time.time()
+            }, f, separators=(",", ":"))
+        os.replace(tmp_path, self.index_path)
+
+    def _read_segment(self, segment):
+        frames = []
+        try:
+            with open(os.path.join(self.directory, segment["file"]), "r") as f:
+                for line in f:
+                    if line.strip():
+                        frames.append(json.loads(line))
+        except (OSError, ValueError):
+            pass
+        return frames
+
+    def frames(self, start=None, end=None, step=None):
+        """Frames with start <= timestamp <= end, at most one per step seconds"""
+        start = start if start is not None else float("-inf")
+        end = end if end is not None else float("inf")
+        frames = []
+        for segment in self.segments:
+            if segment["last"] < start or segment["first"] > end:
+                continue
+            frames.extend(f for f in self._read_segment(segment) if start <= f["timestamp"] <= end)
+        return downsample(frames, step)
+
+
+class TieredHistory:
+    """
+    A dataset's history in retention tiers (see TIERS), each a SegmentStore.
+    Snapshots go to the first tier. Every further tier keeps one merged frame
+    per bucket: the bucket being filled is held in memory and written once a
+    frame from the next bucket arrives, so downsampling is incremental. After
+    a restart the open buckets are rebuilt from the tier below.
+    """
+
+    def __init__(self, directory, dataset, retention=None, tiers=TIERS, binary=False):
+        retention = retention or {}
+        self.dataset = dataset
+        self.tiers = tiers
+        self.stores = [SegmentStore(directory, dataset + suffix, retention.get(suffix, default), segment_seconds, binary)
+                       for suffix, _, default, segment_seconds in tiers]
+        self.pending = [None] * len(tiers)
+
+    def load(self):
+        """Read every tier's index; returns False if the first tier has none yet"""
+        loaded = [store.load() for store in self.stores]
+        for store in self.stores:
+            store.prune()
+        for i in range(1, len(self.stores)):
+            if not loaded[i]:
+                # Tier added since the history was written - downsample everything below it
+                for frame in self.stores[i - 1].frames():
+                    self._cascade(i, frame)
+                break
+            last = self.stores[i - 1].last_frame()
+            if last is None:
+                continue
+            bucket = int(last["timestamp"] // self.tiers[i][1])
+            done = self.stores[i].last_frame()
+            if done is not None and done.get("bucket") == bucket:
+                continue
+            start = bucket * self.tiers[i][1]
+            for frame in self.stores[i - 1].frames(start):
+                self.pending[i] = merge_frame(self.pending[i], frame, bucket)
+        return loaded[0]
+
+    def __len__(self):
+        return len(self.stores[0])
+
+    def last_frame(self):
+        return self.stores[0].last_frame()
+
+    def append(self, frame):
+        self.stores[0].append(frame)
+        self._cascade(1, frame)
+
+    def extend(self, frames):
+        """Append several frames (in time order); the first tier's index is written once"""
+        self.stores[0].extend(frames)
+        for frame in frames:
+            self._cascade(1, frame)
+
+    def _cascade(self, i, frame):
+        if i >= len(self.stores):
+            return
+        bucket = int(frame["timestamp"] // self.tiers[i][1])
+        pending = self.pending[i]
+        if pending is not None and pending["bucket"] != bucket:
+            self.stores[i].append(pending)
+            self._cascade(i + 1, pending)
+            pending = None
+        self.pending[i] = merge_frame(pending, frame, bucket)
+
+    def tier_for(self, seconds):
+        """Finest tier whose retention covers a range of seconds"""
+        for i, store in enumerate(self.stores):
+            if seconds <= store.retention:
+                return i
+        return len(self.stores) - 1
+
+    def tier_for_range(self, start=None, end=None):
+        """
+        Tier for a query range. An open start means from the oldest retained
+        frame, so it picks the finest tier holding any frames.
+        """
+        if start is None:
+            return next((i for i, store in enumerate(self.stores) if store.segments), 0)
+        return self.tier_for((end if end is not None else time.time()) - start)
+
+    def frames(self, start=None, end=None, step=None, tier=None):
+        """Frames of a tier (picked from the range when not given), oldest first"""
+        if tier is None:
+            tier = self.tier_for_range(start, end)
+        return self.stores[tier].frames(start, end, step)
@@ -1,9 +1,15 @@
 import appdaemon.plugins.hass.hassapi as hass
 import time
 import json
-import re
 import os
 from datetime import datetime
+import meshcore_checkpoint
+import meshcore_derive
+import meshcore_ingress
+import meshcore_memory
+import meshcore_receivers
+import meshcore_receptions
+import meshcore_startup
 
 class MeshCoreHops(hass.Hass):
 
@@ -14,14 +20,19 @@ class MeshCoreHops(hass.Hass):
         self.persistence_file = "/homeassistant/www/meshcore_last_messages.json"
         self.sensors_persistence_file = "/homeassistant/www/meshcore_hops_sensors.json"
         
-        # Cache for correlating RX_LOG_DATA with subsequent message events
-        # Now stores LIST of receptions per message
-        self.rx_log_cache = {}
-        self.rx_log_cache_timeout = 10  # seconds (increased to catch all receptions)
+        # RX_LOG_DATA receptions are collected per message in the shared
+        # fingerprint cache, which hands over all receptions of a message at
+        # once after collection_window seconds (later ones follow in an update)
+        self.collector = meshcore_receptions.shared_collector(
+            self.args.get("fingerprint_ttl"), self.args.get("fingerprint_cache_size"))
+        self.collector.subscribe(self, self.handle_message_receptions, int(self.args.get("collection_window", 3)))
+
+        # Radios feeding meshcore_raw_event; with more than one, each reception
+        # in the hops sensors names the radio that heard it
+        self.receivers = meshcore_receivers.shared_receivers(self.args.get("receivers"), self.args.get("my_pubkey", ""))
         
         # Cache for sender name -> pubkey mapping
         self.name_to_pubkey_cache = {}
-        self.rebuild_name_cache()
         
         # Cache for last message times (pubkey -> timestamp)
         self.last_message_times = {}
@@ -29,18 +40,72 @@ class MeshCoreHops(hass.Hass):
         # Cache for full hops sensor data (sensor_id -> attributes)
         self.hops_sensors_data = {}
         
-        self.load_persisted_data()
+        # Hourly per-node signal rollups: node_key -> {name, buckets}
+        # buckets is a fixed-size ring of rollup_hours slots (one per hour)
+        self.rollups_persistence_file = "/homeassistant/www/meshcore_hops_rollups_persist.json"
+        self.rollups_export_file = "/homeassistant/www/meshcore_hops_rollups_data.json"
+        self.rollup_hours = int(self.args.get("rollup_hours", 168))  # 7 days
+        self.rollups = {}
+        
+        # Entity mode: "per_node" creates one sensor.meshcore_hops_* per sender,
+        # "aggregate" keeps per-node data in memory and publishes a summary
+        # sensor plus a JSON file; watchlisted senders still get their sensor
+        self.entity_mode = self.args.get("entity_mode", "per_node")
+        self.watchlist = {str(w).lower() for w in self.args.get("watchlist", [])}
+        self.nodes_export_file = "/homeassistant/www/meshcore_hops_nodes.json"
+        self._summary_timer = None
+        
+        # Attribute budget for sensor.meshcore_hops_* updates
+        # reception_detail: "attributes" keeps receptions on the sensor (capped),
+        # "store" keeps them only in this app's store / persistence file
+        self.max_receptions = int(self.args.get("max_receptions", 10))
+        self.message_text_length = int(self.args.get("message_text_length", 100))
+        self.compact_attributes = bool(self.args.get("compact_attributes", False))
+        self.reception_detail = self.args.get("reception_detail", "attributes")
+        self.reception_store = {}
+        self.attribute_stats = {"updates": 0, "total_bytes": 0, "last_bytes": 0, "max_bytes": 0}
+        
+        # Binary checkpoint of the caches above for fast warm starts; falls
+        # back to the JSON persistence files when missing or stale
+        self.checkpoint_enabled = bool(self.args.get("checkpoint", True))
+        self.checkpoint_file = meshcore_checkpoint.checkpoint_path(self.args.get("checkpoint_dir"), self.name)
+        # Restore is unlimited by default (the whole persistence window)
+        restore_max_age_hours = self.args.get("restore_max_age_hours")
+        self.restore_max_age = float(restore_max_age_hours) * 3600 if restore_max_age_hours else None
+        self.restore_limit = int(self.args.get("restore_limit", 0)) or None
+        self._contact_stamp = None
+        
+        if self.load_checkpoint():
+            # Contacts may have changed while we were down - check once HA has settled
+            self.run_in(self.validate_checkpoint, int(self.args.get("checkpoint_validate_delay", 60)))
+        else:
+            self.rebuild_name_cache()
+            self.load_persisted_data()
+            self.load_rollups()
         
-        # Listen for raw meshcore events
-        self.listen_event(self.handle_raw_event, "meshcore_raw_event")
+        # Listen for raw meshcore events through the bounded ingress queue.
+        # Every reception counts here, so only identical ones are collapsed.
+        self.ingress = meshcore_ingress.ingress_queue(
+            self, self.handle_raw_event,
+            ("EventType.RX_LOG_DATA", "EventType.CONTACT_MSG_RECV",
+             "EventType.CHANNEL_MSG_RECV", "EventType.ADVERTISEMENT"),
+            key=lambda data: meshcore_ingress.reception_key(data, with_signal=True))
         
         # Listen for meshcore contact sensor changes only
         self.listen_state(self.handle_contact_update, "binary_sensor.meshcore_", attribute="all")
         
         # Periodic persistence save
         self.run_every(self.save_persisted_data, "now+120", 300)  # Every 5 minutes
+        self.run_every(self.save_rollups, "now+150", 300)
+        
+        # Memory budgets (memory_budgets: {structure: max items}), enforced periodically
+        self.memory = meshcore_memory.MemoryBudget(self.name, self.args.get("memory_budgets", {}))
+        memory_interval = int(self.args.get("memory_check_interval", 600))
+        self.run_every(self.enforce_memory_budgets, f"now+{memory_interval}", memory_interval)
         
-        # Restore sensors and last message data
+        # Restore sensors and last message data through the shared, rate
+        # limited restore queue (restore_rate set_state calls per second)
+        self.restorer = meshcore_startup.shared_scheduler(self.args.get("restore_rate"), self.args.get("restore_burst"))
         self.run_in(self.restore_hops_sensors, 10)
         self.run_in(self.restore_last_messages, 15)
     
@@ -61,6 +126,7 @@ class MeshCoreHops(hass.Hass):
                 with open(self.sensors_persistence_file, 'r') as f:
                     data = json.load(f)
                     self.hops_sensors_data = data.get("sensors", {})
+                    self.reception_store = data.get("receptions", {})
                     self.log(f"Loaded {len(self.hops_sensors_data)} hops sensors from persistence")
             else:
                 self.log("No persistence file found for hops sensors")
@@ -95,6 +161,7 @@ class MeshCoreHops(hass.Hass):
             
             removed_sensors = len(self.hops_sensors_data) - len(cleaned_sensors)
             self.hops_sensors_data = cleaned_sensors
+            self.reception_store = {k: v for k, v in self.reception_store.items() if k in cleaned_sensors}
             
             if removed_messages > 0 or removed_sensors > 0:
                 self.log(f"Cleaned up {removed_messages} old messages, {removed_sensors} old sensors (>7 days)")
@@ -112,38 +179,145 @@ class MeshCoreHops(hass.Hass):
             # Save hops sensors data
             sensors_data = {
                 "sensors": self.hops_sensors_data,
+                "receptions": self.reception_store,
                 "count": len(self.hops_sensors_data),
                 "saved_at": time.time(),
                 "saved_at_formatted": datetime.now().isoformat()
             }
             with open(self.sensors_persistence_file, 'w') as f:
-                json.dump(sensors_data, f, indent=2)
+                json.dump(sensors_data, f, separators=(",", ":"))
             
             self.log(f"Saved {len(self.last_message_times)} last messages, {len(self.hops_sensors_data)} hops sensors")
+            self.save_checkpoint()
+            
+            stats = self.attribute_stats
+            if stats["updates"]:
+                self.log(f"Hops sensor attributes: {stats['updates']} updates, "
+                         f"avg {stats['total_bytes'] // stats['updates']} bytes, max {stats['max_bytes']} bytes")
         except Exception as e:
             self.log(f"Error saving persisted data: {e}", level="ERROR")
     
+    # -------------------------------------------------------------------------
+    # Checkpoint
+    # -------------------------------------------------------------------------
+    
+    CHECKPOINT_SCHEMA = 1
+    
+    def load_checkpoint(self):
+        """Restore all caches from the binary checkpoint; False if unusable"""
+        if not self.checkpoint_enabled:
+            return False
+        header, state = meshcore_checkpoint.load_checkpoint(
+            self.checkpoint_file, self.name, self.CHECKPOINT_SCHEMA,
+            newer_than=(self.persistence_file, self.sensors_persistence_file, self.rollups_persistence_file))
+        if header is None:
+            self.log(f"No usable checkpoint ({state}), loading JSON persistence")
+            return False
+        
+        self.name_to_pubkey_cache = state["name_cache"]
+        self.last_message_times = state["last_messages"]
+        self.hops_sensors_data = state["sensors"]
+        self.reception_store = state["receptions"]
+        self._contact_stamp = header.get("stamp")
+        
+        # Re-slot rollup buckets in case rollup_hours changed
+        cutoff = time.time() - self.rollup_hours * 3600
+        for node_key, node in state["rollups"].items():
+            buckets = [None] * self.rollup_hours
+            for bucket in node["buckets"]:
+                if bucket and bucket[0] > cutoff:
+                    buckets[(bucket[0] // 3600) % self.rollup_hours] = bucket
+            if any(buckets):
+                self.rollups[node_key] = {"name": node["name"], "buckets": buckets}
+        
+        age = time.time() - header.get("saved_at", 0)
+        self.log(f"Warm start from checkpoint ({age:.0f}s old): {len(self.hops_sensors_data)} hops sensors, "
+                 f"{len(self.last_message_times)} last messages, {len(self.rollups)} rollups")
+        return True
+    
+    def validate_checkpoint(self, kwargs=None):
+        """Rebuild the name cache if contacts changed since the checkpoint was written"""
+        try:
+            stamp = meshcore_checkpoint.contact_stamp(self.get_state("binary_sensor") or {})
+            if stamp != self._contact_stamp:
+                self.log("Contacts changed since checkpoint, rebuilding name cache")
+                self.rebuild_name_cache()
+            self._contact_stamp = stamp
+        except Exception as e:
+            self.log(f"Error validating checkpoint: {e}", level="WARNING")
+    
+    def save_checkpoint(self, kwargs=None):
+        if not self.checkpoint_enabled:
+            return
+        try:
+            if self._contact_stamp is None:
+                self._contact_stamp = meshcore_checkpoint.contact_stamp(self.get_state("binary_sensor") or {})
+            size = meshcore_checkpoint.save_checkpoint(
+                self.checkpoint_file, self.name, self.CHECKPOINT_SCHEMA,
+                {
+                    "name_cache": self.name_to_pubkey_cache,
+                    "last_messages": self.last_message_times,
+                    "sensors": self.hops_sensors_data,
+                    "receptions": self.reception_store,
+                    "rollups": self.rollups
+                },
+                stamp=self._contact_stamp)
+            self.log(f"Saved checkpoint ({size // 1024} kB)", level="DEBUG")
+        except Exception as e:
+            self.log(f"Error saving checkpoint: {e}", level="ERROR")
+    
+    def terminate(self):
+        self.restorer.cancel(self.name)
+        self.collector.unsubscribe(self.name)
+        self.save_checkpoint()
+    
     def restore_hops_sensors(self, kwargs=None):
-        """Restore hops sensors from persisted data"""
+        """
+        Restore hops sensors from persisted data - most recently heard first,
+        optionally limited to restore_max_age_hours / restore_limit, skipping
+        sensors HA still has with the same state and attributes
+        """
         try:
             if not self.hops_sensors_data:
                 self.log("No hops sensors to restore")
                 return
             
-            restored = 0
-            for sensor_id, sensor_data in self.hops_sensors_data.items():
-                state = sensor_data.get("state", "0")
+            def last_heard(sensor_data):
                 attrs = sensor_data.get("attributes", {})
-                
-                if attrs:
-                    self.set_state(sensor_id, state=str(state), attributes=attrs)
-                    restored += 1
+                return attrs.get("last_message_time") or attrs.get("last_seen", 0)
+            
+            wanted = [(sensor_id, sensor_data) for sensor_id, sensor_data in self.hops_sensors_data.items()
+                      if sensor_data.get("attributes") and self.wants_node_entity(
+                          sensor_data["attributes"].get("pubkey_prefix"), sensor_data["attributes"].get("sender_name"))]
+            selected = meshcore_checkpoint.select_for_restore(
+                wanted, last_heard, self.restore_max_age, self.restore_limit)
+            
+            current = (self.get_state("sensor") or {}) if selected else {}
+            
+            def restore(sensor_id, sensor_data):
+                state = str(sensor_data.get("state", "0"))
+                attrs = sensor_data.get("attributes", {})
+                existing = current.get(sensor_id)
+                if existing and existing.get("state") == state and self._same_attributes(existing, attrs):
+                    return False
+                self.set_state(sensor_id, state=state, attributes=attrs)
+                return True
             
-            self.log(f"Restored {restored} hops sensors")
+            def done(restored, unchanged):
+                self.log(f"Restored {restored} hops sensors ({unchanged} unchanged in HA, "
+                         f"{len(wanted) - len(selected)} older/over restore limit)")
+                if self.entity_mode == "aggregate":
+                    self.publish_summary()
+            
+            self.restorer.submit(self, "hops sensor", selected, restore, last_heard, done)
             
         except Exception as e:
             self.log(f"Error restoring hops sensors: {e}", level="ERROR")
     
+    def _same_attributes(self, state_data, attrs):
+        existing = state_data.get("attributes", {})
+        return all(existing.get(k) == v for k, v in attrs.items())
+    
     def track_hops_sensor(self, sensor_id, state, attributes):
         """Track hops sensor data for persistence"""
         self.hops_sensors_data[sensor_id] = {
@@ -151,6 +325,103 @@ class MeshCoreHops(hass.Hass):
             "attributes": attributes
         }
     
+    # -------------------------------------------------------------------------
+    # Entity mode
+    # -------------------------------------------------------------------------
+    
+    def wants_node_entity(self, pubkey=None, sender_name=None):
+        """Whether a per-node sensor should exist in HA for this sender"""
+        if self.entity_mode != "aggregate":
+            return True
+        if pubkey and pubkey.lower() in self.watchlist:
+            return True
+        return bool(sender_name) and sender_name.lower() in self.watchlist
+    
+    def apply_attribute_budget(self, sensor_id, attributes):
+        """Cap receptions/text and drop derivable fields, in place"""
+        stored = meshcore_derive.apply_attribute_budget(
+            attributes, self.max_receptions, self.message_text_length,
+            self.compact_attributes, self.reception_detail == "store")
+        if stored is not None:
+            self.reception_store[sensor_id] = stored
+        
+        attr_bytes = len(json.dumps(attributes, separators=(",", ":"), default=str))
+        stats = self.attribute_stats
+        stats["updates"] += 1
+        stats["total_bytes"] += attr_bytes
+        stats["last_bytes"] = attr_bytes
+        stats["max_bytes"] = max(stats["max_bytes"], attr_bytes)
+        self.log(f"{sensor_id} attributes: {attr_bytes} bytes", level="DEBUG")
+        return attributes
+    
+    def get_receptions(self, sensor_id):
+        """Reception details for a sensor, wherever they are kept"""
+        if sensor_id in self.reception_store:
+            return self.reception_store[sensor_id]
+        sensor_data = self.hops_sensors_data.get(sensor_id) or {}
+        return sensor_data.get("attributes", {}).get("receptions", [])
+    
+    def publish_hops_sensor(self, sensor_id, state, attributes):
+        """Record hops sensor data in memory and push it to HA if wanted"""
+        self.apply_attribute_budget(sensor_id, attributes)
+        self.track_hops_sensor(sensor_id, state, attributes)
+        if self.wants_node_entity(attributes.get("pubkey_prefix"), attributes.get("sender_name")):
+            self.set_state(sensor_id, state=str(state), attributes=attributes)
+        if self.entity_mode == "aggregate":
+            self._schedule_summary()
+    
+    def get_hops_sensor(self, sensor_id):
+        """Return {state, attributes} for a hops sensor from memory (or HA in per-node mode)"""
+        sensor_data = self.hops_sensors_data.get(sensor_id)
+        if sensor_data:
+            return sensor_data
+        if self.entity_mode != "aggregate":
+            return self.get_state(sensor_id, attribute="all")
+        return None
+    
+    def _schedule_summary(self):
+        """Debounce summary publishing - waits 10s after last update"""
+        try:
+            if self._summary_timer is not None:
+                self.cancel_timer(self._summary_timer)
+        except Exception:
+            pass
+        self._summary_timer = self.run_in(self._run_summary, 10)
+    
+    def _run_summary(self, kwargs=None):
+        self._summary_timer = None
+        self.publish_summary()
+    
+    def publish_summary(self):
+        """Publish one aggregate sensor and write per-node data to JSON"""
+        try:
+            nodes, totals = meshcore_derive.hops_summary(self.hops_sensors_data, self.get_receptions)
+            
+            with open(self.nodes_export_file, 'w') as f:
+                json.dump({
+                    "node_count": len(nodes),
+                    "updated": time.time(),
+                    "nodes": nodes
+                }, f, separators=(",", ":"))
+            
+            self.set_state(
+                "sensor.meshcore_hops_summary",
+                state=str(len(nodes)),
+                attributes={
+                    "friendly_name": "MeshCore Hops Summary",
+                    **totals,
+                    "watchlist": sorted(self.watchlist),
+                    "attribute_bytes_avg": (self.attribute_stats["total_bytes"] // self.attribute_stats["updates"]
+                                            if self.attribute_stats["updates"] else 0),
+                    "attribute_bytes_max": self.attribute_stats["max_bytes"],
+                    "icon": "mdi:routes",
+                    "unit_of_measurement": "nodes"
+                }
+            )
+            self.log(f"Published hops summary for {len(nodes)} nodes", level="DEBUG")
+        except Exception as e:
+            self.log(f"Error publishing hops summary: {e}", level="ERROR")
+    
     def restore_last_messages(self, kwargs=None):
         """Restore last_message attribute to contact sensors from persisted data"""
         try:
@@ -158,8 +429,9 @@ class MeshCoreHops(hass.Hass):
                 self.log("No last message times to restore")
                 return
             
-            all_states = self.get_state()
-            restored = 0
+            all_states = self.get_state("binary_sensor") or {}
+            cutoff = time.time() - self.restore_max_age if self.restore_max_age else 0
+            pending = []
             
             for entity_id, state_data in all_states.items():
                 if not (entity_id.startswith("binary_sensor.meshcore_") and "_contact" in entity_id):
@@ -168,19 +440,29 @@ class MeshCoreHops(hass.Hass):
                 attrs = state_data.get("attributes", {}) if state_data else {}
                 pubkey = attrs.get("pubkey_prefix")
                 
-                if pubkey and pubkey in self.last_message_times:
-                    last_msg_time = self.last_message_times[pubkey]
-                    
-                    # Update the contact sensor with last_message
-                    current_state = state_data.get("state", "unknown")
-                    new_attrs = dict(attrs)
-                    new_attrs["last_message"] = last_msg_time
-                    new_attrs["last_message_formatted"] = datetime.fromtimestamp(last_msg_time).isoformat()
-                    
-                    self.set_state(entity_id, state=current_state, attributes=new_attrs)
-                    restored += 1
-            
-            self.log(f"Restored last_message to {restored} contact sensors")
+                if pubkey and pubkey in self.last_message_times and self.last_message_times[pubkey] >= cutoff:
+                    pending.append((entity_id, self.last_message_times[pubkey]))
+            
+            def restore(entity_id, last_msg_time):
+                # Re-read the contact - it may have changed while queued
+                state_data = self.get_state(entity_id, attribute="all")
+                if not state_data:
+                    return False
+                attrs = state_data.get("attributes", {})
+                if attrs.get("last_message") == last_msg_time:
+                    return False
+                
+                # Update the contact sensor with last_message
+                new_attrs = dict(attrs)
+                new_attrs["last_message"] = last_msg_time
+                new_attrs["last_message_formatted"] = datetime.fromtimestamp(last_msg_time).isoformat()
+                self.set_state(entity_id, state=state_data.get("state", "unknown"), attributes=new_attrs)
+                return True
+            
+            def done(restored, unchanged):
+                self.log(f"Restored last_message to {restored} contact sensors ({unchanged} unchanged in HA)")
+            
+            self.restorer.submit(self, "last message", pending, restore, lambda ts: ts, done)
             
         except Exception as e:
             self.log(f"Error restoring last messages: {e}", level="ERROR")
@@ -193,49 +475,94 @@ class MeshCoreHops(hass.Hass):
             if len(self.last_message_times) % 5 == 0:
                 self.save_persisted_data()
     
+    def record_rollup(self, node_key, sender_name, hops, snr, rssi, timestamp=None):
+        """Add one reception to the node's hourly rollup bucket"""
+        meshcore_derive.record_rollup(self.rollups, self.rollup_hours, node_key, sender_name,
+                                      hops, snr, rssi, timestamp or time.time())
+
+    def load_rollups(self):
+        """Load hourly rollups, re-slotting buckets into the current ring size"""
+        try:
+            if not os.path.exists(self.rollups_persistence_file):
+                self.log("No persistence file found for hourly rollups")
+                return
+            with open(self.rollups_persistence_file, 'r') as f:
+                data = json.load(f)
+
+            cutoff = time.time() - self.rollup_hours * 3600
+            for node_key, node in data.get("nodes", {}).items():
+                buckets = [None] * self.rollup_hours
+                for bucket in node.get("buckets", []):
+                    if bucket[0] > cutoff:
+                        buckets[(bucket[0] // 3600) % self.rollup_hours] = bucket
+                if any(buckets):
+                    self.rollups[node_key] = {"name": node.get("name", node_key), "buckets": buckets}
+
+            self.log(f"Loaded hourly rollups for {len(self.rollups)} nodes")
+        except Exception as e:
+            self.log(f"Error loading hourly rollups: {e}", level="WARNING")
+            self.rollups = {}
+
+    def save_rollups(self, kwargs=None):
+        """Persist raw rollup buckets and export chart-ready rows"""
+        try:
+            now_ts = time.time()
+            cutoff = now_ts - self.rollup_hours * 3600
+
+            persisted = {}
+            exported = {}
+            for node_key, node in list(self.rollups.items()):
+                buckets = sorted((b for b in node["buckets"] if b and b[0] > cutoff), key=lambda b: b[0])
+                if not buckets:
+                    # Nothing left inside the window
+                    del self.rollups[node_key]
+                    continue
+                persisted[node_key] = {"name": node["name"], "buckets": buckets}
+                exported[node_key] = {
+                    "name": node["name"],
+                    "rows": [[b[0], b[1],
+                              round(b[3] / b[2], 2) if b[2] else None, b[4], b[5],
+                              round(b[7] / b[6], 1) if b[6] else None, b[8], b[9],
+                              b[10]] for b in buckets]
+                }
+
+            with open(self.rollups_persistence_file, 'w') as f:
+                json.dump({
+                    "rollup_hours": self.rollup_hours,
+                    "nodes": persisted,
+                    "saved_at": now_ts
+                }, f, separators=(",", ":"))
+
+            with open(self.rollups_export_file, 'w') as f:
+                json.dump({
+                    "bucket_seconds": 3600,
+                    "rollup_hours": self.rollup_hours,
+                    "fields": ["hour", "count", "snr_mean", "snr_min", "snr_max",
+                               "rssi_mean", "rssi_min", "rssi_max", "hops"],
+                    "node_count": len(exported),
+                    "updated": now_ts,
+                    "nodes": exported
+                }, f, separators=(",", ":"))
+
+            self.log(f"Saved hourly rollups for {len(exported)} nodes")
+            self.save_checkpoint()
+        except Exception as e:
+            self.log(f"Error saving hourly rollups: {e}", level="ERROR")
+
     def rebuild_name_cache(self):
         """Build cache of sender names to pubkey_prefix"""
         try:
-            all_states = self.get_state()
-            for ent_id in all_states.keys():
-                if ent_id.startswith("binary_sensor.meshcore_") and "_contact" in ent_id:
-                    attrs = all_states[ent_id].get("attributes", {})
-                    pubkey = attrs.get("pubkey_prefix")
-                    name = attrs.get("name") or attrs.get("friendly_name", "")
-                    if pubkey and name:
-                        # Clean name - remove " Contact" suffix and node type suffixes
-                        clean_name = name.replace(" Contact", "").strip()
-                        # Also remove node type suffixes like (Client), (Repeater), (Room Server)
-                        clean_name = re.sub(r'\s*\((Client|Repeater|Room Server|Room|Server)\)\s*$', '', clean_name, flags=re.IGNORECASE).strip()
-                        
-                        # Store multiple variations
-                        self.name_to_pubkey_cache[clean_name] = pubkey
-                        self.name_to_pubkey_cache[clean_name.lower()] = pubkey
-                        # Also store the original name in case messages include the suffix
-                        original_clean = name.replace(" Contact", "").strip()
-                        self.name_to_pubkey_cache[original_clean] = pubkey
-                        self.name_to_pubkey_cache[original_clean.lower()] = pubkey
+            self.name_to_pubkey_cache.update(meshcore_derive.name_to_pubkey(self.get_state()))
             self.log(f"Name cache built with {len(self.name_to_pubkey_cache)} entries")
         except Exception as e:
             self.log(f"Error building name cache: {e}", level="WARNING")
     
     def get_pubkey_for_sender(self, sender_name):
         """Look up pubkey_prefix for a sender name"""
-        # Try exact match first
-        if sender_name in self.name_to_pubkey_cache:
-            return self.name_to_pubkey_cache[sender_name]
-        
-        # Try lowercase
-        if sender_name.lower() in self.name_to_pubkey_cache:
-            return self.name_to_pubkey_cache[sender_name.lower()]
-        
-        # Try partial match (for names with emojis that might be stripped)
+        pubkey = meshcore_derive.lookup_pubkey(self.name_to_pubkey_cache, sender_name)
+        if pubkey:
+            return pubkey
         clean_sender = self.sanitize_entity_name(sender_name)
-        for name, pubkey in self.name_to_pubkey_cache.items():
-            if self.sanitize_entity_name(name) == clean_sender:
-                # Cache this mapping for next time
-                self.name_to_pubkey_cache[sender_name] = pubkey
-                return pubkey
         
         # Log what we're looking for vs what's in cache (sample)
         similar_names = [n for n in self.name_to_pubkey_cache.keys() 
@@ -273,7 +600,7 @@ class MeshCoreHops(hass.Hass):
             
             # Handle RX_LOG_DATA - has the best signal data (SNR + RSSI)
             if event_type == "EventType.RX_LOG_DATA":
-                self.process_rx_log_data(payload)
+                self.process_rx_log_data(payload, meshcore_receivers.receiver_of(data))
             
             # Handle direct messages
             elif event_type == "EventType.CONTACT_MSG_RECV":
@@ -292,111 +619,48 @@ class MeshCoreHops(hass.Hass):
             import traceback
             self.log(traceback.format_exc(), level="ERROR")
 
-    def process_rx_log_data(self, payload):
+    def process_rx_log_data(self, payload, receiver=meshcore_receivers.DEFAULT_RECEIVER):
         """
         Process RX_LOG_DATA events - these have the richest signal data.
-        Collect ALL receptions for a message to show all paths it took.
+        Receptions go to the shared fingerprint cache, which collects ALL
+        receptions of a message (every path it took) before handing them over.
         """
         try:
-            snr = payload.get("snr")
-            rssi = payload.get("rssi")
-            parsed = payload.get("parsed", {})
             decrypted = payload.get("decrypted", {})
             
-            path_len = parsed.get("path_len", 0)
-            path = parsed.get("path", "")
-            path_nodes = parsed.get("path_nodes", [])
-            
-            # Get message info from decrypted section
-            channel_idx = decrypted.get("channel_idx")
-            text = decrypted.get("text", "")
-            timestamp = decrypted.get("timestamp")
-            
             # Skip if we couldn't decrypt (no text means wrong channel/key)
-            if not text and not decrypted.get("decrypted"):
-                self.log(f"RX_LOG: Undecrypted packet, SNR: {snr}, RSSI: {rssi}", level="DEBUG")
+            if not decrypted.get("text") and not decrypted.get("decrypted"):
+                self.log(f"RX_LOG: Undecrypted packet, SNR: {payload.get('snr')}, RSSI: {payload.get('rssi')}", level="DEBUG")
                 return
             
-            # Extract sender name from "Name: Message" format
-            sender_name = "Unknown"
-            message_text = text
-            if ": " in text:
-                parts = text.split(": ", 1)
-                sender_name = parts[0]
-                message_text = parts[1] if len(parts) > 1 else ""
-            
-            # Create a unique key for this message (same message = same key regardless of path)
-            cache_key = f"{channel_idx}_{timestamp}_{sender_name}"
-            
-            # Create reception record
-            reception = {
-                "hops": path_len,
-                "snr": snr,
-                "rssi": rssi,
-                "path": path,
-                "path_nodes": path_nodes,
-                "received_at": time.time()
-            }
-            
-            # Add to cache - accumulate all receptions for this message
-            if cache_key not in self.rx_log_cache:
-                self.rx_log_cache[cache_key] = {
-                    "sender_name": sender_name,
-                    "channel_idx": channel_idx,
-                    "text": text,
-                    "message_text": message_text,
-                    "timestamp": timestamp,
-                    "receptions": [],
-                    "first_seen": time.time()
-                }
-            
-            # Add this reception to the list
-            self.rx_log_cache[cache_key]["receptions"].append(reception)
-            
-            # Clean old cache entries
-            self.clean_rx_log_cache()
-            
-            # Update sensor with ALL receptions so far
-            self.update_sensor_from_cache(cache_key)
-            
-            path_str = ' → '.join(path_nodes) if path_nodes else 'direct'
-            self.log(f"RX_LOG: {sender_name} - {path_len} hops, SNR: {snr}, RSSI: {rssi}, path: {path_str}")
+            self.collector.add(payload, receiver)
                 
         except Exception as e:
             self.log(f"Error processing RX_LOG_DATA: {e}", level="ERROR")
             import traceback
             self.log(traceback.format_exc(), level="ERROR")
 
-    def update_sensor_from_cache(self, cache_key):
-        """Update sensor with all reception data from cache"""
+    def handle_message_receptions(self, record, new_receptions):
+        """Update the sender's sensor once with all receptions of a message"""
         try:
-            cache_data = self.rx_log_cache.get(cache_key)
-            if not cache_data:
-                return
+            sender_name = record["sender_name"]
+            receptions = record["receptions"]
             
-            sender_name = cache_data["sender_name"]
-            channel_idx = cache_data["channel_idx"]
-            text = cache_data["text"]
-            message_text = cache_data["message_text"]
-            receptions = cache_data["receptions"]
+            for r in new_receptions:
+                path_str = ' → '.join(r["path_nodes"]) if r["path_nodes"] else 'direct'
+                self.log(f"RX_LOG: {sender_name} - {r['hops']} hops, SNR: {r['snr']}, RSSI: {r['rssi']}, path: {path_str}")
             
-            if not receptions:
-                return
+            self.update_sensor_from_record(record, new_receptions)
             
-            # Find best reception (direct preferred, then highest SNR)
-            best = None
-            for r in receptions:
-                if best is None:
-                    best = r
-                elif r["hops"] == 0 and best["hops"] > 0:
-                    # Prefer direct
-                    best = r
-                elif r["hops"] == best["hops"] and (r["snr"] or 0) > (best["snr"] or 0):
-                    # Same hops, prefer higher SNR
-                    best = r
-            
-            # Also find the longest path (most interesting for mesh visualization)
-            longest_path = max(receptions, key=lambda r: r["hops"])
+        except Exception as e:
+            self.log(f"Error handling message receptions: {e}", level="ERROR")
+
+    def update_sensor_from_record(self, record, new_receptions):
+        """Update sensor with all reception data of a message"""
+        try:
+            sender_name = record["sender_name"]
+            if not record["receptions"]:
+                return
             
             current_ts = time.time()
             
@@ -405,65 +669,25 @@ class MeshCoreHops(hass.Hass):
             
             # Determine sensor ID - prefer pubkey, fallback to sanitized name
             if pubkey:
-                sensor_id = f"sensor.meshcore_hops_{pubkey}"
+                node_key = pubkey
                 self.log(f"Found pubkey {pubkey} for sender {sender_name}")
             else:
-                safe_sender = self.sanitize_entity_name(sender_name)
-                sensor_id = f"sensor.meshcore_hops_{safe_sender}"
-                self.log(f"No pubkey found for {sender_name}, using name-based sensor ID: {sensor_id}", level="WARNING")
-            
-            # Format receptions for attribute storage
-            receptions_formatted = []
-            for r in receptions:
-                receptions_formatted.append({
-                    "hops": r["hops"],
-                    "snr": r["snr"],
-                    "rssi": r["rssi"],
-                    "path": ' → '.join(r["path_nodes"]) if r["path_nodes"] else "direct"
-                })
+                node_key = self.sanitize_entity_name(sender_name)
+                self.log(f"No pubkey found for {sender_name}, using name-based sensor ID: sensor.meshcore_hops_{node_key}", level="WARNING")
+            sensor_id = f"sensor.meshcore_hops_{node_key}"
+            
+            # Roll the receptions not counted yet into the hourly stats
+            for r in new_receptions:
+                self.record_rollup(node_key, sender_name, r["hops"], r["snr"], r["rssi"], r["received_at"])
             
             # Get location from contact sensor
             location = self.get_contact_location(pubkey_prefix=pubkey, sender_name=sender_name)
             
-            # Build attributes dict
-            sensor_attrs = {
-                "friendly_name": f"{sender_name} Hops",
-                "sender_name": sender_name,
-                "pubkey_prefix": pubkey if pubkey else "",
-                "message_type": "channel",
-                "channel_idx": channel_idx,
-                # Location data
-                "latitude": location["latitude"],
-                "longitude": location["longitude"],
-                # Best reception data
-                "path_length": best["hops"],
-                "snr": best["snr"] if best["snr"] is not None else 0,
-                "rssi": best["rssi"] if best["rssi"] is not None else 0,
-                # Use longest_path for path_nodes (for map visualization)
-                "path_nodes": longest_path["path_nodes"],
-                # Longest path data (for mesh visualization)
-                "max_hops": longest_path["hops"],
-                "longest_path": ' → '.join(longest_path["path_nodes"]) if longest_path["path_nodes"] else "direct",
-                # All receptions
-                "receptions": receptions_formatted,
-                "reception_count": len(receptions),
-                # Message info
-                "last_message_text": message_text[:100] if message_text else "",
-                "last_message_time": current_ts,
-                "last_message_formatted": datetime.fromtimestamp(current_ts).isoformat(),
-                "icon": "mdi:routes",
-                "unit_of_measurement": "hops",
-                "data_source": "rx_log_data"
-            }
-            
-            self.set_state(
-                sensor_id,
-                state=str(best["hops"]),  # State is best/direct hop count
-                attributes=sensor_attrs
-            )
+            state, sensor_attrs = meshcore_derive.hops_sensor_attributes(
+                record, pubkey, location, current_ts,
+                receiver_name=self.receivers.name if self.receivers.multiple() else None)
             
-            # Track for persistence
-            self.track_hops_sensor(sensor_id, best["hops"], sensor_attrs)
+            self.publish_hops_sensor(sensor_id, state, sensor_attrs)
             
             # Also update the contact sensor's last_message attribute if we have pubkey
             if pubkey:
@@ -472,31 +696,33 @@ class MeshCoreHops(hass.Hass):
         except Exception as e:
             self.log(f"Error updating sensor from cache: {e}", level="ERROR")
 
-    def clean_rx_log_cache(self):
-        """Remove old entries from rx_log cache"""
-        now = time.time()
-        expired = [k for k, v in self.rx_log_cache.items() 
-                   if now - v.get("first_seen", 0) > self.rx_log_cache_timeout]
-        for k in expired:
-            del self.rx_log_cache[k]
-
+    def enforce_memory_budgets(self, kwargs=None):
+        """Evict least recently used entries from structures over their budget"""
+        try:
+            # Shared fingerprint cache - bounded by its own LRU/TTL
+            self.memory.track("fingerprints", len(self.collector), self.collector.max_size)
+            
+            def last_heard(sensor_data):
+                attrs = sensor_data.get("attributes", {})
+                return attrs.get("last_message_time") or attrs.get("last_seen", 0)
+            
+            if self.memory.enforce("hops_sensors", self.hops_sensors_data, 5000, recency=last_heard):
+                self.reception_store = {k: v for k, v in self.reception_store.items() if k in self.hops_sensors_data}
+            self.memory.track("reception_store", len(self.reception_store))
+            
+            self.memory.enforce("last_messages", self.last_message_times, 10000, recency=lambda ts: ts)
+            self.memory.enforce("rollups", self.rollups, 2000,
+                                recency=lambda node: max((b[0] for b in node["buckets"] if b), default=0))
+            # No recency for names - oldest inserted go first, misses rebuild from HA
+            self.memory.enforce("name_cache", self.name_to_pubkey_cache, 20000)
+            
+            meshcore_memory.publish_memory_sensor(self)
+        except Exception as e:
+            self.log(f"Error enforcing memory budgets: {e}", level="ERROR")
+    
     def sanitize_entity_name(self, name):
         """Convert a name to a valid entity_id component - ASCII only"""
-        import unicodedata
-        # First normalize accented chars to ASCII equivalents (é -> e)
-        normalized = unicodedata.normalize('NFKD', name)
-        # Keep only ASCII alphanumeric and spaces
-        sanitized = ''.join(c if (c.isalnum() and ord(c) < 128) or c == ' ' else '' for c in normalized)
-        sanitized = re.sub(r'\s+', '_', sanitized.strip())
-        sanitized = sanitized.lower()
-        # Remove any leading/trailing underscores
-        sanitized = sanitized.strip('_')
-        # Remove consecutive underscores
-        sanitized = re.sub(r'_+', '_', sanitized)
-        # Ensure it's not empty
-        if not sanitized:
-            sanitized = "unknown"
-        return sanitized
+        return meshcore_derive.sanitize_entity_name(name)
 
     def process_direct_message(self, payload):
         """Process direct message events (EventType.CONTACT_MSG_RECV)"""
@@ -515,14 +741,10 @@ class MeshCoreHops(hass.Hass):
             # Get sender name from contact lookup
             sender_name = self.get_contact_name(pubkey_prefix)
             
-            # Try to get RSSI from cached RX_LOG_DATA
-            cached_rssi = None
-            for cache_key, cache_data in self.rx_log_cache.items():
-                if cache_data.get("text", "")[:20] == text[:20]:
-                    cached_rssi = cache_data.get("rssi")
-                    if cached_rssi:
-                        rssi = cached_rssi
-                    break
+            # Try to get RSSI from a cached RX_LOG_DATA reception
+            cached = self.collector.find(lambda record: record["text"][:20] == text[:20])
+            if cached and cached["receptions"] and cached["receptions"][-1]["rssi"]:
+                rssi = cached["receptions"][-1]["rssi"]
             
             current_ts = time.time()
             sensor_id = f"sensor.meshcore_hops_{pubkey_prefix}"
@@ -530,10 +752,10 @@ class MeshCoreHops(hass.Hass):
             # Get location from contact sensor
             location = self.get_contact_location(pubkey_prefix=pubkey_prefix)
             
-            self.set_state(
+            self.publish_hops_sensor(
                 sensor_id,
-                state=str(path_len) if path_len is not None else "0",
-                attributes={
+                path_len if path_len is not None else 0,
+                {
                     "friendly_name": f"{sender_name} Hops",
                     "sender_name": sender_name,
                     "pubkey_prefix": pubkey_prefix,
@@ -543,7 +765,7 @@ class MeshCoreHops(hass.Hass):
                     "path_length": path_len if path_len is not None else 0,
                     "snr": snr if snr is not None else 0,
                     "rssi": rssi if rssi is not None else 0,
-                    "last_message_text": text[:100] if text else "",
+                    "last_message_text": text or "",
                     "last_message_time": current_ts,
                     "last_message_formatted": datetime.fromtimestamp(current_ts).isoformat(),
                     "icon": "mdi:routes",
@@ -555,6 +777,8 @@ class MeshCoreHops(hass.Hass):
             # Update contact sensor with last_message timestamp
             self.update_contact_last_message(pubkey_prefix, current_ts)
             
+            self.record_rollup(pubkey_prefix, sender_name, path_len, snr, rssi, current_ts)
+            
             self.log(f"DM from {sender_name}: {path_len} hops, SNR: {snr}, RSSI: {rssi}")
                 
         except Exception as e:
@@ -580,8 +804,7 @@ class MeshCoreHops(hass.Hass):
                 message_text = parts[1] if len(parts) > 1 else ""
             
             # Try to get data from cached RX_LOG_DATA
-            cache_key = f"{channel_idx}_{sender_timestamp}_{sender_name}"
-            cache_data = self.rx_log_cache.get(cache_key)
+            cache_data = self.collector.get(meshcore_receptions.message_fingerprint(channel_idx, sender_timestamp, text))
             
             if cache_data and cache_data.get("receptions"):
                 # Already handled by RX_LOG_DATA with full reception data
@@ -596,11 +819,8 @@ class MeshCoreHops(hass.Hass):
             # Try to get pubkey for this sender
             pubkey = self.get_pubkey_for_sender(sender_name)
             
-            if pubkey:
-                sensor_id = f"sensor.meshcore_hops_{pubkey}"
-            else:
-                safe_sender = self.sanitize_entity_name(sender_name)
-                sensor_id = f"sensor.meshcore_hops_{safe_sender}"
+            node_key = pubkey if pubkey else self.sanitize_entity_name(sender_name)
+            sensor_id = f"sensor.meshcore_hops_{node_key}"
             
             # Get location from contact sensor
             location = self.get_contact_location(pubkey_prefix=pubkey, sender_name=sender_name)
@@ -623,7 +843,7 @@ class MeshCoreHops(hass.Hass):
                     "path": "unknown"
                 }],
                 "reception_count": 1,
-                "last_message_text": message_text[:100] if message_text else "",
+                "last_message_text": message_text or "",
                 "last_message_time": current_ts,
                 "last_message_formatted": datetime.fromtimestamp(current_ts).isoformat(),
                 "icon": "mdi:routes",
@@ -631,19 +851,14 @@ class MeshCoreHops(hass.Hass):
                 "data_source": "channel_message"
             }
             
-            self.set_state(
-                sensor_id,
-                state=str(path_len),
-                attributes=sensor_attrs
-            )
-            
-            # Track for persistence
-            self.track_hops_sensor(sensor_id, path_len, sensor_attrs)
+            self.publish_hops_sensor(sensor_id, path_len, sensor_attrs)
             
             # Update contact sensor if we have pubkey
             if pubkey:
                 self.update_contact_last_message(pubkey, current_ts)
             
+            self.record_rollup(node_key, sender_name, path_len, snr, None, current_ts)
+            
             self.log(f"Channel {channel_idx} from {sender_name}: {path_len} hops, SNR: {snr} (no RX_LOG data)")
                 
         except Exception as e:
@@ -667,7 +882,7 @@ class MeshCoreHops(hass.Hass):
             sensor_id = f"sensor.meshcore_hops_{pubkey_prefix}"
             
             # Check if sensor already exists with message data
-            existing_state = self.get_state(sensor_id, attribute="all")
+            existing_state = self.get_hops_sensor(sensor_id)
             
             # Don't overwrite message data with advertisement data
             if existing_state:
@@ -689,14 +904,8 @@ class MeshCoreHops(hass.Hass):
                 "data_source": "advertisement"
             }
             
-            self.set_state(
-                sensor_id,
-                state="0",
-                attributes=sensor_attrs
-            )
-            
             # Track for persistence (only advertisement data, lower priority)
-            self.track_hops_sensor(sensor_id, 0, sensor_attrs)
+            self.publish_hops_sensor(sensor_id, 0, sensor_attrs)
             
             self.log(f"Advert from {sender_name}: SNR: {snr}, RSSI: {rssi}")
                 
@@ -726,30 +935,7 @@ class MeshCoreHops(hass.Hass):
     def get_contact_location(self, pubkey_prefix=None, sender_name=None):
         """Look up contact location (lat/lon) from pubkey_prefix or sender_name"""
         try:
-            all_states = self.get_state()
-            
-            for ent_id in all_states.keys():
-                if ent_id.startswith("binary_sensor.meshcore_") and "_contact" in ent_id:
-                    ent_attrs = all_states[ent_id].get("attributes", {})
-                    
-                    # Match by pubkey if provided
-                    if pubkey_prefix and ent_attrs.get("pubkey_prefix") == pubkey_prefix:
-                        lat = ent_attrs.get("adv_lat") or ent_attrs.get("latitude")
-                        lon = ent_attrs.get("adv_lon") or ent_attrs.get("longitude")
-                        if lat is not None and lon is not None:
-                            return {"latitude": lat, "longitude": lon}
-                    
-                    # Match by name if no pubkey
-                    if sender_name and not pubkey_prefix:
-                        contact_name = ent_attrs.get("adv_name") or ent_attrs.get("friendly_name", "")
-                        contact_name = contact_name.replace(" Contact", "").replace(" (Client)", "").replace(" (Repeater)", "").replace(" (Room Server)", "").strip()
-                        if contact_name == sender_name or sender_name in contact_name:
-                            lat = ent_attrs.get("adv_lat") or ent_attrs.get("latitude")
-                            lon = ent_attrs.get("adv_lon") or ent_attrs.get("longitude")
-                            if lat is not None and lon is not None:
-                                return {"latitude": lat, "longitude": lon}
-            
-            return {"latitude": None, "longitude": None}
+            return meshcore_derive.contact_location(self.get_state(), pubkey_prefix, sender_name)
             
         except Exception as e:
             self.log(f"Error looking up contact location: {e}", level="WARNING")
@@ -811,6 +997,9 @@ class MeshCoreHops(hass.Hass):
             if not pubkey_prefix:
                 return
             
+            if meshcore_checkpoint.contact_changed(old, new):
+                self._contact_stamp = None
+            
             # Update name cache with this contact
             name = attrs.get("name") or attrs.get("friendly_name", "")
             if name:
@@ -827,7 +1016,7 @@ class MeshCoreHops(hass.Hass):
             
             sensor_id = f"sensor.meshcore_hops_{pubkey_prefix}"
             
-            existing_state = self.get_state(sensor_id, attribute="all")
+            existing_state = self.get_hops_sensor(sensor_id)
             if existing_state:
                 existing_attrs = existing_state.get("attributes", {})
                 if existing_attrs.get("data_source") in ["direct_message", "channel_message", "rx_log_data"]:
@@ -835,10 +1024,10 @@ class MeshCoreHops(hass.Hass):
             
             current_ts = time.time()
             
-            self.set_state(
+            self.publish_hops_sensor(
                 sensor_id,
-                state="0",
-                attributes={
+                0,
+                {
                     "friendly_name": f"{sender_name} Signal",
                     "sender_name": sender_name,
                     "pubkey_prefix": pubkey_prefix,
@@ -0,0 +1,153 @@
+import itertools
+import time
+from collections import OrderedDict
+from datetime import datetime
+from meshcore_receivers import receiver_of
+from meshcore_startup import TokenBucket
+
+RAW_EVENT = "meshcore_raw_event"
+RX_LOG_DATA = "EventType.RX_LOG_DATA"
+
+# Never useful to any app - AppDaemon filters them out before they are queued
+LOW_VALUE_EVENT_TYPES = ("EventType.BATTERY", "EventType.OK", "EventType.NO_MORE_MSGS",
+                         "EventType.MESSAGES_WAITING")
+
+# Apps register their queues here so one sensor can report all of them
+_queues = {}
+_last_published = 0.0
+
+
+def listen_raw_events(app, callback, event_types):
+    """Subscribe to meshcore_raw_event for the given event types only"""
+    return [app.listen_event(callback, RAW_EVENT, event_type=event_type) for event_type in event_types]
+
+
+def reception_key(data, with_signal=False):
+    """
+    Collapse key for an event: receptions of the same message over the same
+    path share a key, from whichever radio (with_signal: only the same SNR/RSSI
+    at the same radio). None = never collapsed.
+    """
+    if data.get("event_type") != RX_LOG_DATA:
+        return None
+    payload = data.get("payload", {})
+    decrypted = payload.get("decrypted", {})
+    if not decrypted.get("decrypted"):
+        return None
+    key = (decrypted.get("channel_idx"), decrypted.get("timestamp"), decrypted.get("text"),
+           tuple(payload.get("parsed", {}).get("path_nodes", [])))
+    if with_signal:
+        key += (payload.get("snr"), payload.get("rssi"), receiver_of(data))
+    return key
+
+
+class IngressQueue:
+    """
+    Bounded ingress queue in front of an app's raw event handler.
+    The listen_event callback only enqueues, so AppDaemon's thread queue stays
+    short however busy the mesh is; the handler runs from a debounced drain.
+    Policies, in order: duplicate receptions already queued are collapsed,
+    RX_LOG_DATA beyond rate per second is sampled (1 in sample_every kept),
+    and when the queue is full the oldest event is dropped.
+    """
+
+    def __init__(self, app, handler, event_types, key=reception_key, max_size=1000, rate=20.0,
+                 sample_every=10, drain_delay=1, batch_size=200):
+        self.app = app
+        self.handler = handler
+        self.key = key
+        self.max_size = max_size
+        self.bucket = TokenBucket(rate, max(1, int(rate * 2)))
+        self.sample_every = max(1, sample_every)
+        self.drain_delay = drain_delay
+        self.batch_size = batch_size
+
+        self._queue = OrderedDict()  # collapse key (or unique seq) -> (enqueued_at, event_name, data)
+        self._seq = itertools.count()
+        self._over_rate = 0
+        self._drain_timer = None
+        self.stats = {"received": 0, "processed": 0, "collapsed": 0, "sampled_out": 0,
+                      "overflow": 0, "depth": 0, "max_depth": 0, "max_lag_ms": 0}
+
+        self.handles = listen_raw_events(app, self.on_event, event_types)
+        _queues[app.name] = self
+
+    def on_event(self, event_name, data, kwargs):
+        stats = self.stats
+        stats["received"] += 1
+        key = self.key(data)
+        if key is not None and key in self._queue:
+            stats["collapsed"] += 1
+            return
+
+        if data.get("event_type") == RX_LOG_DATA and not self.bucket.take(1):
+            # Over rate - keep a sample so the maps still move
+            self._over_rate += 1
+            if self._over_rate % self.sample_every:
+                stats["sampled_out"] += 1
+                return
+
+        if key is None:
+            key = ("seq", next(self._seq))
+        self._queue[key] = (time.monotonic(), event_name, data)
+        if len(self._queue) > self.max_size:
+            self._queue.popitem(last=False)
+            stats["overflow"] += 1
+        stats["depth"] = len(self._queue)
+        stats["max_depth"] = max(stats["max_depth"], stats["depth"])
+
+        if self._drain_timer is None:
+            self._drain_timer = self.app.run_in(self._drain, self.drain_delay)
+
+    def _drain(self, kwargs=None):
+        self._drain_timer = None
+        stats = self.stats
+        for _ in range(min(self.batch_size, len(self._queue))):
+            _, (enqueued_at, event_name, data) = self._queue.popitem(last=False)
+            lag_ms = int((time.monotonic() - enqueued_at) * 1000)
+            if lag_ms > stats["max_lag_ms"]:
+                stats["max_lag_ms"] = lag_ms
+            self.handler(event_name, data, {})
+            stats["processed"] += 1
+        stats["depth"] = len(self._queue)
+
+        if self._queue:
+            # Give other callbacks a turn before the next batch
+            self._drain_timer = self.app.run_in(self._drain, 0)
+        publish_ingress_sensor(self.app)
+
+    def dropped(self):
+        return self.stats["sampled_out"] + self.stats["overflow"]
+
+
+def ingress_queue(app, handler, event_types, key=reception_key):
+    """IngressQueue configured from the app's ingress_* args"""
+    return IngressQueue(
+        app, handler, event_types, key=key,
+        max_size=int(app.args.get("ingress_queue_size", 1000)),
+        rate=float(app.args.get("ingress_rate", 20)),
+        sample_every=int(app.args.get("ingress_sample_every", 10)))
+
+
+def publish_ingress_sensor(app, min_interval=60):
+    """Publish sensor.meshcore_ingress (state: events dropped) - rate limited across apps"""
+    global _last_published
+    now = time.time()
+    if now - _last_published < min_interval:
+        return
+    _last_published = now
+
+    apps = {name: dict(queue.stats) for name, queue in _queues.items()}
+    app.set_state(
+        "sensor.meshcore_ingress",
+        state=sum(queue.dropped() for queue in _queues.values()),
+        attributes={
+            "friendly_name": "MeshCore Ingress Dropped",
+            "unit_of_measurement": "events",
+            "collapsed": sum(s["collapsed"] for s in apps.values()),
+            "max_lag_ms": max((s["max_lag_ms"] for s in apps.values()), default=0),
+            "apps": apps,
+            "icon": "mdi:tray-arrow-down",
+            "last_updated": datetime.now().isoformat()
+        }
+    )
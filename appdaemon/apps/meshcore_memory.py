@@ -0,0 +1,104 @@
+import heapq
+import time
+from datetime import datetime
+
+# Apps register their budgets here so one sensor can report all of them
+_budgets = {}
+_last_published = 0.0
+
+
+def process_rss_kb():
+    """Resident set size of the AppDaemon process in kB (None if /proc is unavailable)"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class MemoryBudget:
+    """
+    Per-structure item limits for one app's in-memory state.
+    enforce() drops entries older than max_age, then the least recently used
+    entries beyond the limit, and keeps per-structure size/eviction counters.
+    Limits come from the app's memory_budgets arg (structure name -> items).
+    """
+
+    def __init__(self, app_name, limits=None):
+        self.app_name = app_name
+        self.limits = dict(limits or {})
+        self.structures = {}  # name -> {size, limit, evicted}
+        _budgets[app_name] = self
+
+    def limit(self, name, default):
+        return int(self.limits.get(name, default))
+
+    def enforce(self, name, data, default_limit, recency=None, max_age=None, now=None):
+        """
+        Evict from dict data in place; returns the evicted keys.
+        recency(value) gives a last-used timestamp; without it the oldest
+        inserted keys go first and max_age is ignored.
+        """
+        limit = self.limit(name, default_limit)
+        evicted = []
+        if recency is not None and max_age:
+            cutoff = (now or time.time()) - max_age
+            evicted = [k for k, v in data.items() if (recency(v) or 0) < cutoff]
+
+        excess = len(data) - len(evicted) - limit if limit > 0 else 0
+        if excess > 0:
+            stale = set(evicted)
+            remaining = [k for k in data if k not in stale]
+            if recency is None:
+                evicted += remaining[:excess]
+            else:
+                evicted += heapq.nsmallest(excess, remaining, key=lambda k: recency(data[k]) or 0)
+
+        for key in evicted:
+            del data[key]
+        self.track(name, len(data), limit, len(evicted))
+        return evicted
+
+    def track(self, name, size, limit=None, evicted=0):
+        """Record a structure's size (also for structures bounded elsewhere)"""
+        entry = self.structures.setdefault(name, {"size": 0, "limit": limit, "evicted": 0})
+        entry["size"] = size
+        entry["limit"] = limit
+        entry["evicted"] += evicted
+
+
+def memory_report():
+    return {
+        "rss_kb": process_rss_kb(),
+        "apps": {name: {k: dict(v) for k, v in budget.structures.items()}
+                 for name, budget in _budgets.items()}
+    }
+
+
+def publish_memory_sensor(app, min_interval=60):
+    """Publish sensor.meshcore_memory_usage (state: RSS in MB) - rate limited across apps"""
+    global _last_published
+    now = time.time()
+    if now - _last_published < min_interval:
+        return
+    _last_published = now
+
+    report = memory_report()
+    rss_kb = report["rss_kb"]
+    evicted = sum(s["evicted"] for structures in report["apps"].values() for s in structures.values())
+    app.set_state(
+        "sensor.meshcore_memory_usage",
+        state=round(rss_kb / 1024, 1) if rss_kb is not None else "unknown",
+        attributes={
+            "friendly_name": "MeshCore Memory Usage",
+            "unit_of_measurement": "MB",
+            "rss_kb": rss_kb,
+            "total_evicted": evicted,
+            "apps": report["apps"],
+            "icon": "mdi:memory",
+            "last_updated": datetime.now().isoformat()
+        }
+    )
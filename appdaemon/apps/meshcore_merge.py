@@ -0,0 +1,159 @@
+import json
+import os
+import meshcore_geo
+
+
+def node_key(node, prefix=""):
+    """Dedupe key: the full pubkey, or name and position for exports without one"""
+    pubkey = (node.get(f"{prefix}pubkey") or "").lower()
+    if pubkey:
+        return pubkey
+    lat, lon = node.get(f"{prefix}lat"), node.get(f"{prefix}lon")
+    return f"{node.get(f'{prefix}name', 'Unknown')}@{round(float(lat or 0), 5)},{round(float(lon or 0), 5)}"
+
+
+def merge_heatmap(datasets):
+    """
+    Combine heatmap exports (site -> data). Nodes seen by several sites keep the
+    highest counts; identical paths are kept once.
+    """
+    nodes = {}
+    paths = {}
+    for site, data in datasets.items():
+        for node in data.get("nodes", []):
+            key = node_key(node)
+            merged = nodes.get(key)
+            if merged is None:
+                nodes[key] = dict(node, pubkey=node.get("pubkey", ""), sites=[site])
+                continue
+            merged["use_count"] = max(merged.get("use_count", 0), node.get("use_count", 0))
+            merged["recent_use_count"] = max(merged.get("recent_use_count", 0), node.get("recent_use_count", 0))
+            merged["activity"] = max(merged.get("activity", 0), node.get("activity", 0))
+            merged["sites"].append(site)
+        for path in data.get("paths", []):
+            key = (path.get("sender"), tuple((c.get("lat"), c.get("lon")) for c in path.get("coords", [])))
+            if key not in paths:
+                paths[key] = dict(path, site=site)
+
+    node_list = sorted(nodes.values(), key=lambda x: x.get("use_count", 0), reverse=True)
+    path_list = list(paths.values())
+    return {
+        "threshold_hours": max((d.get("threshold_hours") or 0 for d in datasets.values()), default=0),
+        "recent_hours": next((d["recent_hours"] for d in datasets.values() if d.get("recent_hours")), None),
+        "activity_half_life_hours": next((d["activity_half_life_hours"] for d in datasets.values()
+                                          if d.get("activity_half_life_hours")), None),
+        "node_count": len(node_list),
+        "path_count": len(path_list),
+        "nodes": node_list,
+        "paths": path_list
+    }
+
+
+def merge_nodemap(datasets, now):
+    """Combine node map exports; a node seen by several sites keeps its latest advert"""
+    nodes = {}
+    for site, data in datasets.items():
+        for node in data.get("nodes", []):
+            key = node_key(node)
+            merged = nodes.get(key)
+            sites = (merged["sites"] if merged else []) + [site]
+            if merged is None or node.get("last_advert", 0) > merged.get("last_advert", 0):
+                nodes[key] = dict(node, pubkey=node.get("pubkey", ""))
+            nodes[key]["sites"] = sites
+
+    node_list = sorted(nodes.values(), key=lambda x: x.get("name", "").lower())
+    type_counts = {}
+    for node in node_list:
+        if node.get("last_advert"):
+            node["age_hours"] = round((now - node["last_advert"]) / 3600, 1)
+        type_counts[node.get("node_type", "unknown")] = type_counts.get(node.get("node_type", "unknown"), 0) + 1
+    return {
+        "threshold_hours": max((d.get("threshold_hours") or 0 for d in datasets.values()), default=0),
+        "node_count": len(node_list),
+        "type_counts": type_counts,
+        "nodes": node_list
+    }
+
+
+def merge_directlinks(datasets, max_link_km=meshcore_geo.MAX_PLAUSIBLE_LINK_KM):
+    """
+    Combine direct link exports. A link heard by several sites is one link with
+    the highest count and latest last_seen (the sites mostly hear the same
+    packets, so counts are not added). Nodes are rebuilt from the merged links.
+    """
+    node_types = {}
+    links = {}
+    for site, data in datasets.items():
+        for node in data.get("nodes", []):
+            node_types.setdefault(node_key(node), node.get("node_type", "unknown"))
+        for link in data.get("links", []):
+            ends = (node_key(link, "from_"), node_key(link, "to_"))
+            key = tuple(sorted(ends))
+            merged = links.get(key)
+            if merged is None:
+                links[key] = dict(link, sites=[site])
+                continue
+            merged["count"] = max(merged.get("count", 1), link.get("count", 1))
+            merged["last_seen"] = max(merged.get("last_seen", 0), link.get("last_seen", 0))
+            merged["sites"].append(site)
+
+    nodes = {}
+    for key, link in links.items():
+        for end, prefix in zip((node_key(link, "from_"), node_key(link, "to_")), ("from_", "to_")):
+            if end not in nodes:
+                nodes[end] = {
+                    "name": link.get(f"{prefix}name", "Unknown"),
+                    "pubkey": link.get(f"{prefix}pubkey", ""),
+                    "lat": link.get(f"{prefix}lat"),
+                    "lon": link.get(f"{prefix}lon"),
+                    "node_type": node_types.get(end, "unknown"),
+                    "link_count": 0
+                }
+            nodes[end]["link_count"] += 1
+
+    link_list = list(links.values())
+    implausible = 0
+    for link in link_list:
+        link["implausible"] = link.get("distance_km", 0) > max_link_km
+        implausible += link["implausible"]
+    return {
+        "threshold_hours": max((d.get("threshold_hours") or 0 for d in datasets.values()), default=0),
+        "node_count": len(nodes),
+        "link_count": len(link_list),
+        "implausible_link_count": implausible,
+        "max_link_km": max_link_km,
+        "nodes": sorted(nodes.values(), key=lambda x: x["link_count"], reverse=True),
+        "links": link_list
+    }
+
+
+def refresh_sources(source_cache, files):
+    """
+    Re-read the export files whose (mtime, size) changed since they were
+    cached. source_cache: (site, export) -> {"version", "data"}, updated in
+    place; files: (site, export) -> path. Returns (exports with changed
+    inputs, [(key, error)] of files that could not be read).
+    """
+    changed = set()
+    errors = []
+
+    for key in [k for k in source_cache if k not in files]:
+        del source_cache[key]
+        changed.add(key[1])
+
+    for key, path in files.items():
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = source_cache.get(key)
+        if cached and cached["version"] == version:
+            continue
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            # Probably caught mid-write - retried next round
+            errors.append((key, e))
+            continue
+        source_cache[key] = {"version": version, "data": data}
+        changed.add(key[1])
+    return changed, errors
@@ -1,6 +1,7 @@
 import appdaemon.plugins.hass.hassapi as hass
 import json
 import time
+import meshcore_startup
 
 class MeshCoreNodeMapExport(hass.Hass):
     """
@@ -11,11 +12,12 @@ class MeshCoreNodeMapExport(hass.Hass):
     def initialize(self):
         self.log("MeshCoreNodeMapExport initialized")
         
-        # Export on startup
-        self.run_in(self.export_nodemap_data, 15)
+        # Export on startup - after the entity restore, staggered against the other exports
+        first_export = 30 + meshcore_startup.startup_offset(self.name)
+        self.run_in(self.export_nodemap_data, first_export)
         
         # Export every 5 minutes
-        self.run_every(self.export_nodemap_data, "now+60", 300)
+        self.run_every(self.export_nodemap_data, f"now+{first_export + 300}", 300)
         
         # Export when threshold changes
         self.listen_state(self.export_nodemap_data, "input_number.meshcore_advert_threshold_hours")
@@ -64,6 +66,7 @@ class MeshCoreNodeMapExport(hass.Hass):
                     
                     node_data.append({
                         "name": name,
+                        "pubkey": (attrs.get("public_key") or attrs.get("pubkey_prefix") or "").lower(),
                         "lat": float(lat),
                         "lon": float(lon),
                         "node_type": node_type.lower() if node_type else "unknown",
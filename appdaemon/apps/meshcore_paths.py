@@ -5,6 +5,16 @@ import os
 import re
 import unicodedata
 from datetime import datetime
+import meshcore_checkpoint
+import meshcore_geo
+import meshcore_ingress
+import meshcore_contacts
+import meshcore_derive
+import meshcore_memory
+import meshcore_receivers
+import meshcore_receptions
+import meshcore_registry
+import meshcore_startup
 
 class MeshCorePathMap(hass.Hass):
     """
@@ -25,29 +35,117 @@ class MeshCorePathMap(hass.Hass):
         else:
             self.log(f"My pubkey: {self.my_repeater_pubkey}")
 
-        self.node_coordinates = {}
-        self.build_coordinate_cache()
-
-        # drawn_paths: cache_key -> {first_seen, drawn_at, path_nodes, sender_name}
-        self.drawn_paths = {}
-
-        # hop_nodes_used: pubkey -> {coords, last_used, use_count}
+        # Path hash -> contact resolution, rebuilt only when contacts change.
+        # Shared with the exports, which resolve the same paths.
+        self.contacts = meshcore_contacts.shared_index(
+            self.my_repeater_pubkey,
+            cache_size=int(self.args.get("resolve_cache_size", 4096)),
+            path_cache_size=int(self.args.get("path_cache_size", 1024)),
+            max_link_km=float(self.args.get("max_link_km", meshcore_geo.MAX_PLAUSIBLE_LINK_KM)))
+
+        # Other radios feeding meshcore_raw_event (receivers: [{id, name, pubkey}]);
+        # paths are resolved from the radio that heard them
+        self.receivers = meshcore_receivers.shared_receivers(self.args.get("receivers"), self.my_repeater_pubkey)
+        self.contacts.set_receivers(self.receivers.pubkeys())
+
+        # Receptions are collected per message in the shared fingerprint cache;
+        # the longest path is drawn once, collection_window seconds after the first
+        self.collector = meshcore_receptions.shared_collector(
+            self.args.get("fingerprint_ttl"), self.args.get("fingerprint_cache_size"))
+        self.collector.subscribe(self, self.handle_message_receptions, int(self.args.get("collection_window", 3)))
+
+        # hop_nodes_used: pubkey -> {coords, last_used, use_count, use_buckets, activity, activity_at}
+        # use_buckets: [[hour_start, count], ...] covering the last recent_hours
+        # activity: uses decayed with a half-life of activity_half_life_hours, as of activity_at
         self.hop_nodes_used = {}
+        self.recent_hours = int(self.args.get("recent_hours", 24))
+        self.activity_half_life_hours = float(
+            self.args.get("activity_half_life_hours", meshcore_derive.ACTIVITY_HALF_LIFE_HOURS))
+        self.hop_use_total = 0
+
+        # Hop nodes are published to the shared registry (copy-on-write) for the
+        # snapshot recorder, which reads them from memory instead of the file;
+        # changes are committed at most every publish_delay seconds
+        self.published_hop_nodes = meshcore_registry.CopyOnWriteMap(
+            meshcore_registry.shared_registry(), meshcore_registry.HOP_NODES,
+            app=self, commit_delay=float(self.args.get("publish_delay", 1)))
+
+        # Persistence is flushed in the background when dirty, at most every persist_interval seconds
+        self.persist_interval = int(self.args.get("persist_interval", 60))
+        self._persist_dirty = False
 
         self._hop_marker_timer = None
 
-        self.load_persisted_data()
+        # Hop marker diffing: only markers whose attributes changed are pushed.
+        # marker_layout (pubkey -> entity_id) is regrouped only when a hop node
+        # is added or its name/coords change.
+        self.marker_layout = {}
+        self._marker_layout_dirty = True
+        self._dirty_markers = set()
+        self._sent_markers = {}  # entity_id -> attributes last pushed
+
+        # Entity mode: "per_node" creates device_trackers for every hop node and
+        # sender, "aggregate" only for watchlisted names/pubkeys. Hop data stays
+        # in memory either way and is published by the summary sensors/exports.
+        self.entity_mode = self.args.get("entity_mode", "per_node")
+        self.watchlist = {str(w).lower() for w in self.args.get("watchlist", [])}
+        self.hops_app_name = self.args.get("hops_app", "meshcore_hops")
+
+        # GeoJSON path layer: safe sender name -> LineString feature (latest path)
+        # path_trackers: false stops animating device_tracker.meshcore_path_*
+        self.paths_geojson_file = "/homeassistant/www/meshcore_paths.geojson"
+        self.path_trackers = bool(self.args.get("path_trackers", True))
+        self.path_features = {}
+        self._geojson_dirty = False
+        self._geojson_timer = None
+
+        # Binary checkpoint (hop nodes, contact index, path layer) for fast warm
+        # starts; falls back to the JSON persistence file when missing or stale
+        self.checkpoint_enabled = bool(self.args.get("checkpoint", True))
+        self.checkpoint_file = meshcore_checkpoint.checkpoint_path(self.args.get("checkpoint_dir"), self.name)
+        # Restore is unlimited by default (the whole persistence window)
+        restore_max_age_hours = self.args.get("restore_max_age_hours")
+        self.restore_max_age = float(restore_max_age_hours) * 3600 if restore_max_age_hours else None
+        self.restore_limit = int(self.args.get("restore_limit", 0)) or None
+        self._contact_stamp = None
+
+        if self.load_checkpoint():
+            # Contacts may have changed while we were down - check once HA has settled
+            self.run_in(self.validate_checkpoint, int(self.args.get("checkpoint_validate_delay", 60)))
+        else:
+            self.build_coordinate_cache()
+            self.load_persisted_data()
+        self.publish_hop_nodes(reload=True)
 
-        # Listen directly to raw meshcore events - no sensor state cascade
-        self.listen_event(self.handle_raw_event, "meshcore_raw_event")
+        # Listen directly to raw meshcore events - no sensor state cascade.
+        # The ingress queue collapses receptions of a message over the same path.
+        self.ingress = meshcore_ingress.ingress_queue(self, self.handle_raw_event, (meshcore_ingress.RX_LOG_DATA,))
 
         # Listen for threshold changes
         self.listen_state(self.update_entity_sensors, "input_number.meshcore_messages_threshold_hours")
 
-        self.run_every(self.refresh_cache, "now+60", 300)
-        self.run_every(self.save_persisted_data, "now+120", 300)
-        self.run_in(self.update_entity_sensors, 30)
+        # Contact changes patch the coordinate cache as they happen; the full
+        # rebuild only runs as an occasional consistency check
+        self.listen_state(self.handle_contact_change, "binary_sensor", attribute="all")
+        self.contacts.maintained_by = self.name
+        self.consistency_check_interval = int(self.args.get("consistency_check_interval", 3600))
+
+        self.run_every(self.refresh_cache, f"now+{self.consistency_check_interval}", self.consistency_check_interval)
+        self.run_every(self.flush_persisted_data, f"now+{self.persist_interval}", self.persist_interval)
+        # Hop markers go through the shared, rate limited restore queue;
+        # the entity sensors are refreshed once they are all back
+        self.restorer = meshcore_startup.shared_scheduler(self.args.get("restore_rate"), self.args.get("restore_burst"))
         self.run_in(self.restore_hop_markers, 10)
+        self.run_every(self.export_paths_geojson, "now+90", 300)
+
+        # Memory budgets (memory_budgets: {structure: max items}), enforced periodically
+        self.memory = meshcore_memory.MemoryBudget(self.name, self.args.get("memory_budgets", {}))
+        self.hop_node_max_age = float(self.args.get("hop_node_max_age_days", 90)) * 86400
+        memory_interval = int(self.args.get("memory_check_interval", 600))
+        self.run_every(self.enforce_memory_budgets, f"now+{memory_interval}", memory_interval)
+
+        # Serve the path layer from memory
+        self.register_endpoint(self.api_paths_geojson, "meshcore_paths_geojson")
 
     # -------------------------------------------------------------------------
     # Raw event handling
@@ -60,73 +158,30 @@ class MeshCorePathMap(hass.Hass):
                 return
 
             payload = data.get("payload", {})
-            decrypted = payload.get("decrypted", {})
-
-            if not decrypted.get("decrypted"):
-                return
-
-            text = decrypted.get("text", "")
-            if not text or ": " not in text:
-                return
-
-            parsed = payload.get("parsed", {})
-            path_nodes = parsed.get("path_nodes", [])
-
-            if len(path_nodes) < 2:
+            if len(payload.get("parsed", {}).get("path_nodes", [])) < 2:
                 return
 
-            sender_name = text.split(": ", 1)[0]
-            channel_idx = decrypted.get("channel_idx", 0)
-            msg_timestamp = decrypted.get("timestamp", 0)
-            cache_key = f"{channel_idx}_{msg_timestamp}_{sender_name}"
-
-            now = time.time()
-
-            if cache_key in self.drawn_paths:
-                entry = self.drawn_paths[cache_key]
-                if now - entry["first_seen"] < 10:
-                    # Still in collection window - keep longest path
-                    if len(path_nodes) > len(entry.get("path_nodes", [])):
-                        self.drawn_paths[cache_key]["path_nodes"] = path_nodes
-                    return
-                elif now - entry.get("drawn_at", 0) < 60:
-                    # Already drawn recently
-                    return
-
-            self.drawn_paths[cache_key] = {
-                "first_seen": now,
-                "drawn_at": 0,
-                "path_nodes": path_nodes,
-                "sender_name": sender_name
-            }
-
-            # Wait 3s to collect all receptions of this message before drawing
-            self.run_in(self._draw_path_from_cache, 3, cache_key=cache_key)
+            # Collected with the message's other receptions (from every radio) before drawing
+            self.collector.add(payload, meshcore_receivers.receiver_of(data))
 
         except Exception as e:
             self.log(f"Error handling raw event: {e}", level="ERROR")
             import traceback
             self.log(traceback.format_exc(), level="ERROR")
 
-    def _draw_path_from_cache(self, kwargs):
-        """Draw the best (longest) path after the collection window"""
-        try:
-            cache_key = kwargs.get("cache_key")
-            if not cache_key or cache_key not in self.drawn_paths:
-                return
-
-            entry = self.drawn_paths[cache_key]
-            if entry.get("drawn_at", 0) > 0:
-                return  # Already drawn
-
-            path_nodes = entry["path_nodes"]
-            sender_name = entry["sender_name"]
+    def handle_message_receptions(self, record, new_receptions):
+        """Draw the best (longest) path once all receptions of a message are in"""
+        longest = meshcore_derive.path_to_draw(record, new_receptions)
+        if longest:
+            origin = self.receivers.origin(longest.get("receiver"), self.contacts) or self.my_coords
+            self.draw_path(record["sender_name"], longest["path_nodes"], origin)
 
+    def draw_path(self, sender_name, path_nodes, origin=None):
+        try:
             self.log(f"Path check: {sender_name} - path_nodes={path_nodes}")
 
             path_coords = []
-            for node_prefix in path_nodes:
-                node_coords = self.get_node_coords(node_prefix)
+            for node_prefix, node_coords in zip(path_nodes, self.resolve_path_coords(path_nodes, origin)):
                 if node_coords:
                     path_coords.append(node_coords)
                     self.log(f"  Found coords for node {node_prefix}: {node_coords['name']}")
@@ -134,15 +189,16 @@ class MeshCorePathMap(hass.Hass):
                 else:
                     self.log(f"  No coords for node {node_prefix}")
 
-            self.drawn_paths[cache_key]["drawn_at"] = time.time()
+            self.publish_hop_nodes()
 
             if len(path_coords) < 2:
                 self.log(f"Not enough coordinates for {sender_name} (need 2+, got {len(path_coords)})")
                 return
 
-            self.create_path_tracker(sender_name, path_coords)
+            self.add_path_feature(sender_name, path_coords)
+            if self.path_trackers and self.wants_node_entity(name=sender_name):
+                self.create_path_tracker(sender_name, path_coords)
             self._schedule_hop_marker_update()
-            self.clean_old_paths()
 
         except Exception as e:
             self.log(f"Error drawing path: {e}", level="ERROR")
@@ -166,6 +222,19 @@ class MeshCorePathMap(hass.Hass):
         self._hop_marker_timer = None
         self.update_hop_node_markers()
 
+    def _schedule_geojson_export(self):
+        """Debounce GeoJSON export"""
+        try:
+            if self._geojson_timer is not None:
+                self.cancel_timer(self._geojson_timer)
+        except Exception:
+            pass
+        self._geojson_timer = self.run_in(self._run_geojson_export, 5)
+
+    def _run_geojson_export(self, kwargs=None):
+        self._geojson_timer = None
+        self.export_paths_geojson()
+
     # -------------------------------------------------------------------------
     # Persistence
     # -------------------------------------------------------------------------
@@ -176,6 +245,8 @@ class MeshCorePathMap(hass.Hass):
                 with open(self.persistence_file, 'r') as f:
                     data = json.load(f)
                     self.hop_nodes_used = data.get("hop_nodes_used", {})
+                    self.hop_use_total = sum(h.get("use_count", 0) for h in self.hop_nodes_used.values())
+                    self.contacts.load_adjacency(data.get("adjacency", []))
                     self.log(f"Loaded {len(self.hop_nodes_used)} hop nodes from persistence file")
             else:
                 self.log("No persistence file found, starting fresh")
@@ -187,178 +258,273 @@ class MeshCorePathMap(hass.Hass):
         try:
             data = {
                 "hop_nodes_used": self.hop_nodes_used,
+                "adjacency": self.contacts.export_adjacency(),
                 "saved_at": time.time(),
                 "saved_at_formatted": datetime.now().isoformat()
             }
             with open(self.persistence_file, 'w') as f:
-                json.dump(data, f, indent=2)
+                json.dump(data, f, separators=(",", ":"))
+            self._persist_dirty = False
             self.log(f"Saved {len(self.hop_nodes_used)} hop nodes to persistence file")
+            self.save_checkpoint()
         except Exception as e:
             self.log(f"Error saving persisted data: {e}", level="ERROR")
 
+    def flush_persisted_data(self, kwargs=None):
+        """Background flush - only writes if hop usage changed since the last save"""
+        if self._persist_dirty:
+            self.save_persisted_data()
+
     # -------------------------------------------------------------------------
-    # Coordinate cache
+    # Checkpoint
     # -------------------------------------------------------------------------
 
-    def refresh_cache(self, kwargs=None):
-        self.build_coordinate_cache()
+    CHECKPOINT_SCHEMA = 1
 
-    def build_coordinate_cache(self):
+    def load_checkpoint(self):
+        """Restore hop nodes, the contact index and the path layer; False if unusable"""
+        if not self.checkpoint_enabled:
+            return False
+        header, state = meshcore_checkpoint.load_checkpoint(
+            self.checkpoint_file, self.name, self.CHECKPOINT_SCHEMA, newer_than=(self.persistence_file,))
+        if header is None:
+            self.log(f"No usable checkpoint ({state}), loading JSON persistence")
+            return False
+
+        # The index is shared - only seed it if nobody has built it yet
+        if not self.contacts.contacts:
+            self.contacts.rebuild(state["contacts"])
+            self.contacts.entities = state["entities"]
+        self.contacts.load_adjacency(state["adjacency"])
+        self._refresh_my_coords()
+        self._contact_stamp = header.get("stamp")
+
+        self.hop_nodes_used = state["hop_nodes_used"]
+        self.hop_use_total = sum(h.get("use_count", 0) for h in self.hop_nodes_used.values())
+        self.path_features = state["path_features"]
+        self._geojson_dirty = bool(self.path_features)
+
+        age = time.time() - header.get("saved_at", 0)
+        self.log(f"Warm start from checkpoint ({age:.0f}s old): {len(self.hop_nodes_used)} hop nodes, "
+                 f"{len(self.contacts.contacts)} contacts, {len(self.path_features)} paths")
+        return True
+
+    def validate_checkpoint(self, kwargs=None):
+        """Full contact refresh only if contacts changed since the checkpoint was written"""
         try:
-            all_states = self.get_state()
-            self.node_coordinates = {}
+            stamp = meshcore_checkpoint.contact_stamp(self.get_state("binary_sensor") or {})
+            if stamp != self._contact_stamp:
+                self.log("Contacts changed since checkpoint, refreshing contact index")
+                self.build_coordinate_cache()
+            self._contact_stamp = stamp
+        except Exception as e:
+            self.log(f"Error validating checkpoint: {e}", level="WARNING")
 
-            for ent_id, state_data in all_states.items():
-                if not (ent_id.startswith("binary_sensor.meshcore_") and "_contact" in ent_id):
-                    continue
-                attrs = state_data.get("attributes", {})
-                pubkey = attrs.get("pubkey_prefix", "")
-                lat = attrs.get("adv_lat") or attrs.get("latitude")
-                lon = attrs.get("adv_lon") or attrs.get("longitude")
-                name = attrs.get("adv_name") or attrs.get("friendly_name", "").replace(" Contact", "")
-                node_type = attrs.get("node_type_str", "Unknown")
-
-                if pubkey == self.my_repeater_pubkey and lat is not None and lon is not None:
-                    self.my_coords = {"lat": float(lat), "lon": float(lon),
-                                      "name": name, "pubkey": pubkey, "node_type": node_type}
-                    self.log(f"Found my repeater: {name} at {lat}, {lon}")
-
-                if pubkey and lat is not None and lon is not None:
-                    for length in [2, 4, 6, 8, 10, 12, len(pubkey)]:
-                        if len(pubkey) >= length:
-                            short_key = pubkey[:length].lower()
-                            if short_key not in self.node_coordinates:
-                                self.node_coordinates[short_key] = {
-                                    "lat": float(lat), "lon": float(lon),
-                                    "name": name, "pubkey": pubkey, "node_type": node_type
-                                }
-
-            self.log(f"Coordinate cache built with {len(self.node_coordinates)} entries")
+    def save_checkpoint(self, kwargs=None):
+        if not self.checkpoint_enabled:
+            return
+        try:
+            if self._contact_stamp is None:
+                self._contact_stamp = meshcore_checkpoint.contact_stamp(self.get_state("binary_sensor") or {})
+            contacts, entities = self.contacts.export_contacts()
+            size = meshcore_checkpoint.save_checkpoint(
+                self.checkpoint_file, self.name, self.CHECKPOINT_SCHEMA,
+                {
+                    "hop_nodes_used": self.hop_nodes_used,
+                    "contacts": contacts,
+                    "entities": entities,
+                    "adjacency": self.contacts.export_adjacency(),
+                    "path_features": self.path_features
+                },
+                stamp=self._contact_stamp)
+            self.log(f"Saved checkpoint ({size // 1024} kB)", level="DEBUG")
         except Exception as e:
-            self.log(f"Error building coordinate cache: {e}", level="ERROR")
+            self.log(f"Error saving checkpoint: {e}", level="ERROR")
 
-    def get_node_coords(self, pubkey_prefix):
-        lower_key = pubkey_prefix.lower()
+    # -------------------------------------------------------------------------
+    # Coordinate cache
+    # -------------------------------------------------------------------------
 
-        if self.my_coords and self.my_repeater_pubkey.lower().startswith(lower_key):
-            self.log(f"    Node {pubkey_prefix} matched my repeater")
-            return self.my_coords
+    def terminate(self):
+        self.restorer.cancel(self.name)
+        self.collector.unsubscribe(self.name)
+        if self._persist_dirty:
+            self.save_persisted_data()
+        else:
+            self.save_checkpoint()
+        if self.contacts.maintained_by == self.name:
+            self.contacts.maintained_by = None
 
-        matches = []
-        for key, coords in self.node_coordinates.items():
-            if key.startswith(lower_key) or lower_key.startswith(key):
-                matches.append(coords)
+    def refresh_cache(self, kwargs=None):
+        """Consistency check - should find nothing if contact changes were all seen"""
+        if self.build_coordinate_cache():
+            self.log("Coordinate cache was out of date, rebuilt from full state", level="WARNING")
 
-        if not matches:
-            return None
-        if len(matches) == 1:
-            return matches[0]
+    def build_coordinate_cache(self):
+        """Full rebuild from all states; returns True if anything changed"""
+        try:
+            changed = self.contacts.update(self.get_state())
+            if changed:
+                self.log(f"Contact index rebuilt: {len(self.contacts.contacts)} contacts, "
+                         f"{len(self.contacts.ambiguous)} colliding prefixes")
+            self._refresh_my_coords()
+            return changed
+        except Exception as e:
+            self.log(f"Error building coordinate cache: {e}", level="ERROR")
+            return False
 
-        if self.my_coords:
-            def distance_to_me(node):
-                return (node["lat"] - self.my_coords["lat"]) ** 2 + (node["lon"] - self.my_coords["lon"]) ** 2
-            matches.sort(key=distance_to_me)
-            self.log(f"    Node {pubkey_prefix} had {len(matches)} matches, picked closest: {matches[0]['name']}")
+    def handle_contact_change(self, entity, attribute, old, new, kwargs):
+        """Patch the coordinate cache for one contact sensor change"""
+        if not meshcore_contacts.is_contact_entity(entity):
+            return
+        if meshcore_checkpoint.contact_changed(old, new):
+            self._contact_stamp = None
+        try:
+            if self.contacts.update_entity(entity, new):
+                self.log(f"Contact index updated for {entity}", level="DEBUG")
+                self._refresh_my_coords()
+        except Exception as e:
+            self.log(f"Error updating coordinate cache for {entity}: {e}", level="ERROR")
+
+    def _refresh_my_coords(self):
+        me = self.contacts.me()
+        if me and me != self.my_coords:
+            self.log(f"Found my repeater: {me['name']} at {me['lat']}, {me['lon']}")
+        self.my_coords = me
+
+    def get_node_candidates(self, pubkey_prefix):
+        """Distinct contacts whose pubkey matches a path prefix"""
+        return list(self.contacts.lookup(pubkey_prefix))
+
+    def resolve_path_coords(self, path_nodes, origin=None):
+        """
+        Resolve every hop of a path at once; colliding hops are resolved from
+        their neighbours. origin is the radio that heard it (default: mine).
+        """
+        picks = self.contacts.resolve_path(path_nodes, origin=origin or self.my_coords)
+
+        for prefix, pick in zip(path_nodes, picks):
+            if pick and prefix.lower() in self.contacts.ambiguous:
+                self.log(f"    Node {prefix} had {len(self.contacts.ambiguous[prefix.lower()])} matches, "
+                         f"picked: {pick['name']}")
+        return picks
 
-        return matches[0]
+    def get_node_coords(self, pubkey_prefix):
+        return self.resolve_path_coords([pubkey_prefix])[0]
 
     # -------------------------------------------------------------------------
     # Hop node tracking
     # -------------------------------------------------------------------------
 
     def track_hop_node(self, pubkey_prefix, coords):
-        key = coords.get("pubkey", pubkey_prefix).lower()
-        if key in self.hop_nodes_used:
-            self.hop_nodes_used[key]["last_used"] = time.time()
-            self.hop_nodes_used[key]["use_count"] += 1
+        key, created = meshcore_derive.track_hop_node(
+            self.hop_nodes_used, pubkey_prefix, coords, time.time(), self.recent_hours,
+            self.activity_half_life_hours)
+        if created:
+            self._marker_layout_dirty = True
+        self.hop_use_total += 1
+        self._dirty_markers.add(key)
+        self._persist_dirty = True
+        node = meshcore_derive.heatmap_snapshot_node(key, self.hop_nodes_used[key])
+        if node:
+            self.published_hop_nodes.set(key, node)
+
+    def publish_hop_nodes(self, reload=False):
+        """Publish staged hop node changes, debounced (reload: republish every node now)"""
+        if reload:
+            self.published_hop_nodes.replace(
+                (node["pubkey"], node) for node in meshcore_derive.heatmap_snapshot_nodes(self.hop_nodes_used))
+            self.published_hop_nodes.commit()
         else:
-            self.hop_nodes_used[key] = {"coords": coords, "last_used": time.time(), "use_count": 1}
+            self.published_hop_nodes.schedule()
 
-        total = sum(h.get("use_count", 0) for h in self.hop_nodes_used.values())
-        if total % 10 == 0:
-            self.save_persisted_data()
+    def recent_use_count(self, data, now=None):
+        """Uses within the last recent_hours (hour resolution)"""
+        return meshcore_derive.recent_use_count(data, now or time.time(), self.recent_hours)
+
+    def activity(self, data, now=None):
+        """Decayed activity score (activity_half_life_hours)"""
+        return meshcore_derive.decayed_activity(data, now or time.time(), self.activity_half_life_hours)
 
     def restore_hop_markers(self, kwargs=None):
+        """
+        Queue hop node markers on the shared restore queue, most recently used
+        first; markers HA still holds unchanged are not pushed again. With
+        restore_max_age_hours / restore_limit set, older nodes get their marker
+        back the next time they are used.
+        """
         try:
             if not self.hop_nodes_used:
                 self.log("No hop nodes to restore")
+                self.update_entity_sensors()
                 return
-            self.log(f"Restoring {len(self.hop_nodes_used)} hop node markers...")
-            nodes_by_name = self._group_nodes_by_name(self.hop_nodes_used)
-            for safe_name, nodes in nodes_by_name.items():
-                needs_dis = self._needs_disambiguation(nodes)
-                for pubkey, data, coords in nodes:
-                    eid = f"device_tracker.meshcore_hop_{safe_name}_{pubkey[:6]}" if needs_dis else f"device_tracker.meshcore_hop_{safe_name}"
-                    self._set_hop_entity(eid, coords, data)
-            self.log(f"Restored {len(self.hop_nodes_used)} hop node markers")
-            self.update_entity_sensors()
+            selected = meshcore_checkpoint.select_for_restore(
+                self.hop_nodes_used.items(), lambda v: v.get("last_used", 0),
+                self.restore_max_age, self.restore_limit)
+            self.log(f"Restoring {len(selected)} of {len(self.hop_nodes_used)} hop node markers...")
+            current = self.get_state("device_tracker") or {}
+            self._sent_markers = {entity_id: state_data.get("attributes", {})
+                                  for entity_id, state_data in current.items()
+                                  if entity_id.startswith("device_tracker.meshcore_hop_") and state_data}
+            self._marker_layout_dirty = True
+            self._refresh_marker_layout()
+
+            def done(pushed, unchanged):
+                self.log(f"Restored {pushed} hop node markers ({unchanged} unchanged in HA)")
+                self.update_entity_sensors()
+
+            self.restorer.submit(self, "hop marker", selected, lambda pubkey, data: self._push_marker(pubkey),
+                                 lambda v: v.get("last_used", 0), done)
         except Exception as e:
             self.log(f"Error restoring hop markers: {e}", level="ERROR")
 
     def update_hop_node_markers(self):
         try:
-            nodes_by_name = self._group_nodes_by_name(self.hop_nodes_used)
-            for safe_name, nodes in nodes_by_name.items():
-                needs_dis = self._needs_disambiguation(nodes)
-                for pubkey, data, coords in nodes:
-                    eid = f"device_tracker.meshcore_hop_{safe_name}_{pubkey[:6]}" if needs_dis else f"device_tracker.meshcore_hop_{safe_name}"
-                    self._set_hop_entity(eid, coords, data)
+            pushed = self.push_hop_markers()
+            self.log(f"Pushed {pushed} changed hop markers", level="DEBUG")
             self.update_hop_entities_sensor()
         except Exception as e:
             self.log(f"Error updating hop node markers: {e}", level="ERROR")
 
-    def _group_nodes_by_name(self, hop_nodes):
-        nodes_by_name = {}
-        for pubkey, data in hop_nodes.items():
-            coords = data.get("coords", {})
-            if not coords or not coords.get("lat") or not coords.get("lon"):
-                continue
-            safe_name = self._safe_entity_name(coords.get("name", "Unknown"))
-            if safe_name not in nodes_by_name:
-                nodes_by_name[safe_name] = []
-            nodes_by_name[safe_name].append((pubkey, data, coords))
-        return nodes_by_name
-
-    def _needs_disambiguation(self, nodes):
-        if len(nodes) <= 1:
+    def push_hop_markers(self):
+        """set_state only the hop markers whose attributes changed; returns the number pushed"""
+        self._refresh_marker_layout()
+        pushed = 0
+        for pubkey in [pk for pk in self.marker_layout if pk in self._dirty_markers]:
+            if self._push_marker(pubkey):
+                pushed += 1
+        self._dirty_markers.clear()
+        return pushed
+
+    def _refresh_marker_layout(self):
+        if not self._marker_layout_dirty:
+            return
+        layout = meshcore_derive.marker_layout(self.hop_nodes_used, self._safe_entity_name, self.wants_node_entity)
+        # Nodes that moved to another entity (newly disambiguated names) must be pushed
+        self._dirty_markers.update(pk for pk, eid in layout.items() if self.marker_layout.get(pk, eid) != eid)
+        self.marker_layout = layout
+        self._marker_layout_dirty = False
+
+    def _push_marker(self, pubkey):
+        """Push one hop marker if its attributes changed; returns True if pushed"""
+        data = self.hop_nodes_used.get(pubkey)
+        entity_id = self.marker_layout.get(pubkey)
+        if not data or not entity_id:
             return False
-        first_lat = nodes[0][2].get("lat", 0)
-        first_lon = nodes[0][2].get("lon", 0)
-        for _, _, coords in nodes[1:]:
-            if abs(coords.get("lat", 0) - first_lat) > 0.001 or abs(coords.get("lon", 0) - first_lon) > 0.001:
-                return True
-        return False
-
-    def _set_hop_entity(self, entity_id, coords, data):
-        node_type = coords.get("node_type", "Unknown")
-        if "repeater" in node_type.lower():
-            icon = "mdi:radio-tower"
-        elif "client" in node_type.lower():
-            icon = "mdi:cellphone-wireless"
-        elif "room" in node_type.lower():
-            icon = "mdi:forum"
-        else:
-            icon = "mdi:access-point"
-
-        display_name = self._normalize_display_name(coords.get("name", "Unknown"))
-        self.set_state(
-            entity_id,
-            state="home",
-            attributes={
-                "friendly_name": f"Hop: {display_name}",
-                "source_type": "gps",
-                "latitude": coords["lat"],
-                "longitude": coords["lon"],
-                "gps_accuracy": 50,
-                "source": "meshcore_hop",
-                "node_name": display_name,
-                "node_type": node_type,
-                "pubkey": data.get("pubkey", ""),
-                "use_count": data.get("use_count", 0),
-                "last_used": data.get("last_used", 0),
-                "icon": icon
-            }
-        )
+        attributes = meshcore_derive.hop_marker_attributes(data.get("coords", {}), data, self._normalize_display_name)
+        if self._sent_markers.get(entity_id) == attributes:
+            return False
+        self.set_state(entity_id, state="home", attributes=attributes)
+        self._sent_markers[entity_id] = attributes
+        return True
+
+    def wants_node_entity(self, pubkey=None, name=None):
+        """Whether a per-node device_tracker should exist in HA"""
+        if self.entity_mode != "aggregate":
+            return True
+        if pubkey and any(pubkey.lower().startswith(w) for w in self.watchlist):
+            return True
+        return bool(name) and (name.lower() in self.watchlist or self._safe_entity_name(name) in self.watchlist)
 
     # -------------------------------------------------------------------------
     # Path tracker entities
@@ -395,11 +561,73 @@ class MeshCorePathMap(hass.Hass):
         except Exception as e:
             self.log(f"Error creating path tracker: {e}", level="ERROR")
 
-    def clean_old_paths(self):
-        now = time.time()
-        old = [k for k, v in self.drawn_paths.items() if now - v.get("first_seen", 0) > 3600]
-        for k in old:
-            del self.drawn_paths[k]
+    # -------------------------------------------------------------------------
+    # GeoJSON path layer
+    # -------------------------------------------------------------------------
+
+    def add_path_feature(self, sender_name, path_coords):
+        """Replace the sender's path in the GeoJSON layer"""
+        self.path_features[self._safe_entity_name(sender_name)] = meshcore_derive.path_feature(
+            sender_name, path_coords, time.time(), self._normalize_display_name)
+        self._geojson_dirty = True
+        self._schedule_geojson_export()
+
+    def expire_path_features(self):
+        """Drop paths older than the messages threshold"""
+        if meshcore_derive.expire_path_features(self.path_features, time.time() - self.get_threshold_seconds()):
+            self._geojson_dirty = True
+
+    def get_paths_geojson(self):
+        return meshcore_derive.path_feature_collection(self.path_features, time.time())
+
+    def export_paths_geojson(self, kwargs=None):
+        """Write the path layer to www if it changed"""
+        try:
+            self.expire_path_features()
+            if not self._geojson_dirty:
+                return
+            with open(self.paths_geojson_file, 'w') as f:
+                json.dump(self.get_paths_geojson(), f, separators=(",", ":"))
+            self._geojson_dirty = False
+            self.log(f"Exported {len(self.path_features)} paths to GeoJSON")
+        except Exception as e:
+            self.log(f"Error exporting paths GeoJSON: {e}", level="ERROR")
+
+    def api_paths_geojson(self, data, kwargs):
+        """AppDaemon endpoint: /api/appdaemon/meshcore_paths_geojson"""
+        self.expire_path_features()
+        return self.get_paths_geojson(), 200
+
+    # -------------------------------------------------------------------------
+    # Memory budgets
+    # -------------------------------------------------------------------------
+
+    def enforce_memory_budgets(self, kwargs=None):
+        try:
+            now = time.time()
+            evicted = self.memory.enforce("hop_nodes", self.hop_nodes_used, 5000,
+                                          recency=lambda v: v.get("last_used", 0),
+                                          max_age=self.hop_node_max_age, now=now)
+            if evicted:
+                self._marker_layout_dirty = True
+                self._persist_dirty = True
+                self.hop_use_total = sum(h.get("use_count", 0) for h in self.hop_nodes_used.values())
+                self.publish_hop_nodes(reload=True)
+
+            if self.memory.enforce("path_features", self.path_features, 2000,
+                                   recency=lambda f: f["properties"]["drawn_at"]):
+                self._geojson_dirty = True
+
+            # Bounded by their own LRUs / ring sizes
+            stats = self.contacts.cache_stats()
+            self.memory.track("resolver_paths", stats["paths_cached"], self.contacts.path_cache_size)
+            self.memory.track("contacts", stats["contacts"])
+            self.memory.track("sent_markers", len(self._sent_markers))
+            self.memory.track("fingerprints", len(self.collector), self.collector.max_size)
+
+            meshcore_memory.publish_memory_sensor(self)
+        except Exception as e:
+            self.log(f"Error enforcing memory budgets: {e}", level="ERROR")
 
     # -------------------------------------------------------------------------
     # Entity sensors
@@ -415,6 +643,17 @@ class MeshCorePathMap(hass.Hass):
         self.update_path_entities_sensor()
         self.update_hop_entities_sensor()
 
+    def get_hops_sensors(self, all_states):
+        """Hops sensor data ({sensor_id: {state, attributes}}) from MeshCoreHops memory or HA"""
+        try:
+            hops_app = self.get_app(self.hops_app_name)
+        except Exception:
+            hops_app = None
+        if hops_app is not None:
+            return dict(hops_app.hops_sensors_data)
+        return {eid: data or {} for eid, data in all_states.items()
+                if eid.startswith("sensor.meshcore_hops_")}
+
     def update_path_entities_sensor(self, *args, **kwargs):
         try:
             all_states = self.get_state()
@@ -422,6 +661,18 @@ class MeshCorePathMap(hass.Hass):
             now_ts = time.time()
             threshold_sec = self.get_threshold_seconds()
 
+            # safe sender name -> last message time (first match wins, as before)
+            last_msg_by_name = {}
+            for hops_data in self.get_hops_sensors(all_states).values():
+                hops_attrs = hops_data.get("attributes", {})
+                last_msg_by_name.setdefault(self._safe_entity_name(hops_attrs.get("sender_name", "")),
+                                            hops_attrs.get("last_message_time", 0))
+
+            active_paths = 0
+            for last_msg in last_msg_by_name.values():
+                if last_msg and (now_ts - last_msg) <= threshold_sec:
+                    active_paths += 1
+
             for entity_id in all_states.keys():
                 if not entity_id.startswith("device_tracker.meshcore_path_"):
                     continue
@@ -429,15 +680,9 @@ class MeshCorePathMap(hass.Hass):
                 if not attrs.get("latitude") or not attrs.get("longitude"):
                     continue
                 safe_name = entity_id.replace("device_tracker.meshcore_path_", "")
-                for hops_eid, hops_data in all_states.items():
-                    if not hops_eid.startswith("sensor.meshcore_hops_"):
-                        continue
-                    hops_attrs = (hops_data or {}).get("attributes", {})
-                    if self._safe_entity_name(hops_attrs.get("sender_name", "")) == safe_name:
-                        last_msg = hops_attrs.get("last_message_time", 0)
-                        if last_msg and (now_ts - last_msg) <= threshold_sec:
-                            path_entities.append(entity_id)
-                        break
+                last_msg = last_msg_by_name.get(safe_name, 0)
+                if last_msg and (now_ts - last_msg) <= threshold_sec:
+                    path_entities.append(entity_id)
 
             self.set_state(
                 "sensor.meshcore_path_entities",
@@ -445,6 +690,7 @@ class MeshCorePathMap(hass.Hass):
                 attributes={
                     "friendly_name": "MeshCore Path Entities",
                     "entities": path_entities,
+                    "active_senders": active_paths,
                     "icon": "mdi:map-marker-path",
                     "last_updated": datetime.now().isoformat()
                 }
@@ -470,12 +716,18 @@ class MeshCorePathMap(hass.Hass):
                 if last_used and (now_ts - last_used) <= threshold_sec:
                     hop_entities.append(entity_id)
 
+            active_nodes = sum(1 for h in list(self.hop_nodes_used.values())
+                               if h.get("last_used") and (now_ts - h["last_used"]) <= threshold_sec)
+
             self.set_state(
                 "sensor.meshcore_hop_entities",
                 state=str(len(hop_entities)),
                 attributes={
                     "friendly_name": "MeshCore Hop Node Entities",
                     "entities": hop_entities,
+                    "active_nodes": active_nodes,
+                    "total_uses": self.hop_use_total,
+                    "resolver_cache": self.contacts.cache_stats(),
                     "icon": "mdi:transit-connection-variant",
                     "last_updated": datetime.now().isoformat()
                 }
@@ -0,0 +1,65 @@
+DEFAULT_RECEIVER = "default"
+
+# Event data keys that identify the radio (config entry) an event came from
+TAG_KEYS = ("receiver", "entry_id", "config_entry_id", "device_id")
+
+_registry = None
+
+
+def receiver_of(data):
+    """Receiver tag of a meshcore_raw_event (DEFAULT_RECEIVER for single-radio setups)"""
+    for key in TAG_KEYS:
+        value = data.get(key)
+        if value:
+            return str(value)
+    return DEFAULT_RECEIVER
+
+
+class ReceiverRegistry:
+    """
+    The radios feeding meshcore_raw_event: tag -> {name, pubkey}.
+    Configured from the receivers arg; my_pubkey is the default receiver.
+    """
+
+    def __init__(self):
+        self.receivers = {}
+
+    def configure(self, receivers=None, my_pubkey=""):
+        if my_pubkey and DEFAULT_RECEIVER not in self.receivers:
+            self.receivers[DEFAULT_RECEIVER] = {"name": "default", "pubkey": my_pubkey.lower()}
+        items = receivers.items() if isinstance(receivers, dict) else \
+            ((r.get("id"), r) for r in (receivers or []))
+        for tag, receiver in items:
+            if not tag:
+                continue
+            self.receivers[str(tag)] = {
+                "name": receiver.get("name") or str(tag),
+                "pubkey": (receiver.get("pubkey") or "").lower()
+            }
+
+    def multiple(self):
+        return len(self.receivers) > 1
+
+    def name(self, tag):
+        receiver = self.receivers.get(tag)
+        return receiver["name"] if receiver else tag
+
+    def pubkey(self, tag):
+        receiver = self.receivers.get(tag)
+        return receiver["pubkey"] if receiver else ""
+
+    def pubkeys(self):
+        return [r["pubkey"] for r in self.receivers.values() if r["pubkey"]]
+
+    def origin(self, tag, index):
+        """The receiving radio's located contact in a ContactIndex (None if unknown)"""
+        return index.contacts.get(self.pubkey(tag))
+
+
+def shared_receivers(receivers=None, my_pubkey=""):
+    """Process-wide ReceiverRegistry; receivers from any app's args are added"""
+    global _registry
+    if _registry is None:
+        _registry = ReceiverRegistry()
+    _registry.configure(receivers, my_pubkey)
+    return _registry
@@ -0,0 +1,205 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from meshcore_receivers import DEFAULT_RECEIVER
+
+_collector = None
+
+
+def message_fingerprint(channel_idx, sender_timestamp, text):
+    """Same flood message = same fingerprint, whichever path it came over"""
+    raw = f"{channel_idx}\x1f{sender_timestamp}\x1f{text}".encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+
+def split_sender(text):
+    """("Name", "message") from "Name: message" channel text"""
+    if ": " in text:
+        sender_name, message_text = text.split(": ", 1)
+        return sender_name, message_text
+    return "Unknown", text
+
+
+class ReceptionCollector:
+    """
+    Process-wide cache of flood messages keyed by fingerprint (LRU with TTL).
+    Every RX_LOG_DATA reception of a decrypted message is added once, however
+    many apps see the event, and receptions of one packet by several radios
+    share a record. Each subscribed app gets one aggregated record
+    per message, window seconds after the first reception, from its own run_in
+    timer; receptions arriving later are handed over in a follow-up delivery.
+    """
+
+    def __init__(self, ttl=300, max_size=2000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._records = OrderedDict()  # fingerprint -> record, oldest first
+        self._subscribers = {}         # app name -> (app, callback, window)
+        self._lock = threading.RLock()
+        # evicted: over max_size; dropped: removed with a delivery still pending
+        self.stats = {"messages": 0, "receptions": 0, "duplicates": 0, "deliveries": 0, "expired": 0,
+                      "evicted": 0, "dropped": 0}
+
+    def subscribe(self, app, callback, window=3):
+        """callback(record, new_receptions) runs on app window seconds after a message's first reception"""
+        with self._lock:
+            self._subscribers[app.name] = (app, callback, window)
+
+    def unsubscribe(self, app_name):
+        with self._lock:
+            self._subscribers.pop(app_name, None)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self._records
+
+    def get(self, fingerprint):
+        """Live record for a fingerprint (None if unknown or expired)"""
+        with self._lock:
+            self._expire(time.time())
+            return self._records.get(fingerprint)
+
+    def find(self, predicate):
+        """Most recent live record matching predicate(record)"""
+        with self._lock:
+            self._expire(time.time())
+            for record in reversed(self._records.values()):
+                if predicate(record):
+                    return record
+        return None
+
+    def add(self, payload, receiver=DEFAULT_RECEIVER, now=None):
+        """
+        Add one RX_LOG_DATA payload heard by receiver; returns the message record
+        (None if not a decrypted message). The same packet from several radios
+        is one message with a reception per radio. now is the reception time
+        when replaying logged events.
+        """
+        decrypted = payload.get("decrypted", {})
+        text = decrypted.get("text", "")
+        if not text or not decrypted.get("decrypted"):
+            return None
+
+        parsed = payload.get("parsed", {})
+        path_nodes = parsed.get("path_nodes", [])
+        channel_idx = decrypted.get("channel_idx")
+        timestamp = decrypted.get("timestamp")
+        fingerprint = message_fingerprint(channel_idx, timestamp, text)
+        reception_key = (tuple(path_nodes), payload.get("snr"), payload.get("rssi"), receiver)
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            self._expire(now)
+            record = self._records.get(fingerprint)
+            if record is None:
+                sender_name, message_text = split_sender(text)
+                record = {
+                    "fingerprint": fingerprint,
+                    "channel_idx": channel_idx,
+                    "timestamp": timestamp,
+                    "text": text,
+                    "sender_name": sender_name,
+                    "message_text": message_text,
+                    "first_seen": now,
+                    "receptions": [],
+                    "_keys": set(),
+                    "_delivered": {},  # app name -> receptions already handed over
+                    "_pending": set()  # app names with a delivery scheduled
+                }
+                self._records[fingerprint] = record
+                self.stats["messages"] += 1
+
+            if reception_key in record["_keys"]:
+                self.stats["duplicates"] += 1
+                return record
+            record["_keys"].add(reception_key)
+            record["receptions"].append({
+                "hops": parsed.get("path_len", 0),
+                "snr": payload.get("snr"),
+                "rssi": payload.get("rssi"),
+                "path": parsed.get("path", ""),
+                "path_nodes": path_nodes,
+                "receiver": receiver,
+                "received_at": now
+            })
+            self.stats["receptions"] += 1
+
+            for name, (app, _, window) in self._subscribers.items():
+                if name not in record["_pending"]:
+                    record["_pending"].add(name)
+                    app.run_in(self._deliver, window, fingerprint=fingerprint, subscriber=name)
+            self._evict()
+        return record
+
+    def _deliver(self, kwargs):
+        name = kwargs.get("subscriber")
+        with self._lock:
+            record = self._records.get(kwargs.get("fingerprint"))
+            subscriber = self._subscribers.get(name)
+            if record is None or subscriber is None:
+                return
+            record["_pending"].discard(name)
+            start = record["_delivered"].get(name, 0)
+            new = record["receptions"][start:]
+            record["_delivered"][name] = len(record["receptions"])
+            self.stats["deliveries"] += 1
+        if new:
+            app, callback, _ = subscriber
+            try:
+                callback(record, new)
+            except Exception as e:
+                app.log(f"Error handling receptions of {record['sender_name']}: {e}", level="ERROR")
+
+    def pop_expired(self, now):
+        """Remove and return the records first seen more than ttl before now, oldest first"""
+        expired = []
+        with self._lock:
+            cutoff = now - self.ttl
+            while self._records:
+                fingerprint, record = next(iter(self._records.items()))
+                if record["first_seen"] >= cutoff:
+                    break
+                del self._records[fingerprint]
+                expired.append(record)
+                if record["_pending"]:
+                    self.stats["dropped"] += 1
+            self.stats["expired"] += len(expired)
+        return expired
+
+    def _expire(self, now):
+        self.pop_expired(now)
+
+    def _evict(self):
+        """
+        Evict the least recent records over max_size. Records with a delivery
+        still scheduled are kept until it has run, so a burst can hold the
+        cache over max_size for a collection window but never loses receptions.
+        """
+        excess = len(self._records) - self.max_size
+        if excess <= 0:
+            return
+        evict = []
+        for fingerprint, record in self._records.items():
+            if len(evict) >= excess:
+                break
+            if not record["_pending"]:
+                evict.append(fingerprint)
+        for fingerprint in evict:
+            del self._records[fingerprint]
+        self.stats["evicted"] += len(evict)
+
+
+def shared_collector(ttl=None, max_size=None):
+    """Process-wide ReceptionCollector; ttl/max_size from any app's args are applied"""
+    global _collector
+    if _collector is None:
+        _collector = ReceptionCollector()
+    if ttl is not None:
+        _collector.ttl = float(ttl)
+    if max_size is not None:
+        _collector.max_size = int(max_size)
+    return _collector
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+# Published names
+HOP_NODES = "hop_nodes"        # pubkey -> heatmap snapshot node (meshcore_paths)
+DIRECT_LINKS = "direct_links"  # (from prefix, to prefix) -> {count, last_seen} (meshcore_directlinks_export)
+
+# data is read-only and never changes after publish; version counts publishes per name
+Snapshot = namedtuple("Snapshot", ("name", "version", "published_at", "data"))
+
+_registry = None
+
+
+class SnapshotRegistry:
+    """
+    Latest published snapshot of each producer's data, shared by all apps in
+    the process. Publishing swaps in a new Snapshot; readers take the current
+    one without locking or copying, and it stays consistent however long they
+    hold it. Subscribers are called on their own app (run_in) after a publish,
+    at most one pending call per subscriber and name.
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._subscribers = {}  # name -> {app name: (app, callback)}
+        self._pending = set()   # (name, app name) with a call scheduled
+        self._lock = threading.RLock()
+
+    def publish(self, name, data):
+        with self._lock:
+            previous = self._snapshots.get(name)
+            snapshot = Snapshot(name, previous.version + 1 if previous else 1, time.time(), data)
+            self._snapshots[name] = snapshot
+            for app_name, (app, _) in self._subscribers.get(name, {}).items():
+                if (name, app_name) not in self._pending:
+                    self._pending.add((name, app_name))
+                    app.run_in(self._notify, 0, snapshot_name=name, subscriber=app_name)
+        return snapshot
+
+    def get(self, name):
+        """Current Snapshot of name (None until its producer has published)"""
+        return self._snapshots.get(name)
+
+    def subscribe(self, app, name, callback):
+        """callback(snapshot) runs on app after each publish of name"""
+        with self._lock:
+            self._subscribers.setdefault(name, {})[app.name] = (app, callback)
+
+    def unsubscribe(self, app_name):
+        with self._lock:
+            for subscribers in self._subscribers.values():
+                subscribers.pop(app_name, None)
+
+    def _notify(self, kwargs):
+        name, app_name = kwargs.get("snapshot_name"), kwargs.get("subscriber")
+        with self._lock:
+            self._pending.discard((name, app_name))
+            subscriber = self._subscribers.get(name, {}).get(app_name)
+        if subscriber is None:
+            return
+        app, callback = subscriber
+        try:
+            callback(self._snapshots[name])
+        except Exception as e:
+            app.log(f"Error handling {name} snapshot: {e}", level="ERROR")
+
+
+class CopyOnWriteMap:
+    """
+    A producer's published view of a mapping. Changes are staged with set()
+    and discard() and published by commit() as a new read-only copy, so a
+    snapshot a reader holds is never modified. Values must not be mutated
+    after set(); stage a new value instead. A commit copies the whole map,
+    so busy producers call schedule(), which commits at most once per
+    commit_delay seconds from the app's own run_in timer.
+    """
+
+    def __init__(self, registry, name, app=None, commit_delay=1):
+        self.registry = registry
+        self.name = name
+        self.app = app
+        self.commit_delay = commit_delay
+        self._current = {}
+        self._changes = {}
+        self._removed = set()
+        self._replaced = False
+        self._commit_timer = None
+
+    def set(self, key, value):
+        self._changes[key] = value
+        self._removed.discard(key)
+
+    def discard(self, key):
+        self._changes.pop(key, None)
+        self._removed.add(key)
+
+    def replace(self, mapping):
+        """Stage a whole new mapping (after a load or an eviction pass)"""
+        self._current = dict(mapping)
+        self._changes.clear()
+        self._removed.clear()
+        self._replaced = True
+
+    def commit(self):
+        """Publish the staged changes; returns the Snapshot, or None if nothing changed"""
+        if not (self._changes or self._removed or self._replaced):
+            return None
+        current = dict(self._current)
+        current.update(self._changes)
+        for key in self._removed:
+            current.pop(key, None)
+        self._current = current
+        self._changes, self._removed, self._replaced = {}, set(), False
+        return self.registry.publish(self.name, MappingProxyType(current))
+
+    def schedule(self):
+        """Commit the staged changes commit_delay seconds from now (one pending commit at a time)"""
+        if self.app is None:
+            self.commit()
+        elif self._commit_timer is None:
+            self._commit_timer = self.app.run_in(self._scheduled_commit, self.commit_delay)
+
+    def _scheduled_commit(self, kwargs=None):
+        self._commit_timer = None
+        try:
+            self.commit()
+        except Exception as e:
+            self.app.log(f"Error publishing {self.name}: {e}", level="ERROR")
+
+
+def shared_registry():
+    """Process-wide SnapshotRegistry"""
+    global _registry
+    if _registry is None:
+        _registry = SnapshotRegistry()
+    return _registry
@@ -2,15 +2,26 @@ import appdaemon.plugins.hass.hassapi as hass
 import json
 import os
 import time
-from datetime import datetime
+import meshcore_contacts
+import meshcore_derive
+import meshcore_history
+import meshcore_registry
+import meshcore_startup
 
 class MeshCoreSnapshotRecorder(hass.Hass):
     """
     Records snapshots of heatmap and directlinks data every 5 minutes.
     Stores 24 hours of history server-side so playback works without browser.
     
-    Records RAW data from persistence files (not threshold-filtered).
-    Playback HTML applies threshold filtering client-side.
+    Records RAW data (not threshold-filtered) from the hop nodes and direct
+    links that meshcore_paths and meshcore_directlinks_export publish in the
+    shared registry; the persistence files are only read when an app is not
+    running. Playback HTML applies threshold filtering client-side.
+    
+    History is kept as hourly NDJSON segments plus an index per dataset in
+    /homeassistant/www/meshcore_history/, so a snapshot is a one-line append
+    and playback only loads the hours it shows. Older history is downsampled
+    into hourly (30 days) and daily (1 year) tiers as snapshots come in.
     """
 
     def initialize(self):
@@ -19,46 +30,87 @@ class MeshCoreSnapshotRecorder(hass.Hass):
         # File paths - use /homeassistant for HA OS Add-on
         self.www_path = "/homeassistant/www"
         
-        # RAW persistence files (contains ALL data, not threshold-filtered)
+        # RAW persistence files (contains ALL data, not threshold-filtered) - fallback
+        # when meshcore_paths / meshcore_directlinks_export don't publish in this process
         self.hops_persist_file = f"{self.www_path}/meshcore_hops_data.json"
         self.directlinks_persist_file = f"{self.www_path}/meshcore_directlinks_persist.json"
         
-        # History output files
+        # Monolithic history files of older versions - imported once into the segments
         self.heatmap_history_file = f"{self.www_path}/meshcore_heatmap_history.json"
         self.directlinks_history_file = f"{self.www_path}/meshcore_directlinks_history.json"
         
         # Settings
-        self.max_snapshots = 288  # 24 hours at 5-min intervals
+        self.history_hours = int(self.args.get("history_hours", 24))
+        self.history_retention = {
+            "": self.history_hours * 3600,
+            "_hourly": int(self.args.get("hourly_history_days", 30)) * 86400,
+            "_daily": int(self.args.get("daily_history_days", 365)) * 86400
+        }
         self.snapshot_interval = 5 * 60  # 5 minutes in seconds
         self.min_snapshot_gap = 30  # Minimum seconds between snapshots
         self.last_snapshot_time = 0
+        self._activity_timer = None
+        
+        # In-memory data from the producing apps; link ends are resolved with the
+        # shared contact index, like the direct links export does
+        self.registry = meshcore_registry.shared_registry()
+        self.contacts = meshcore_contacts.shared_index(self.args.get("my_pubkey", ""))
+        self.recorded_versions = {}  # registry name -> version of the last snapshot taken from it
         
-        # Load existing history
-        self.heatmap_history = self.load_history(self.heatmap_history_file)
-        self.directlinks_history = self.load_history(self.directlinks_history_file)
+        # Segmented history, one store per dataset; binary_history adds a columnar
+        # .bin copy of every segment for the playback pages (?binary)
+        self.binary_history = bool(self.args.get("binary_history", False))
+        history_dir = self.args.get("history_dir", meshcore_history.DEFAULT_HISTORY_DIR)
+        self.heatmap_history = self.open_history(history_dir, "heatmap", self.heatmap_history_file)
+        self.directlinks_history = self.open_history(history_dir, "directlinks", self.directlinks_history_file)
         
         self.log(f"Loaded {len(self.heatmap_history)} heatmap snapshots")
         self.log(f"Loaded {len(self.directlinks_history)} directlinks snapshots")
         
-        # Take initial snapshot
-        self.run_in(self.take_snapshots, 10)
+        # Take initial snapshot - after the entity restore, staggered against the exports
+        first_snapshot = 30 + meshcore_startup.startup_offset(self.name)
+        self.run_in(self.take_snapshots, first_snapshot)
         
         # Schedule regular snapshots every 5 minutes
-        self.run_every(self.take_snapshots, f"now+60", self.snapshot_interval)
+        self.run_every(self.take_snapshots, f"now+{first_snapshot + self.snapshot_interval}", self.snapshot_interval)
+        
+        # Snapshot on message activity: the producers publish once a message's
+        # hops and links are recorded, so the data is already current
+        self.registry.subscribe(self, meshcore_registry.HOP_NODES, self.on_published)
+        self.registry.subscribe(self, meshcore_registry.DIRECT_LINKS, self.on_published)
         
-        # Listen for MeshCore events to capture on message activity
-        self.listen_event(self.on_meshcore_event, "meshcore_raw_event")
+        # Range queries for playback: /api/appdaemon/meshcore_history?dataset=..&start=..&end=..&step=..&tier=..
+        self.register_endpoint(self.api_history, "meshcore_history")
+        
+    def open_history(self, history_dir, dataset, legacy_file):
+        """Open a dataset's tiered history, importing the old history file on first run"""
+        store = meshcore_history.TieredHistory(history_dir, dataset, retention=self.history_retention,
+                                               binary=self.binary_history)
+        try:
+            if store.load():
+                return store
+        except Exception as e:
+            self.log(f"Error loading {dataset} history index: {e}", level="WARNING")
         
+        snapshots = self.load_history(legacy_file)
+        if snapshots:
+            try:
+                store.extend(snapshots)
+                self.log(f"Imported {len(snapshots)} {dataset} snapshots from {legacy_file}")
+            except Exception as e:
+                self.log(f"Error importing {dataset} history: {e}", level="WARNING")
+        return store
+    
     def load_history(self, filepath):
-        """Load snapshot history from file"""
+        """Load snapshot history from an old monolithic history file"""
         try:
             if os.path.exists(filepath):
                 with open(filepath, 'r') as f:
                     data = json.load(f)
                     snapshots = data.get("snapshots", [])
                     
-                    # Clean old snapshots (older than 24 hours)
-                    cutoff = time.time() - (24 * 60 * 60)
+                    # Clean old snapshots (older than the history window)
+                    cutoff = time.time() - self.history_hours * 3600
                     snapshots = [s for s in snapshots if s.get("timestamp", 0) > cutoff]
                     
                     return snapshots
@@ -66,42 +118,43 @@ class MeshCoreSnapshotRecorder(hass.Hass):
             self.log(f"Error loading history from {filepath}: {e}", level="WARNING")
         return []
     
-    def save_history(self, filepath, snapshots):
-        """Save snapshot history to file"""
+    def save_snapshot(self, store, snapshot):
+        """Append a snapshot to the dataset's current segment (and its downsampled tiers)"""
         try:
-            # Keep only last max_snapshots
-            if len(snapshots) > self.max_snapshots:
-                snapshots = snapshots[-self.max_snapshots:]
-            
-            data = {
+            store.append(snapshot)
+        except Exception as e:
+            self.log(f"Error saving {store.dataset} snapshot: {e}", level="ERROR")
+    
+    def api_history(self, data, kwargs):
+        """AppDaemon endpoint: /api/appdaemon/meshcore_history?dataset=..&start=..&end=..&step=..&tier=.."""
+        try:
+            data = data or {}
+            dataset = data.get("dataset", "heatmap")
+            store = {"heatmap": self.heatmap_history, "directlinks": self.directlinks_history}.get(dataset)
+            if store is None:
+                return {"error": f"unknown dataset {dataset}"}, 404
+            start = float(data["start"]) if data.get("start") not in (None, "") else None
+            end = float(data["end"]) if data.get("end") not in (None, "") else None
+            step = float(data["step"]) if data.get("step") not in (None, "") else None
+            # Tier 0 = every snapshot, 1 = hourly, 2 = daily; picked from the range by default
+            # (without start, the finest tier that holds any snapshots)
+            tier = int(data["tier"]) if data.get("tier") not in (None, "") else store.tier_for_range(start, end)
+            tier = max(0, min(tier, len(store.stores) - 1))
+            snapshots = store.frames(start, end, step, tier)
+            return {
+                "dataset": dataset,
+                "tier": tier,
                 "snapshots": snapshots,
                 "count": len(snapshots),
-                "max_snapshots": self.max_snapshots,
-                "snapshot_interval_minutes": self.snapshot_interval // 60,
-                "last_updated": datetime.now().isoformat(),
-                "version": int(time.time())  # Unix timestamp for cache busting
-            }
-            
-            with open(filepath, 'w') as f:
-                json.dump(data, f)
-            
-            self.log(f"Saved history to {filepath} ({len(snapshots)} snapshots)")
-                
+                "snapshot_interval_minutes": self.snapshot_interval // 60
+            }, 200
         except Exception as e:
-            self.log(f"Error saving history to {filepath}: {e}", level="ERROR")
+            self.log(f"Error answering history query: {e}", level="ERROR")
+            return {"error": str(e)}, 500
     
     def get_data_hash(self, nodes):
         """Create a simple hash to detect data changes"""
-        if not nodes:
-            return ""
-        try:
-            # Hash based on node count and first/last few nodes
-            hash_str = str(len(nodes))
-            if nodes:
-                hash_str += json.dumps([(n.get("name", ""), n.get("use_count", n.get("link_count", 0))) for n in nodes[:10]])
-            return hash_str
-        except:
-            return ""
+        return meshcore_derive.snapshot_hash(nodes)
     
     def take_snapshots(self, kwargs=None):
         """Take snapshots of both heatmap and directlinks data"""
@@ -110,23 +163,22 @@ class MeshCoreSnapshotRecorder(hass.Hass):
         self.take_directlinks_snapshot()
         self.last_snapshot_time = time.time()
     
-    def on_meshcore_event(self, event_name, data, kwargs):
-        """Handle MeshCore events - take snapshot on message activity"""
-        try:
-            event_type = data.get("event_type", "")
-            
-            # Only snapshot on actual message/data events - not NO_MORE_MSGS or battery polls
-            if event_type in ("EventType.RX_LOG_DATA", "EventType.CONTACT_MSG_RECV", "EventType.CHANNEL_MSG_RECV"):
-                # Rate limit - don't snapshot more than once per 30 seconds
-                now = time.time()
-                if (now - self.last_snapshot_time) >= self.min_snapshot_gap:
-                    # Delay slightly to let other scripts update the data files first
-                    self.run_in(self.take_snapshots_on_event, 5)
-        except Exception as e:
-            self.log(f"Error handling meshcore event: {e}", level="ERROR")
+    def terminate(self):
+        self.registry.unsubscribe(self.name)
+    
+    def on_published(self, snapshot):
+        """A producer published new data - snapshot now, or once min_snapshot_gap has passed"""
+        if self._activity_timer is not None:
+            return
+        wait = self.min_snapshot_gap - (time.time() - self.last_snapshot_time)
+        if wait <= 0:
+            self.take_snapshots_on_event()
+        else:
+            self._activity_timer = self.run_in(self.take_snapshots_on_event, wait)
     
     def take_snapshots_on_event(self, kwargs=None):
-        """Take snapshots triggered by event (with rate limiting)"""
+        """Take snapshots triggered by message activity (with rate limiting)"""
+        self._activity_timer = None
         now = time.time()
         if (now - self.last_snapshot_time) >= self.min_snapshot_gap:
             self.log("Taking snapshot on message activity...")
@@ -134,40 +186,41 @@ class MeshCoreSnapshotRecorder(hass.Hass):
             self.take_directlinks_snapshot()
             self.last_snapshot_time = now
     
+    def unchanged_since_recorded(self, name):
+        """(published snapshot, True if it was already recorded); snapshot is None without a producer"""
+        published = self.registry.get(name)
+        if published is None:
+            return None, False
+        return published, self.recorded_versions.get(name) == published.version
+    
+    def read_persisted(self, filepath, key):
+        """Raw data under key in a persistence file (fallback without a publishing app)"""
+        if not os.path.exists(filepath):
+            self.log(f"Persistence file not found: {filepath}")
+            return None
+        with open(filepath, 'r') as f:
+            file_data = json.load(f)
+        raw_data = file_data.get(key, file_data)
+        if not raw_data or not isinstance(raw_data, dict):
+            self.log(f"No valid data in {filepath}")
+            return None
+        return raw_data
+    
     def take_heatmap_snapshot(self):
-        """Take a snapshot of heatmap data from RAW persistence file"""
+        """Take a snapshot of the RAW hop node data published by meshcore_paths"""
         try:
-            # Try to read from hops persistence file (raw data)
-            if not os.path.exists(self.hops_persist_file):
-                self.log(f"Hops persistence file not found: {self.hops_persist_file}")
-                return
-            
-            with open(self.hops_persist_file, 'r') as f:
-                file_data = json.load(f)
-            
-            # Data is nested under 'hop_nodes_used' key
-            raw_data = file_data.get("hop_nodes_used", file_data)
-            
-            if not raw_data or not isinstance(raw_data, dict):
-                self.log("No valid data in hops persistence file")
+            published, recorded = self.unchanged_since_recorded(meshcore_registry.HOP_NODES)
+            if recorded:
+                self.log(f"Heatmap data unchanged, skipping snapshot ({len(self.heatmap_history)} total)")
                 return
-            
-            # Convert raw persistence data to node list with coordinates
-            nodes = []
-            for pubkey, data in raw_data.items():
-                if not isinstance(data, dict):
-                    continue
-                coords = data.get("coords", {})
-                if coords and coords.get("lat") and coords.get("lon"):
-                    nodes.append({
-                        "name": coords.get("name", "Unknown"),
-                        "lat": coords.get("lat"),
-                        "lon": coords.get("lon"),
-                        "use_count": data.get("use_count", 0),
-                        "last_used": data.get("last_used", 0),
-                        "node_type": coords.get("node_type", "Unknown"),
-                        "pubkey": pubkey
-                    })
+            if published is not None:
+                # Already snapshot nodes - immutable, so they are stored as they are
+                nodes = list(published.data.values())
+            else:
+                raw_data = self.read_persisted(self.hops_persist_file, "hop_nodes_used")
+                if raw_data is None:
+                    return
+                nodes = meshcore_derive.heatmap_snapshot_nodes(raw_data)
             
             if not nodes:
                 self.log("No nodes with coordinates in hops data")
@@ -175,8 +228,9 @@ class MeshCoreSnapshotRecorder(hass.Hass):
             
             # Check if data has changed
             current_hash = self.get_data_hash(nodes)
-            if self.heatmap_history:
-                last_hash = self.get_data_hash(self.heatmap_history[-1].get("nodes", []))
+            last_frame = self.heatmap_history.last_frame()
+            if last_frame:
+                last_hash = self.get_data_hash(last_frame.get("nodes", []))
                 if current_hash == last_hash:
                     self.log(f"Heatmap data unchanged, skipping snapshot ({len(self.heatmap_history)} total)")
                     return  # No change, skip
@@ -189,8 +243,9 @@ class MeshCoreSnapshotRecorder(hass.Hass):
                 "threshold_hours": None  # Raw data - no threshold applied
             }
             
-            self.heatmap_history.append(snapshot)
-            self.save_history(self.heatmap_history_file, self.heatmap_history)
+            self.save_snapshot(self.heatmap_history, snapshot)
+            if published is not None:
+                self.recorded_versions[published.name] = published.version
             
             self.log(f"Heatmap snapshot taken: {len(self.heatmap_history)} total ({len(nodes)} nodes)")
             
@@ -198,114 +253,28 @@ class MeshCoreSnapshotRecorder(hass.Hass):
             self.log(f"Error taking heatmap snapshot: {e}", level="ERROR")
     
     def take_directlinks_snapshot(self):
-        """Take a snapshot of directlinks data from RAW persistence file"""
+        """Take a snapshot of the RAW direct links published by meshcore_directlinks_export"""
         try:
-            # Read from the raw persistence file
-            if not os.path.exists(self.directlinks_persist_file):
-                self.log(f"Directlinks persistence file not found: {self.directlinks_persist_file}")
-                return
-            
-            with open(self.directlinks_persist_file, 'r') as f:
-                file_data = json.load(f)
-            
-            # Data is nested under 'direct_links' key
-            raw_links = file_data.get("direct_links", file_data)
-            
-            if not raw_links or not isinstance(raw_links, dict):
-                self.log("No valid data in directlinks persistence file")
+            published, recorded = self.unchanged_since_recorded(meshcore_registry.DIRECT_LINKS)
+            if recorded:
+                self.log(f"Directlinks data unchanged, skipping snapshot ({len(self.directlinks_history)} total)")
                 return
+            if published is not None:
+                raw_links = {}
+                for (node_a, node_b), info in published.data.items():
+                    raw_links.setdefault(node_a, {})[node_b] = info
+            else:
+                raw_links = self.read_persisted(self.directlinks_persist_file, "direct_links")
+                if raw_links is None:
+                    return
             
-            # Build coordinate lookup from contact sensors
-            coord_lookup = {}
-            try:
-                all_states = self.get_state()
-                for entity_id, state_data in all_states.items():
-                    if not (entity_id.startswith("binary_sensor.meshcore_") and "_contact" in entity_id):
-                        continue
-                    attrs = state_data.get("attributes", {})
-                    pubkey = attrs.get("pubkey_prefix", "")
-                    lat = attrs.get("adv_lat")
-                    lon = attrs.get("adv_lon")
-                    name = attrs.get("adv_name", "Unknown")
-                    node_type = attrs.get("node_type_str", "Unknown")
-                    last_advert = attrs.get("last_advert", 0)
-                    
-                    if pubkey and lat and lon:
-                        coord_lookup[pubkey[:2]] = {
-                            "name": name,
-                            "lat": lat,
-                            "lon": lon,
-                            "node_type": node_type,
-                            "pubkey": pubkey,
-                            "last_advert": last_advert
-                        }
-            except Exception as e:
-                self.log(f"Error building coord lookup: {e}", level="WARNING")
-            
-            # Build nodes and links lists
-            nodes = {}
-            all_links = []
-            current_time = time.time()
-            
-            for from_prefix, targets in raw_links.items():
-                if not isinstance(targets, dict):
-                    continue
-                    
-                # Get coords for source node
-                from_coords = coord_lookup.get(from_prefix, {})
-                if not from_coords.get("lat"):
-                    continue
-                
-                # Add source node
-                if from_prefix not in nodes:
-                    nodes[from_prefix] = {
-                        "name": from_coords.get("name", "Unknown"),
-                        "lat": from_coords.get("lat"),
-                        "lon": from_coords.get("lon"),
-                        "node_type": from_coords.get("node_type", "Unknown"),
-                        "pubkey": from_coords.get("pubkey", from_prefix),
-                        "link_count": 0,
-                        "last_seen": from_coords.get("last_advert", current_time)
-                    }
-                
-                for to_prefix, link_data in targets.items():
-                    if not isinstance(link_data, dict):
-                        continue
-                    
-                    # Get coords for target node
-                    to_coords = coord_lookup.get(to_prefix, {})
-                    if not to_coords.get("lat"):
-                        continue
-                    
-                    # Add target node
-                    if to_prefix not in nodes:
-                        nodes[to_prefix] = {
-                            "name": to_coords.get("name", "Unknown"),
-                            "lat": to_coords.get("lat"),
-                            "lon": to_coords.get("lon"),
-                            "node_type": to_coords.get("node_type", "Unknown"),
-                            "pubkey": to_coords.get("pubkey", to_prefix),
-                            "link_count": 0,
-                            "last_seen": to_coords.get("last_advert", current_time)
-                        }
-                    
-                    # Increment link counts
-                    nodes[from_prefix]["link_count"] += 1
-                    
-                    # Add link
-                    last_seen = link_data.get("last_seen", current_time)
-                    all_links.append({
-                        "from_name": from_coords.get("name", "Unknown"),
-                        "from_lat": from_coords.get("lat"),
-                        "from_lon": from_coords.get("lon"),
-                        "to_name": to_coords.get("name", "Unknown"),
-                        "to_lat": to_coords.get("lat"),
-                        "to_lon": to_coords.get("lon"),
-                        "count": link_data.get("count", 1),
-                        "last_seen": last_seen
-                    })
+            # Nobody keeps the shared contact index current - refresh it ourselves
+            if not self.contacts.maintained_by:
+                self.contacts.update(self.get_state())
             
-            nodes_list = list(nodes.values())
+            # Build nodes and links lists - both ends of a link resolved together
+            nodes_list, all_links = meshcore_derive.directlinks_snapshot(
+                raw_links, meshcore_derive.index_resolver(self.contacts), time.time())
             
             if not nodes_list:
                 self.log("No nodes with coordinates in directlinks data")
@@ -313,8 +282,9 @@ class MeshCoreSnapshotRecorder(hass.Hass):
             
             # Check if data has changed
             current_hash = self.get_data_hash(nodes_list)
-            if self.directlinks_history:
-                last_hash = self.get_data_hash(self.directlinks_history[-1].get("nodes", []))
+            last_frame = self.directlinks_history.last_frame()
+            if last_frame:
+                last_hash = self.get_data_hash(last_frame.get("nodes", []))
                 if current_hash == last_hash:
                     self.log(f"Directlinks data unchanged, skipping snapshot ({len(self.directlinks_history)} total)")
                     return  # No change, skip
@@ -327,8 +297,9 @@ class MeshCoreSnapshotRecorder(hass.Hass):
                 "threshold_hours": None  # Raw data - no threshold applied
             }
             
-            self.directlinks_history.append(snapshot)
-            self.save_history(self.directlinks_history_file, self.directlinks_history)
+            self.save_snapshot(self.directlinks_history, snapshot)
+            if published is not None:
+                self.recorded_versions[published.name] = published.version
             
             self.log(f"Directlinks snapshot taken: {len(self.directlinks_history)} total ({len(nodes_list)} nodes, {len(all_links)} links)")
             
@@ -0,0 +1,142 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Seconds between the first runs of the staggered apps
+DEFAULT_STAGGER_SPACING = 10
+
+_slots = {}  # app name -> stagger slot, stable across app reloads
+_scheduler = None
+
+
+def startup_offset(app_name, spacing=DEFAULT_STAGGER_SPACING):
+    """Per-app offset (slot * spacing seconds) so the apps' first full scans don't coincide"""
+    slot = _slots.setdefault(app_name, len(_slots))
+    return slot * spacing
+
+
+class TokenBucket:
+    """rate tokens per second, banking at most burst"""
+
+    def __init__(self, rate=20.0, burst=50):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, wanted):
+        """Take up to wanted whole tokens; returns how many were granted"""
+        self._refill()
+        granted = min(wanted, int(self.tokens))
+        self.tokens -= granted
+        return granted
+
+    def give_back(self, count):
+        self.tokens = min(self.burst, self.tokens + count)
+
+    def wait_time(self):
+        """Seconds until the next token is available"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RestoreScheduler:
+    """
+    Process-wide startup restoration queue.
+    Apps submit (key, value) items with an apply callback; items from all apps
+    are replayed most recent first and paced by one token bucket, so a restart
+    doesn't flood the HA websocket with set_state calls. The queue is drained
+    from the run_in timer of an app that has work pending.
+    """
+
+    def __init__(self, rate=20.0, burst=50):
+        self.bucket = TokenBucket(rate, burst)
+        self._heap = []  # (-recency, seq, batch, key, value)
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+        self._driver = None
+        self.stats = {"applied": 0, "skipped": 0, "errors": 0}
+
+    def submit(self, app, label, items, apply, recency, on_done=None):
+        """
+        Queue items for restoration. apply(key, value) returns True if it
+        pushed anything to HA (only those use a token). on_done(applied, skipped)
+        runs on the app once all of its items are through.
+        """
+        batch = {"app": app, "label": label, "apply": apply, "on_done": on_done,
+                 "pending": 0, "applied": 0, "skipped": 0}
+        with self._lock:
+            for key, value in items:
+                heapq.heappush(self._heap, (-(recency(value) or 0), next(self._seq), batch, key, value))
+                batch["pending"] += 1
+            if not batch["pending"]:
+                self._finish(batch)
+                return
+            if self._driver is None:
+                self._driver = app
+                app.run_in(self._drain, 1)
+
+    def pending(self, app_name=None):
+        return sum(1 for entry in self._heap if app_name is None or entry[2]["app"].name == app_name)
+
+    def cancel(self, app_name):
+        """Drop an app's queued items (on terminate); hands the timer to another app if needed"""
+        with self._lock:
+            self._heap = [e for e in self._heap if e[2]["app"].name != app_name]
+            heapq.heapify(self._heap)
+            if self._driver is not None and self._driver.name == app_name:
+                self._driver = self._heap[0][2]["app"] if self._heap else None
+                if self._driver is not None:
+                    self._driver.run_in(self._drain, 1)
+
+    def _drain(self, kwargs=None):
+        with self._lock:
+            granted = self.bucket.take(len(self._heap))
+            used = 0
+            while self._heap and used < granted:
+                _, _, batch, key, value = heapq.heappop(self._heap)
+                try:
+                    if batch["apply"](key, value):
+                        batch["applied"] += 1
+                        used += 1
+                    else:
+                        batch["skipped"] += 1
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    batch["app"].log(f"Error restoring {batch['label']} {key}: {e}", level="ERROR")
+                batch["pending"] -= 1
+                if not batch["pending"]:
+                    self._finish(batch)
+            self.bucket.give_back(granted - used)
+
+            if not self._heap:
+                self._driver = None
+                return
+            self._driver.run_in(self._drain, max(1, round(self.bucket.wait_time())))
+
+    def _finish(self, batch):
+        self.stats["applied"] += batch["applied"]
+        self.stats["skipped"] += batch["skipped"]
+        if batch["on_done"]:
+            try:
+                batch["on_done"](batch["applied"], batch["skipped"])
+            except Exception as e:
+                batch["app"].log(f"Error finishing {batch['label']} restore: {e}", level="ERROR")
+
+
+def shared_scheduler(rate=None, burst=None):
+    """Process-wide RestoreScheduler; rate/burst from any app's args are applied"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RestoreScheduler()
+    if rate is not None:
+        _scheduler.bucket.rate = float(rate)
+    if burst is not None:
+        _scheduler.bucket.burst = int(burst)
+    return _scheduler
@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+Rebuild the panel's derived data from archived meshcore_raw_event logs.
+
+Replays RX_LOG_DATA receptions through the same code the apps use
+(meshcore_receptions, meshcore_contacts, meshcore_derive) and writes fresh
+copies of the persistence files:
+
+    meshcore_directlinks_persist.json   direct_links (meshcore_directlinks_export)
+    meshcore_hops_data.json             hop_nodes_used (meshcore_paths)
+    meshcore_hops_sensors.json          hops sensors (meshcore_hops)
+    meshcore_last_messages.json         last message times (meshcore_hops)
+    meshcore_hops_rollups_persist.json  hourly signal rollups (meshcore_hops)
+    meshcore_history/                   playback history segments (meshcore_snapshot_recorder)
+
+Logs are NDJSON files (optionally .gz), one event per line: either the event
+data itself ({"event_type": "EventType.RX_LOG_DATA", "payload": {...},
+"timestamp": ...}) or a Home Assistant event ({"event_type":
+"meshcore_raw_event", "data": {...}, "time_fired": "..."}). Each file must be
+in time order.
+
+The logs are indexed first (a timestamp sampled every INDEX_STEP bytes) and
+split into time ranges of about equal size, one per worker process - a single
+large file is split as well. Each worker seeks to a little before its range
+and reads on past its end by the fingerprint TTL, so messages crossing a
+boundary are collected whole and counted by exactly one worker. The partial
+results are then merged in time order.
+
+Usage:
+    python meshcore_rebuild.py --states states.json --output rebuilt/ logs/*.ndjson.gz
+"""
+import argparse
+import copy
+import gzip
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "apps"))
+
+import meshcore_contacts  # noqa: E402
+import meshcore_derive  # noqa: E402
+import meshcore_history  # noqa: E402
+import meshcore_receivers  # noqa: E402
+import meshcore_receptions  # noqa: E402
+
+RX_LOG_DATA = "EventType.RX_LOG_DATA"
+SNAPSHOT_INTERVAL = 5 * 60  # as meshcore_snapshot_recorder
+INDEX_STEP = 256 * 1024     # uncompressed bytes between sampled timestamps
+
+
+# -----------------------------------------------------------------------------
+# Input
+# -----------------------------------------------------------------------------
+
+def parse_time(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+def unwrap_event(obj):
+    """(timestamp, event data) of one log line, or None if it has no time"""
+    data = obj.get("data") if isinstance(obj.get("data"), dict) else obj
+    try:
+        ts = parse_time(obj.get("time_fired") or data.get("timestamp") or obj.get("timestamp"))
+    except ValueError:
+        return None
+    return (ts, data) if ts is not None else None
+
+
+def open_log(path):
+    """Binary reader of a log; offsets are in uncompressed bytes for .gz too"""
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def line_timestamp(line):
+    try:
+        event = unwrap_event(json.loads(line))
+    except ValueError:
+        return None
+    return event[0] if event else None
+
+
+def read_events(path, offset=0):
+    """(timestamp, event data) for every RX_LOG_DATA line of a log file from a line-start offset"""
+    with open_log(path) as f:
+        if offset:
+            f.seek(offset)
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = unwrap_event(json.loads(line))
+            except ValueError:
+                continue
+            if event and event[1].get("event_type") == RX_LOG_DATA:
+                yield event
+
+
+def index_log(path, step=INDEX_STEP):
+    """
+    Sparse time index of a log: (path, [(line offset, timestamp)], size) with
+    about one sample every step bytes plus the last line. Lines in between are
+    read but not parsed.
+    """
+    samples = []
+    offset = next_sample = 0
+    last = None
+    with open_log(path) as f:
+        for line in f:
+            if offset >= next_sample:
+                ts = line_timestamp(line) if line.strip() else None
+                if ts is not None:
+                    samples.append((offset, ts))
+                    next_sample = offset + step
+            if line.strip():
+                last = (offset, line)
+            offset += len(line)
+    if last and samples and last[0] > samples[-1][0]:
+        ts = line_timestamp(last[1])
+        if ts is not None:
+            samples.append((last[0], ts))
+    return path, samples, offset
+
+
+def load_states(path):
+    """HA states as {entity_id: {"state", "attributes"}} from /api/states or AppDaemon get_state() output"""
+    if not path:
+        return {}
+    with open(path, "r") as f:
+        states = json.load(f)
+    if isinstance(states, list):
+        return {s["entity_id"]: s for s in states if "entity_id" in s}
+    return states
+
+
+# -----------------------------------------------------------------------------
+# Worker
+# -----------------------------------------------------------------------------
+
+def empty_slice():
+    return {"direct_links": {}, "hop_nodes_used": {}}
+
+
+def rebuild_partition(task):
+    """Replay one time range; returns the partial results for the merge step"""
+    states = task["states"]
+    start, end, ttl, window = task["start"], task["end"], task["ttl"], task["window"]
+
+    contacts = meshcore_contacts.ContactIndex(task["my_pubkey"])
+    contacts.update(states)
+    receivers = meshcore_receivers.ReceiverRegistry()
+    receivers.configure(task["receivers"], task["my_pubkey"])
+    contacts.set_receivers(receivers.pubkeys())
+    my_coords = contacts.me()
+    names = meshcore_derive.name_to_pubkey(states)
+    receiver_name = receivers.name if receivers.multiple() else None
+    locations = {}
+
+    collector = meshcore_receptions.ReceptionCollector(ttl=ttl, max_size=sys.maxsize)
+    base = empty_slice()
+    intervals = {}  # interval start -> slice, inside the history window only
+    totals = {"sensors": {}, "receptions": {}, "last_messages": {}, "rollups": {}}
+    stats = {"events": 0, "messages": 0}
+
+    def slice_at(ts):
+        if ts < task["history_start"]:
+            return base
+        return intervals.setdefault(int(ts // SNAPSHOT_INTERVAL) * SNAPSHOT_INTERVAL, empty_slice())
+
+    def handle(record, new_receptions, ts):
+        part = slice_at(ts)
+
+        # meshcore_directlinks_export
+        for reception in meshcore_derive.distinct_new_paths(record, new_receptions):
+            for node_a, node_b in meshcore_derive.path_links(reception["path_nodes"]):
+                meshcore_derive.record_direct_link(part["direct_links"], node_a, node_b, ts)
+                meshcore_derive.record_direct_link(part["direct_links"], node_b, node_a, ts)
+            contacts.resolve_path(reception["path_nodes"], origin=receivers.origin(reception["receiver"], contacts))
+
+        # meshcore_paths
+        longest = meshcore_derive.path_to_draw(record, new_receptions)
+        if longest:
+            origin = receivers.origin(longest["receiver"], contacts) or my_coords
+            picks = contacts.resolve_path(longest["path_nodes"], origin=origin)
+            for prefix, coords in zip(longest["path_nodes"], picks):
+                if coords:
+                    meshcore_derive.track_hop_node(part["hop_nodes_used"], prefix, coords, ts, task["recent_hours"],
+                                                   task["activity_half_life_hours"])
+
+        # meshcore_hops
+        sender_name = record["sender_name"]
+        pubkey = meshcore_derive.lookup_pubkey(names, sender_name)
+        node_key = pubkey or meshcore_derive.sanitize_entity_name(sender_name)
+        for r in new_receptions:
+            meshcore_derive.record_rollup(totals["rollups"], task["rollup_hours"], node_key, sender_name,
+                                          r["hops"], r["snr"], r["rssi"], r["received_at"])
+        if (pubkey, sender_name) not in locations:
+            locations[(pubkey, sender_name)] = meshcore_derive.contact_location(states, pubkey, sender_name)
+        state, attributes = meshcore_derive.hops_sensor_attributes(
+            record, pubkey, locations[(pubkey, sender_name)], ts, receiver_name=receiver_name)
+        # Same attribute budget as meshcore_hops.publish_hops_sensor
+        sensor_id = f"sensor.meshcore_hops_{node_key}"
+        stored = meshcore_derive.apply_attribute_budget(
+            attributes, task["max_receptions"], task["message_text_length"],
+            task["compact_attributes"], task["reception_detail"] == "store")
+        totals["sensors"][sensor_id] = {"state": state, "attributes": attributes}
+        if stored is not None:
+            totals["receptions"][sensor_id] = stored
+        if pubkey:
+            totals["last_messages"][pubkey] = ts
+
+    def deliver(record):
+        """As the collector would: all receptions after the window, late ones in a follow-up"""
+        if start is not None and record["first_seen"] < start:
+            return  # Belongs to the previous time range
+        stats["messages"] += 1
+        window_end = record["first_seen"] + window
+        initial = [r for r in record["receptions"] if r["received_at"] <= window_end]
+        late = record["receptions"][len(initial):]
+        if initial:
+            handle(dict(record, receptions=initial), initial, window_end)
+        if late:
+            handle(record, late, late[-1]["received_at"])
+
+    for path, offset in task["files"]:
+        for ts, data in read_events(path, offset):
+            if start is not None and ts < start - ttl:
+                continue
+            if end is not None and ts >= end + ttl:
+                break
+            payload = data.get("payload", {})
+            if end is not None and ts >= end:
+                # Past the range - only late receptions of messages already collected
+                decrypted = payload.get("decrypted", {})
+                fingerprint = meshcore_receptions.message_fingerprint(
+                    decrypted.get("channel_idx"), decrypted.get("timestamp"), decrypted.get("text", ""))
+                if fingerprint not in collector:
+                    continue
+            for record in collector.pop_expired(ts):
+                deliver(record)
+            collector.add(payload, meshcore_receivers.receiver_of(data), now=ts)
+            if (start is None or ts >= start) and (end is None or ts < end):
+                stats["events"] += 1
+
+    for record in collector.pop_expired(float("inf")):
+        deliver(record)
+
+    return {
+        "index": task["index"],
+        "base": base,
+        "intervals": intervals,
+        "totals": totals,
+        "adjacency": contacts.export_adjacency(),
+        "stats": stats
+    }
+
+
+# -----------------------------------------------------------------------------
+# Merge
+# -----------------------------------------------------------------------------
+
+def merge_links(into, links):
+    for node_a, connections in links.items():
+        target = into.setdefault(node_a, {})
+        for node_b, info in connections.items():
+            existing = target.get(node_b)
+            if existing is None:
+                target[node_b] = dict(info)
+            else:
+                existing["count"] += info["count"]
+                existing["last_seen"] = max(existing["last_seen"], info["last_seen"])
+
+
+def merge_hop_nodes(into, hop_nodes, recent_hours, half_life_hours):
+    """Merge hop node uses (later slices last, so use buckets stay in time order)"""
+    for key, data in hop_nodes.items():
+        existing = into.get(key)
+        if existing is None:
+            into[key] = copy.deepcopy(data)
+            continue
+        existing["use_count"] += data["use_count"]
+        if data["last_used"] >= existing["last_used"]:
+            existing["last_used"] = data["last_used"]
+            existing["coords"] = data["coords"]
+        for hour, count in data.get("use_buckets", []):
+            meshcore_derive.count_recent_use(existing, hour, recent_hours, count)
+        if data.get("activity"):
+            meshcore_derive.add_activity(existing, data["activity_at"], half_life_hours, data["activity"])
+
+
+def merge_rollups(into, rollups):
+    """Merge rollup rings into {node_key: {"name", "buckets": {hour_start: bucket}}}"""
+    for node_key, node in rollups.items():
+        target = into.setdefault(node_key, {"name": node["name"], "buckets": {}})
+        target["name"] = node["name"]
+        for bucket in node["buckets"]:
+            if bucket is None:
+                continue
+            if bucket[0] in target["buckets"]:
+                meshcore_derive.merge_rollup_bucket(target["buckets"][bucket[0]], bucket)
+            else:
+                target["buckets"][bucket[0]] = bucket
+
+
+def build_history(snapshots, nodes, timestamp, extra):
+    """Append a snapshot like the recorder does - only when the data changed"""
+    if not nodes:
+        return
+    if snapshots and meshcore_derive.snapshot_hash(snapshots[-1]["nodes"]) == meshcore_derive.snapshot_hash(nodes):
+        return
+    snapshots.append(dict({"timestamp": timestamp, "nodes": nodes, "threshold_hours": None}, **extra))
+
+
+def merge_partitions(results, args, states, end_ts):
+    results = sorted(results, key=lambda r: r["index"])
+    direct_links, hop_nodes_used = {}, {}
+    sensors, receptions, last_messages, rollups, adjacency = {}, {}, {}, {}, {}
+
+    for result in results:
+        merge_links(direct_links, result["base"]["direct_links"])
+        merge_hop_nodes(hop_nodes_used, result["base"]["hop_nodes_used"], args.recent_hours, args.activity_half_life_hours)
+        for sensor_id, sensor in result["totals"]["sensors"].items():
+            old = sensors.get(sensor_id)
+            if old is None or sensor["attributes"]["last_message_time"] >= old["attributes"]["last_message_time"]:
+                sensors[sensor_id] = sensor
+                receptions.pop(sensor_id, None)
+                if sensor_id in result["totals"]["receptions"]:
+                    receptions[sensor_id] = result["totals"]["receptions"][sensor_id]
+        last_messages.update(result["totals"]["last_messages"])
+        merge_rollups(rollups, result["totals"]["rollups"])
+        # Each worker learns a path's neighbours once, as one app process would
+        for a, b, count in result["adjacency"]:
+            adjacency[(a, b)] = max(adjacency.get((a, b), 0), count)
+
+    # Replay the history window interval by interval for the playback snapshots.
+    # Link ends are resolved as the recorder does, with the merged adjacency.
+    contacts = meshcore_contacts.ContactIndex(args.my_pubkey)
+    contacts.update(states)
+    receivers = meshcore_receivers.ReceiverRegistry()
+    receivers.configure(json.loads(args.receivers), args.my_pubkey)
+    contacts.set_receivers(receivers.pubkeys())
+    contacts.load_adjacency([[a, b, n] for (a, b), n in adjacency.items()])
+    resolve_link = meshcore_derive.index_resolver(contacts)
+    heatmap_history, directlinks_history = [], []
+    intervals = {}
+    for result in results:
+        for interval, part in result["intervals"].items():
+            intervals.setdefault(interval, []).append(part)
+    for interval in sorted(intervals):
+        for part in intervals[interval]:
+            merge_links(direct_links, part["direct_links"])
+            merge_hop_nodes(hop_nodes_used, part["hop_nodes_used"], args.recent_hours, args.activity_half_life_hours)
+        taken_at = interval + SNAPSHOT_INTERVAL
+        build_history(heatmap_history, meshcore_derive.heatmap_snapshot_nodes(hop_nodes_used), taken_at,
+                      {"paths": []})
+        nodes, links = meshcore_derive.directlinks_snapshot(direct_links, resolve_link, taken_at)
+        build_history(directlinks_history, nodes, taken_at, {"links": links})
+
+    rollup_cutoff = end_ts - args.rollup_hours * 3600
+    rollups = {key: {"name": node["name"],
+                     "buckets": [b for _, b in sorted(node["buckets"].items()) if b[0] > rollup_cutoff]}
+               for key, node in rollups.items()}
+    rollups = {key: node for key, node in rollups.items() if node["buckets"]}
+
+    max_snapshots = args.history_hours * 3600 // SNAPSHOT_INTERVAL
+    return {
+        "direct_links": direct_links,
+        "hop_nodes_used": hop_nodes_used,
+        "sensors": sensors,
+        "receptions": receptions,
+        "last_messages": last_messages,
+        "rollups": rollups,
+        "adjacency": [[a, b, n] for (a, b), n in adjacency.items()],
+        "heatmap_history": heatmap_history[-max_snapshots:],
+        "directlinks_history": directlinks_history[-max_snapshots:]
+    }
+
+
+# -----------------------------------------------------------------------------
+# Output
+# -----------------------------------------------------------------------------
+
+def write_json(directory, filename, data, compact=False):
+    path = os.path.join(directory, filename)
+    with open(path, "w") as f:
+        if compact:
+            json.dump(data, f, separators=(",", ":"))
+        else:
+            json.dump(data, f, indent=2)
+    return path
+
+
+def write_outputs(directory, merged, args):
+    os.makedirs(directory, exist_ok=True)
+    now_ts = time.time()
+    saved = {"saved_at": now_ts, "saved_at_formatted": datetime.now().isoformat()}
+
+    write_json(directory, "meshcore_directlinks_persist.json",
+               dict({"direct_links": merged["direct_links"], "adjacency": merged["adjacency"]}, **saved))
+    write_json(directory, "meshcore_hops_data.json",
+               dict({"hop_nodes_used": merged["hop_nodes_used"], "adjacency": merged["adjacency"]}, **saved),
+               compact=True)
+    write_json(directory, "meshcore_hops_sensors.json",
+               dict({"sensors": merged["sensors"], "receptions": merged["receptions"], "count": len(merged["sensors"])}, **saved),
+               compact=True)
+    write_json(directory, "meshcore_last_messages.json",
+               dict({"last_messages": merged["last_messages"], "count": len(merged["last_messages"])}, **saved))
+    write_json(directory, "meshcore_hops_rollups_persist.json",
+               {"rollup_hours": args.rollup_hours, "nodes": merged["rollups"], "saved_at": now_ts}, compact=True)
+
+    history_dir = os.path.join(directory, "meshcore_history")
+    for dataset in ("heatmap", "directlinks"):
+        # Start from empty segments - a previous rebuild's would be appended to
+        if os.path.isdir(history_dir):
+            for filename in os.listdir(history_dir):
+                if filename.startswith(f"{dataset}_"):
+                    os.remove(os.path.join(history_dir, filename))
+        # Tier retention as the recorder defaults; --history-hours only sets how far back to replay
+        store = meshcore_history.TieredHistory(history_dir, dataset, binary=args.binary)
+        store.extend(merged[f"{dataset}_history"])
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+def plan_partitions(logs, workers, ttl):
+    """
+    Split indexed logs (in time order) into contiguous time ranges of about
+    equal size: [(start, end, [(path, offset to read from)])]. Range
+    boundaries are sampled timestamps, so one large file is split too. Reads
+    start at the last sample at least ttl before the range.
+    """
+    total = sum(size for _, _, size in logs)
+    targets = [total * i / workers for i in range(1, workers)]
+    boundaries = set()
+    base = 0
+    for _, samples, size in logs:
+        for offset, ts in samples:
+            while targets and base + offset >= targets[0]:
+                boundaries.add(ts)
+                targets.pop(0)
+        base += size
+    first_ts = logs[0][1][0][1]
+    boundaries = sorted(b for b in boundaries if b > first_ts)
+
+    partitions = []
+    for start, end in zip([None] + boundaries, boundaries + [None]):
+        reads = []
+        for path, samples, _ in logs:
+            if start is not None and samples[-1][1] < start - ttl:
+                continue
+            if end is not None and samples[0][1] >= end + ttl:
+                continue
+            offset = 0
+            if start is not None:
+                offset = max((o for o, ts in samples if ts < start - ttl), default=0)
+            reads.append((path, offset))
+        partitions.append((start, end, reads))
+    return partitions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild MeshCore panel data from raw event logs")
+    parser.add_argument("logs", nargs="+", help="NDJSON event logs (.gz allowed)")
+    parser.add_argument("--states", help="HA states JSON (/api/states) for contact names and locations")
+    parser.add_argument("--output", default="meshcore_rebuilt", help="directory for the rebuilt files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--my-pubkey", default="", help="as my_pubkey in apps.yaml")
+    parser.add_argument("--receivers", default="[]", help="receivers arg as JSON")
+    parser.add_argument("--fingerprint-ttl", type=float, default=300)
+    parser.add_argument("--collection-window", type=float, default=3)
+    parser.add_argument("--recent-hours", type=int, default=24)
+    parser.add_argument("--activity-half-life-hours", type=float, default=meshcore_derive.ACTIVITY_HALF_LIFE_HOURS)
+    parser.add_argument("--rollup-hours", type=int, default=168)
+    parser.add_argument("--max-receptions", type=int, default=10, help="as max_receptions in apps.yaml")
+    parser.add_argument("--message-text-length", type=int, default=100, help="as message_text_length in apps.yaml")
+    parser.add_argument("--compact-attributes", action="store_true", help="as compact_attributes in apps.yaml")
+    parser.add_argument("--reception-detail", choices=("attributes", "store"), default="attributes",
+                        help="as reception_detail in apps.yaml")
+    parser.add_argument("--history-hours", type=int, default=24)
+    parser.add_argument("--binary", action="store_true", help="also write binary history segments")
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    states = load_states(args.states)
+
+    workers = max(1, args.workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        logs = sorted((log for log in pool.map(index_log, args.logs) if log[1]), key=lambda log: log[1][0][1])
+    if not logs:
+        print("No timestamped events found")
+        return 1
+    end_ts = max(samples[-1][1] for _, samples, _ in logs)
+    history_start = end_ts - args.history_hours * 3600
+
+    tasks = [{
+        "index": i, "start": start, "end": end, "files": paths,
+        "states": states, "my_pubkey": args.my_pubkey, "receivers": json.loads(args.receivers),
+        "ttl": args.fingerprint_ttl, "window": args.collection_window,
+        "recent_hours": args.recent_hours, "rollup_hours": args.rollup_hours,
+        "activity_half_life_hours": args.activity_half_life_hours,
+        "max_receptions": args.max_receptions, "message_text_length": args.message_text_length,
+        "compact_attributes": args.compact_attributes, "reception_detail": args.reception_detail,
+        "history_start": history_start
+    } for i, (start, end, paths) in enumerate(plan_partitions(logs, workers, args.fingerprint_ttl))]
+
+    with ProcessPoolExecutor(max_workers=len(tasks)) as pool:
+        results = list(pool.map(rebuild_partition, tasks))
+
+    merged = merge_partitions(results, args, states, end_ts)
+    write_outputs(args.output, merged, args)
+
+    events = sum(r["stats"]["events"] for r in results)
+    messages = sum(r["stats"]["messages"] for r in results)
+    print(f"Replayed {events} receptions of {messages} messages from {len(logs)} files "
+          f"in {len(tasks)} partitions ({time.time() - started:.1f}s)")
+    print(f"{sum(len(v) for v in merged['direct_links'].values())} direct links, "
+          f"{len(merged['hop_nodes_used'])} hop nodes, {len(merged['sensors'])} hops sensors, "
+          f"{len(merged['heatmap_history'])}/{len(merged['directlinks_history'])} snapshots -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pytest
+
+# The apps and their helper modules are flat modules in appdaemon/apps, as AppDaemon loads them
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "appdaemon", "apps"))
+sys.path.insert(0, os.path.join(ROOT, "appdaemon", "tools"))
+
+
+class Clock:
+    """Manual clock, patched in for time.time/time.monotonic where a test needs it"""
+
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeApp:
+    """
+    The parts of hass.Hass the helper modules call. run_in timers fire from
+    run_timers(), which moves the clock to each timer's due time.
+    """
+
+    def __init__(self, name="test_app", args=None, clock=None):
+        self.name = name
+        self.args = args or {}
+        self.clock = clock or Clock()
+        self.timers = []     # [(due, seq, callback, kwargs)]
+        self.listeners = []  # [(callback, event, kwargs)]
+        self.states = {}     # entity_id -> {state, attributes}
+        self.logs = []       # [(level, message)]
+        self._seq = 0
+
+    def run_in(self, callback, delay, **kwargs):
+        self._seq += 1
+        self.timers.append((self.clock.now + delay, self._seq, callback, kwargs))
+        return self._seq
+
+    def listen_event(self, callback, event=None, **kwargs):
+        self.listeners.append((callback, event, kwargs))
+        return len(self.listeners)
+
+    def set_state(self, entity_id, state=None, attributes=None, **kwargs):
+        self.states[entity_id] = {"state": state, "attributes": attributes or {}}
+
+    def log(self, message, level="INFO"):
+        self.logs.append((level, message))
+
+    def errors(self):
+        return [message for level, message in self.logs if level == "ERROR"]
+
+    def run_timers(self, limit=1000):
+        """Fire due timers in order (including ones they schedule); returns how many ran"""
+        ran = 0
+        while self.timers and ran < limit:
+            self.timers.sort()
+            due, _, callback, kwargs = self.timers.pop(0)
+            self.clock.now = max(self.clock.now, due)
+            callback(kwargs)
+            ran += 1
+        return ran
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def make_app(clock):
+    """Factory for more apps sharing the test clock"""
+    return lambda name="test_app", args=None: FakeApp(name, args, clock)
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
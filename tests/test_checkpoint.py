@@ -0,0 +1,93 @@
+import os
+import pickle
+import time
+
+import pytest
+
+from meshcore_checkpoint import (contact_changed, contact_stamp, load_checkpoint, save_checkpoint,
+                                 select_for_restore)
+
+STATE = {"sensors": {"sensor.meshcore_hops_ab": {"count": 3, "nodes": ["ab", "cd"]}},
+         "links": {("ab", "cd"): 7}, "recent": [1.5, 2.5]}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "checkpoints" / "meshcore_hops.ckpt")
+
+
+def test_round_trip(path):
+    size = save_checkpoint(path, "meshcore_hops", 2, STATE, stamp="abc")
+    assert size == os.path.getsize(path)
+    assert not os.path.exists(f"{path}.tmp")
+    header, state = load_checkpoint(path, "meshcore_hops", 2)
+    assert state == STATE
+    assert header["stamp"] == "abc"
+    assert header["saved_at"] <= time.time()
+
+
+def test_overwrite_replaces_the_previous_checkpoint(path):
+    save_checkpoint(path, "meshcore_hops", 2, STATE)
+    save_checkpoint(path, "meshcore_hops", 2, {"sensors": {}})
+    assert load_checkpoint(path, "meshcore_hops", 2)[1] == {"sensors": {}}
+
+
+@pytest.mark.parametrize("app_name, schema", [("meshcore_paths", 2), ("meshcore_hops", 3)])
+def test_other_app_or_schema_is_rejected(path, app_name, schema):
+    save_checkpoint(path, "meshcore_hops", 2, STATE)
+    assert load_checkpoint(path, app_name, schema) == (None, "schema changed")
+
+
+def test_missing_unreadable_and_old_format(path):
+    assert load_checkpoint(path, "meshcore_hops", 2) == (None, "missing")
+
+    save_checkpoint(path, "meshcore_hops", 2, STATE)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+    header, reason = load_checkpoint(path, "meshcore_hops", 2)
+    assert header is None and reason.startswith("unreadable")
+
+    with open(path, "wb") as f:
+        pickle.dump({"format": 0, "app": "meshcore_hops", "schema": 2}, f)
+        pickle.dump(STATE, f)
+    assert load_checkpoint(path, "meshcore_hops", 2) == (None, "format changed")
+
+
+def test_newer_json_persistence_wins(path, tmp_path):
+    json_path = str(tmp_path / "meshcore_hops.json")
+    with open(json_path, "w") as f:
+        f.write("{}")
+    save_checkpoint(path, "meshcore_hops", 2, STATE)
+    assert load_checkpoint(path, "meshcore_hops", 2, newer_than=(json_path,))[1] == STATE
+
+    later = time.time() + 60
+    os.utime(json_path, (later, later))
+    assert load_checkpoint(path, "meshcore_hops", 2, newer_than=(json_path,)) == (
+        None, "older than meshcore_hops.json")
+
+
+def test_contact_stamp_tracks_stamped_attributes_only():
+    contact = {"attributes": {"pubkey_prefix": "ab11", "adv_lat": 50.1, "adv_lon": 1.0, "last_advert": 1}}
+    all_states = {"binary_sensor.meshcore_ab11_contact": contact, "sensor.other": {"state": "1"}}
+    stamp = contact_stamp(all_states)
+
+    advert = {"attributes": dict(contact["attributes"], last_advert=2)}
+    assert not contact_changed(contact, advert)
+    assert contact_stamp({"binary_sensor.meshcore_ab11_contact": advert}) == stamp
+
+    moved = {"attributes": dict(contact["attributes"], adv_lat=50.2)}
+    assert contact_changed(contact, moved)
+    assert contact_stamp({"binary_sensor.meshcore_ab11_contact": moved}) != stamp
+
+
+def test_select_for_restore_defaults_to_everything_newest_first():
+    items = [("old", {"t": 100}), ("new", {"t": 300}), ("mid", {"t": 200}), ("never", {})]
+    selected = select_for_restore(items, lambda v: v.get("t"), now=1000)
+    assert [k for k, _ in selected] == ["new", "mid", "old", "never"]
+
+
+def test_select_for_restore_limits():
+    items = [("old", {"t": 100}), ("new", {"t": 300}), ("mid", {"t": 200})]
+    recency = lambda v: v["t"]  # noqa: E731
+    assert [k for k, _ in select_for_restore(items, recency, max_age=250, now=400)] == ["new", "mid"]
+    assert [k for k, _ in select_for_restore(items, recency, limit=1)] == ["new"]
@@ -0,0 +1,152 @@
+import threading
+
+from meshcore_contacts import ContactIndex, contacts_from_states
+
+
+def contact_state(pubkey, lat, lon, name=None, node_type="Repeater"):
+    return {"state": "on", "attributes": {
+        "pubkey_prefix": pubkey, "adv_lat": lat, "adv_lon": lon,
+        "adv_name": name or pubkey[:4], "node_type_str": node_type}}
+
+
+def states(*contacts):
+    return {f"binary_sensor.meshcore_{c[0][:6]}_contact": contact_state(*c) for c in contacts}
+
+
+NEAR = ("ab1100", 50.20, 1.0)
+FAR = ("ab2200", 10.00, 10.0)
+NEIGHBOUR = ("cd3300", 50.10, 1.0)
+
+
+def index_of(*contacts):
+    index = ContactIndex()
+    index.update(states(*contacts))
+    return index
+
+
+def test_contacts_from_states_skips_unlocated_and_other_entities():
+    all_states = states(NEAR, ("ef0000", 0, 0))
+    all_states["binary_sensor.meshcore_ef11_contact"] = {"attributes": {"pubkey_prefix": "ef11"}}
+    all_states["sensor.meshcore_ab1100_rssi"] = contact_state(*FAR)
+    assert list(contacts_from_states(all_states).values()) == [{
+        "name": "ab11", "lat": 50.2, "lon": 1.0, "pubkey": "ab1100", "node_type": "Repeater", "last_advert": 0}]
+
+
+def test_unique_prefix_resolves_directly():
+    index = index_of(NEAR, NEIGHBOUR)
+    assert index.resolve("CD")["pubkey"] == "cd3300"
+    assert index.resolve("ef") is None
+
+
+def test_colliding_prefix_picks_the_plausible_neighbour():
+    index = index_of(NEAR, FAR, NEIGHBOUR)
+    assert len(index.lookup("ab")) == 2
+    resolved = index.resolve_path(["cd", "ab"])
+    assert [c["pubkey"] for c in resolved] == ["cd3300", "ab1100"]
+
+
+def test_learned_adjacency_beats_distance():
+    near_but_unlinked = ("ab2200", 50.11, 1.01)
+    index = index_of(NEAR, near_but_unlinked, NEIGHBOUR)
+    assert index.resolve_path(["cd", "ab"], learn=False)[1]["pubkey"] == "ab2200"
+    index.learn("ab1100", "cd3300", 5)
+    assert index.resolve_path(["cd", "ab"], learn=False)[1]["pubkey"] == "ab1100"
+
+
+def test_origin_breaks_ties_for_the_last_hop():
+    index = index_of(NEAR, FAR)
+    origin = {"pubkey": "ff0000", "lat": 10.1, "lon": 10.0}
+    assert index.resolve_path(["ab"], origin=origin)[0]["pubkey"] == "ab2200"
+
+
+def test_my_own_node_wins_its_prefix():
+    index = index_of(NEAR, FAR)
+    index.my_pubkey = "ab2200"
+    index.set_receivers([])
+    assert [c["pubkey"] for c in index.lookup("ab")] == ["ab2200"]
+
+
+def test_update_only_rebuilds_on_contact_changes():
+    all_states = states(NEAR, NEIGHBOUR)
+    index = ContactIndex()
+    assert index.update(all_states)
+    all_states["binary_sensor.meshcore_ab1100_contact"]["attributes"]["last_advert"] = 123
+    assert not index.update(all_states)
+    assert index.contacts["ab1100"]["last_advert"] == 123
+    assert index.cache_stats()["rebuilds"] == 1
+
+
+def test_update_entity_patches_the_candidate_table():
+    index = index_of(NEAR, NEIGHBOUR)
+    assert index.update_entity("binary_sensor.meshcore_ab2200_contact", contact_state(*FAR))
+    assert index.cache_stats()["colliding_prefixes"] == 1
+    assert {c["pubkey"] for c in index.lookup("ab")} == {"ab1100", "ab2200"}
+    assert index.update_entity("binary_sensor.meshcore_ab1100_contact", None)
+    assert [c["pubkey"] for c in index.lookup("ab")] == ["ab2200"]
+    assert index.cache_stats()["colliding_prefixes"] == 0
+
+
+def test_repeated_paths_are_served_from_the_path_cache():
+    index = index_of(NEAR, FAR, NEIGHBOUR)
+    first = index.resolve_path(["cd", "ab"])
+    # The first resolution learned cd-ab; the repeat is a cache hit
+    assert index.resolve_path(["CD", "AB"]) == first
+    stats = index.cache_stats()
+    assert (stats["path_misses"], stats["path_hits"]) == (1, 1)
+
+
+def test_contact_changes_invalidate_cached_paths():
+    index = index_of(FAR, NEIGHBOUR)
+    assert index.resolve_path(["cd", "ab"], learn=False)[1]["pubkey"] == "ab2200"
+    index.update_entity("binary_sensor.meshcore_ab1100_contact", contact_state(*NEAR))
+    assert index.resolve_path(["cd", "ab"], learn=False)[1]["pubkey"] == "ab1100"
+    assert index.cache_stats()["path_hits"] == 0
+
+
+def test_path_cache_is_bounded():
+    index = ContactIndex(path_cache_size=2)
+    index.update(states(NEAR, NEIGHBOUR))
+    for path in (["cd"], ["ab"], ["cd", "ab"]):
+        index.resolve_path(path, learn=False)
+    assert index.cache_stats()["paths_cached"] == 2
+
+
+def test_concurrent_resolution_and_updates():
+    index = index_of(NEAR, FAR, NEIGHBOUR)
+    errors = []
+
+    def resolver():
+        try:
+            for _ in range(300):
+                resolved = index.resolve_path(["cd", "ab"])
+                assert resolved[0]["pubkey"] == "cd3300"
+        except Exception as e:  # noqa: BLE001 - surfaced by the assert below
+            errors.append(e)
+
+    def updater():
+        try:
+            for i in range(300):
+                state = contact_state("ef%04x" % i, 40.0, 2.0) if i % 2 else None
+                index.update_entity("binary_sensor.meshcore_ef_contact", state)
+        except Exception as e:  # noqa: BLE001
+            errors.append(e)
+
+    threads = [threading.Thread(target=resolver) for _ in range(3)] + [threading.Thread(target=updater)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert index.resolve_path(["cd", "ab"])[1]["pubkey"] == "ab1100"
+
+
+def test_picks_ranked_from_the_origin_are_cached_per_origin():
+    # Both hops collide, so the first is ranked from the receiving radio
+    north = {"pubkey": "ee1100", "lat": 50.3, "lon": 1.0}
+    south = {"pubkey": "ee2200", "lat": 40.3, "lon": 1.0}
+    contacts = (("aa1100", 50.0, 1.0), ("aa2200", 40.0, 1.0), ("bb1100", 50.1, 1.0), ("bb2200", 40.1, 1.0))
+    index = index_of(*contacts)
+    # Without learning, nothing clears the pick cache between the two receivers
+    assert [c["pubkey"] for c in index.resolve_path(["aa", "bb"], origin=north, learn=False)] == ["aa1100", "bb1100"]
+    assert [c["pubkey"] for c in index.resolve_path(["aa", "bb"], origin=south, learn=False)] == ["aa2200", "bb2200"]
+    assert index.cache_stats()["pick_hits"] == 0
@@ -0,0 +1,229 @@
+import pytest
+
+from meshcore_derive import (DERIVABLE_HOPS_ATTRIBUTES, ROLLUP_MAX_HOPS, add_activity, apply_attribute_budget,
+                            count_recent_use, decayed_activity, expire_path_features, hop_marker_attributes,
+                            hops_summary, marker_layout, merge_rollup_bucket, new_rollup_bucket, path_feature,
+                            path_feature_collection, recent_use_count, record_rollup, sanitize_entity_name,
+                            track_hop_node)
+
+HOUR = 3600
+T0 = 1_700_000_000
+
+
+def test_activity_halves_every_half_life():
+    data = {}
+    add_activity(data, T0, half_life_hours=6)
+    add_activity(data, T0, half_life_hours=6)
+    assert decayed_activity(data, T0, 6) == 2.0
+    assert decayed_activity(data, T0 + 6 * HOUR, 6) == pytest.approx(1.0)
+    assert decayed_activity(data, T0 + 12 * HOUR, 6) == pytest.approx(0.5)
+    # Reads never change the stored score
+    assert data == {"activity": 2.0, "activity_at": T0}
+
+
+def test_activity_is_decayed_lazily_on_update():
+    data = {}
+    add_activity(data, T0, half_life_hours=1)
+    add_activity(data, T0 + HOUR, half_life_hours=1)
+    assert data == {"activity": pytest.approx(1.5), "activity_at": T0 + HOUR}
+
+
+def test_out_of_order_uses_add_their_decayed_share():
+    data = {}
+    add_activity(data, T0 + 2 * HOUR, half_life_hours=1)
+    add_activity(data, T0, half_life_hours=1)
+    assert data == {"activity": pytest.approx(1.25), "activity_at": T0 + 2 * HOUR}
+    # Same score as seeing the uses in order
+    in_order = {}
+    add_activity(in_order, T0, half_life_hours=1)
+    add_activity(in_order, T0 + 2 * HOUR, half_life_hours=1)
+    assert in_order["activity"] == pytest.approx(data["activity"])
+
+
+def test_unused_nodes_score_zero():
+    assert decayed_activity({}, T0) == 0.0
+    assert decayed_activity({"activity": 0.0, "activity_at": T0}, T0 + HOUR) == 0.0
+
+
+def test_track_hop_node_scores_each_use():
+    hop_nodes = {}
+    coords = {"lat": 50.0, "lon": 1.0, "name": "AB", "pubkey": "AB1100", "node_type": "Repeater"}
+    assert track_hop_node(hop_nodes, "ab", coords, T0, 24, half_life_hours=2) == ("ab1100", True)
+    assert track_hop_node(hop_nodes, "ab", coords, T0 + 2 * HOUR, 24, half_life_hours=2) == ("ab1100", False)
+    node = hop_nodes["ab1100"]
+    assert node["use_count"] == 2
+    assert decayed_activity(node, T0 + 2 * HOUR, 2) == pytest.approx(1.5)
+
+
+def test_rollup_buckets_per_hour():
+    rollups = {}
+    record_rollup(rollups, 24, "ab1100", "Alice", 0, 5.0, -80, T0)
+    record_rollup(rollups, 24, "ab1100", "Alice (Repeater)", 2, -3.0, -100, T0 + 60)
+    record_rollup(rollups, 24, "ab1100", "Alice", 12, None, None, T0 + 120)
+    record_rollup(rollups, 24, "", "Nobody", 1, 1.0, -90, T0)  # No key - not rolled up
+    node = rollups["ab1100"]
+    assert list(rollups) == ["ab1100"]
+    assert node["name"] == "Alice"
+    (bucket,) = [b for b in node["buckets"] if b]
+    hour = T0 // HOUR * HOUR
+    assert bucket[:10] == [hour, 3, 2, 2.0, -3.0, 5.0, 2, -180, -100, -80]
+    # 12 hops lands in the ROLLUP_MAX_HOPS+ slot
+    assert bucket[10] == [1, 0, 1] + [0] * (ROLLUP_MAX_HOPS - 3) + [1]
+
+
+def test_rollup_ring_reuses_rotated_slots():
+    rollups = {}
+    record_rollup(rollups, 3, "ab1100", "Alice", 0, 1.0, -80, T0)
+    record_rollup(rollups, 3, "ab1100", "Alice", 0, 2.0, -80, T0 + 3 * HOUR)
+    buckets = [b for b in rollups["ab1100"]["buckets"] if b]
+    assert len(rollups["ab1100"]["buckets"]) == 3
+    assert [(b[0], b[1]) for b in buckets] == [(T0 // HOUR * HOUR + 3 * HOUR, 1)]
+
+
+def test_merge_rollup_bucket():
+    hour = T0 // HOUR * HOUR
+    into, other, empty = {}, {}, new_rollup_bucket(hour)
+    record_rollup(into, 24, "n", "N", 1, 4.0, -90, hour)
+    record_rollup(other, 24, "n", "N", 3, -2.0, None, hour + 10)
+    merged = next(b for b in into["n"]["buckets"] if b)
+    merge_rollup_bucket(merged, next(b for b in other["n"]["buckets"] if b))
+    merge_rollup_bucket(merged, empty)
+    assert merged[:10] == [hour, 2, 2, 2.0, -2.0, 4.0, 1, -90, -90, -90]
+    assert merged[10][1] == merged[10][3] == 1
+
+
+def test_hops_summary_lists_sensors_newest_first():
+    sensors = {
+        "sensor.meshcore_hops_alice": {"state": 0, "attributes": {
+            "sender_name": "Alice", "pubkey_prefix": "ab1100", "path_length": 0, "last_message_time": T0 + 50,
+            "data_source": "rx_log_data", "snr": 7.5}},
+        "sensor.meshcore_hops_bob": {"state": 2, "attributes": {
+            "sender_name": "Bob", "path_length": 2, "path_nodes": ["aa", "bb"], "last_seen": T0 + 90}},
+        "sensor.meshcore_hops_carol": {"state": 1, "attributes": {
+            "sender_name": "Carol", "path_length": 1, "last_message_time": T0 + 10, "data_source": "rx_log_data"}},
+    }
+    nodes, totals = hops_summary(sensors, lambda sensor_id: [{"hops": 0}] if "alice" in sensor_id else [])
+    assert [n["sender_name"] for n in nodes] == ["Bob", "Alice", "Carol"]
+    assert nodes[0]["path_nodes"] == ["aa", "bb"] and nodes[0]["hops"] == 2
+    assert nodes[1]["receptions"] == [{"hops": 0}] and nodes[1]["snr"] == 7.5
+    assert totals == {"direct_count": 1, "by_source": {"rx_log_data": 2, "unknown": 1},
+                      "last_sender": "Bob", "last_message_time": T0 + 90}
+
+
+def test_hops_summary_of_nothing():
+    assert hops_summary({}, lambda sensor_id: []) == (
+        [], {"direct_count": 0, "by_source": {}, "last_sender": "", "last_message_time": 0})
+
+
+def budget_attributes():
+    return {"receptions": [{"hops": h} for h in range(5)], "last_message_text": "Alice: hello mesh",
+            "longest_path": "aa → bb", "max_hops": 2, "last_message_formatted": "x", "last_seen_formatted": "y",
+            "path_length": 0}
+
+
+def test_attribute_budget_caps_receptions_and_text():
+    attributes = budget_attributes()
+    assert apply_attribute_budget(attributes, 3, 5) is None
+    assert attributes["receptions"] == [{"hops": 0}, {"hops": 1}, {"hops": 2}]
+    assert attributes["last_message_text"] == "Alice"
+    assert attributes["max_hops"] == 2
+
+
+def test_attribute_budget_zero_means_no_cap_or_no_text():
+    attributes = budget_attributes()
+    apply_attribute_budget(attributes, 0, 0)
+    assert len(attributes["receptions"]) == 5
+    assert "last_message_text" not in attributes
+
+
+def test_attribute_budget_compact_drops_derivable_fields():
+    attributes = budget_attributes()
+    apply_attribute_budget(attributes, 10, 100, compact=True)
+    assert not set(DERIVABLE_HOPS_ATTRIBUTES) & set(attributes)
+    assert attributes["path_length"] == 0 and attributes["last_message_text"] == "Alice: hello mesh"
+
+
+def test_attribute_budget_stores_receptions_off_the_sensor():
+    attributes = budget_attributes()
+    stored = apply_attribute_budget(attributes, 2, 100, store_receptions=True)
+    assert len(stored) == 5 and "receptions" not in attributes
+    assert apply_attribute_budget({"path_length": 1}, 2, 100, store_receptions=True) is None
+
+
+def test_path_feature_is_a_lon_lat_linestring():
+    coords = [{"lat": 52.1, "lon": 4.3, "name": "Alpha (Repeater)", "pubkey": "aa11"}, {"lat": 52.2, "lon": 4.4}]
+    feature = path_feature("Alice", coords, T0, str.upper)
+    assert feature["geometry"] == {"type": "LineString", "coordinates": [[4.3, 52.1], [4.4, 52.2]]}
+    assert feature["properties"] == {"sender": "ALICE", "hops": 2, "nodes": ["ALPHA (REPEATER)", "UNKNOWN"],
+                                     "pubkeys": ["aa11", ""], "drawn_at": T0}
+
+
+def test_path_layer_expires_old_paths_and_lists_newest_first():
+    coords = [{"lat": 52.1, "lon": 4.3}, {"lat": 52.2, "lon": 4.4}]
+    features = {name: path_feature(name, coords, T0 + i * HOUR, str) for i, name in enumerate(["a", "b", "c"])}
+    assert expire_path_features(features, T0 + HOUR) == 1
+    assert expire_path_features(features, T0 + HOUR) == 0
+    layer = path_feature_collection(features, T0 + 3 * HOUR)
+    assert layer["type"] == "FeatureCollection" and layer["updated"] == T0 + 3 * HOUR
+    assert [f["properties"]["sender"] for f in layer["features"]] == ["c", "b"]
+
+
+def hop_node(name, lat, lon, **coords):
+    return {"coords": dict(coords, name=name, lat=lat, lon=lon), "use_count": 3, "last_used": T0}
+
+
+def test_marker_layout_disambiguates_same_names_at_different_places():
+    hop_nodes = {
+        "aa1111ff": hop_node("Hill", 52.1, 4.3),
+        "bb2222ff": hop_node("Hill", 52.5, 4.3),
+        "cc3333ff": hop_node("Tower", 52.1, 4.3),
+        "dd4444ff": hop_node("Tower", 52.1001, 4.3001),
+        "ee5555ff": hop_node("Nowhere", None, None),
+    }
+    assert marker_layout(hop_nodes, sanitize_entity_name, lambda pubkey, name: True) == {
+        "aa1111ff": "device_tracker.meshcore_hop_hill_aa1111",
+        "bb2222ff": "device_tracker.meshcore_hop_hill_bb2222",
+        "cc3333ff": "device_tracker.meshcore_hop_tower",
+        "dd4444ff": "device_tracker.meshcore_hop_tower",
+    }
+    wanted = marker_layout(hop_nodes, sanitize_entity_name, lambda pubkey, name: pubkey.startswith("bb"))
+    assert wanted == {"bb2222ff": "device_tracker.meshcore_hop_hill_bb2222"}
+
+
+def test_hop_marker_attributes():
+    data = hop_node("Hill (Repeater)", 52.1, 4.3, node_type="Repeater")
+    attributes = hop_marker_attributes(data["coords"], data, str.strip)
+    assert attributes["friendly_name"] == "Hop: Hill (Repeater)"
+    assert (attributes["latitude"], attributes["longitude"]) == (52.1, 4.3)
+    assert attributes["icon"] == "mdi:radio-tower"
+    assert (attributes["use_count"], attributes["last_used"]) == (3, T0)
+    # Same node, same attributes - the marker is not pushed again
+    assert hop_marker_attributes(data["coords"], data, str.strip) == attributes
+    assert hop_marker_attributes({"lat": 1, "lon": 1}, {}, str.strip)["icon"] == "mdi:access-point"
+
+
+def test_recent_uses_are_bucketed_per_hour():
+    start = (T0 // HOUR) * HOUR
+    data = {}
+    count_recent_use(data, start + 10, 3)
+    count_recent_use(data, start + 20, 3)
+    count_recent_use(data, start + HOUR, 3, count=4)
+    assert data["use_buckets"] == [[start, 2], [start + HOUR, 4]]
+    assert recent_use_count(data, start + HOUR + 10, 3) == 6
+    # The first hour leaves the window once it is recent_hours old
+    assert recent_use_count(data, start + 4 * HOUR, 3) == 4
+    count_recent_use(data, start + 3 * HOUR, 3)
+    assert data["use_buckets"] == [[start + HOUR, 4], [start + 3 * HOUR, 1]]
+
+
+def test_track_hop_node_keeps_counters_and_buckets():
+    start = (T0 // HOUR) * HOUR
+    hop_nodes = {}
+    coords = {"lat": 52.1, "lon": 4.3, "name": "Hill", "pubkey": "AB1100", "extra": "dropped"}
+    assert track_hop_node(hop_nodes, "ab", coords, start, 24) == ("ab1100", True)
+    track_hop_node(hop_nodes, "ab", coords, start + 60, 24)
+    track_hop_node(hop_nodes, "ab", coords, start + 25 * HOUR, 24)
+    node = hop_nodes["ab1100"]
+    assert node["coords"] == {"lat": 52.1, "lon": 4.3, "name": "Hill", "pubkey": "AB1100", "node_type": None}
+    assert node["use_count"] == 3 and node["last_used"] == start + 25 * HOUR
+    assert node["use_buckets"] == [[start + 25 * HOUR, 1]]
@@ -0,0 +1,56 @@
+import math
+
+import pytest
+
+import meshcore_geo
+from meshcore_geo import EARTH_RADIUS_KM, distances_from, haversine_km, haversine_many, segment_lengths
+
+# (lat1, lon1, lat2, lon2, km)
+KNOWN = [
+    (0.0, 0.0, 0.0, 1.0, EARTH_RADIUS_KM * math.pi / 180),       # One degree along the equator
+    (0.0, 0.0, 90.0, 0.0, EARTH_RADIUS_KM * math.pi / 2),        # Equator to pole
+    (0.0, 0.0, 0.0, 180.0, EARTH_RADIUS_KM * math.pi),           # Antipodes
+    (51.5074, -0.1278, 48.8566, 2.3522, 343.56),                 # London - Paris
+    (52.3676, 4.9041, 52.3676, 4.9041, 0.0),
+]
+
+POINTS = [(50.0 + i * 0.37, -3.0 + i * 0.91) for i in range(12)]
+
+
+@pytest.fixture
+def pure_python(monkeypatch):
+    monkeypatch.setattr(meshcore_geo, "np", None)
+
+
+@pytest.mark.parametrize("lat1, lon1, lat2, lon2, km", KNOWN)
+def test_haversine_known_distances(lat1, lon1, lat2, lon2, km):
+    assert haversine_km(lat1, lon1, lat2, lon2) == pytest.approx(km, abs=0.01)
+    assert haversine_km(lat2, lon2, lat1, lon1) == pytest.approx(km, abs=0.01)
+
+
+def test_haversine_many_pure_python(pure_python):
+    lats1, lons1, lats2, lons2, expected = zip(*KNOWN)
+    assert haversine_many(list(lats1), list(lons1), list(lats2), list(lons2)) == pytest.approx(expected, abs=0.01)
+    assert haversine_many([], [], [], []) == []
+
+
+def test_distances_from_and_segment_lengths(pure_python):
+    lats = [p[0] for p in POINTS]
+    lons = [p[1] for p in POINTS]
+    assert distances_from(50.0, -3.0, lats, lons) == [haversine_km(50.0, -3.0, a, b) for a, b in POINTS]
+
+    line = [{"lat": a, "lon": b} for a, b in POINTS[:3]]
+    assert segment_lengths([line, line[:1], []]) == [
+        [haversine_km(*POINTS[0], *POINTS[1]), haversine_km(*POINTS[1], *POINTS[2])], [], []]
+
+
+def test_numpy_matches_pure_python(monkeypatch):
+    pytest.importorskip("numpy")
+    lats1, lons1 = [p[0] for p in POINTS], [p[1] for p in POINTS]
+    lats2, lons2 = lats1[::-1], lons1[::-1]
+    vectorized = haversine_many(lats1, lons1, lats2, lons2)
+    vectorized_from = distances_from(51.0, 0.5, lats1, lons1)
+    monkeypatch.setattr(meshcore_geo, "np", None)
+    assert vectorized == pytest.approx(haversine_many(lats1, lons1, lats2, lons2), rel=1e-12, abs=1e-9)
+    assert vectorized_from == pytest.approx(distances_from(51.0, 0.5, lats1, lons1), rel=1e-12, abs=1e-9)
+    assert isinstance(vectorized, list)
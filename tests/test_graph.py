@@ -0,0 +1,183 @@
+import itertools
+import math
+import random
+
+from meshcore_graph import LinkGraph
+
+
+def graph_of(edges):
+    graph = LinkGraph()
+    for a, b in edges:
+        graph.add_edge(a, b)
+    return graph
+
+
+def components(nodes, edges):
+    """Connected components by union-find (reference for the Tarjan results)"""
+    parent = {v: v for v in nodes}
+
+    def find(v):
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    for a, b in edges:
+        parent[find(a)] = find(b)
+    return len({find(v) for v in nodes})
+
+
+def brute_force_cuts(edges):
+    nodes = {v for edge in edges for v in edge}
+    base = components(nodes, edges)
+    cut_vertices = {v for v in nodes
+                    if components(nodes - {v}, [e for e in edges if v not in e]) > base}
+    bridges = {frozenset(e) for e in edges
+               if components(nodes, [f for f in edges if f != e]) > base}
+    return cut_vertices, bridges
+
+
+def test_chain_has_inner_cut_vertices_and_only_bridges():
+    analysis = graph_of([("aa", "bb"), ("bb", "cc"), ("cc", "dd")]).analyse()
+    assert analysis["articulation_points"] == ["bb", "cc"]
+    assert analysis["components"] == 1
+    # Middle link separates 2 x 2 nodes, the end links 1 x 3
+    assert [b[2] for b in analysis["bridges"]] == [4, 3, 3]
+    assert frozenset(analysis["bridges"][0][:2]) == {"bb", "cc"}
+    assert {frozenset(b[:2]) for b in analysis["bridges"][1:]} == {frozenset(("aa", "bb")), frozenset(("cc", "dd"))}
+
+
+def test_cycle_has_no_cuts():
+    analysis = graph_of([("aa", "bb"), ("bb", "cc"), ("cc", "aa")]).analyse()
+    assert analysis["articulation_points"] == []
+    assert analysis["bridges"] == []
+
+
+def test_two_triangles_joined_by_a_bridge():
+    edges = [("a1", "a2"), ("a2", "a3"), ("a3", "a1"), ("b1", "b2"), ("b2", "b3"), ("b3", "b1"), ("a3", "b1")]
+    analysis = graph_of(edges).analyse()
+    assert analysis["articulation_points"] == ["a3", "b1"]
+    assert [(frozenset(b[:2]), b[2]) for b in analysis["bridges"]] == [(frozenset(("a3", "b1")), 9)]
+
+
+def test_separate_components_are_counted():
+    analysis = graph_of([("aa", "bb"), ("cc", "dd"), ("dd", "ee")]).analyse()
+    assert analysis["components"] == 2
+    assert analysis["articulation_points"] == ["dd"]
+
+
+def test_matches_brute_force_on_random_graphs():
+    rng = random.Random(7)
+    for _ in range(40):
+        nodes = [f"{i:02x}" for i in range(rng.randint(2, 14))]
+        pairs = list(itertools.combinations(nodes, 2))
+        edges = rng.sample(pairs, rng.randint(1, min(len(pairs), 20)))
+        analysis = graph_of(edges).analyse()
+        cut_vertices, bridges = brute_force_cuts(edges)
+        assert set(analysis["articulation_points"]) == cut_vertices
+        assert {frozenset(b[:2]) for b in analysis["bridges"]} == bridges
+
+
+def test_analysis_is_cached_until_the_topology_changes():
+    graph = graph_of([("aa", "bb"), ("bb", "cc")])
+    first = graph.analyse()
+    graph.add_edge("aa", "bb", 5)  # Heavier link, same topology
+    assert graph.analyse() is first
+    graph.add_edge("cc", "aa")
+    second = graph.analyse()
+    assert second is not first
+    assert second["articulation_points"] == []
+
+
+def test_betweenness_peaks_at_the_hub():
+    analysis = graph_of([("hub", leaf) for leaf in ("aa", "bb", "cc", "dd")]).analyse()
+    assert analysis["complete"]
+    assert analysis["betweenness"] == {"hub": 1.0}
+
+
+def bfs_hops(edges, source):
+    adjacency = {}
+    for a, b in edges:
+        adjacency.setdefault(a, []).append(b)
+        adjacency.setdefault(b, []).append(a)
+    hops = {source: 0}
+    queue = [source]
+    for v in queue:
+        for w in adjacency[v]:
+            if w not in hops:
+                hops[w] = hops[v] + 1
+                queue.append(w)
+    return hops
+
+
+def test_route_modes_trade_hops_for_reliability():
+    graph = LinkGraph()
+    graph.add_edge("aa", "bb", 1)  # Direct but rarely heard
+    for a, b in (("aa", "cc"), ("cc", "dd"), ("dd", "bb")):
+        graph.add_edge(a, b, 100)
+    assert graph.route("aa", "bb")["path"] == ["aa", "bb"]
+    reliable = graph.route("aa", "bb", "reliable")
+    assert reliable["path"] == ["aa", "cc", "dd", "bb"]
+    assert reliable["hops"] == 3
+    assert reliable["cost"] == round(3 * math.log1p(1 / 100), 4)
+
+
+def test_route_unknown_or_disconnected():
+    graph = graph_of([("aa", "bb"), ("cc", "dd")])
+    assert graph.route("aa", "zz") is None
+    assert graph.route("aa", "dd") is None
+    assert graph.route("aa", "aa") == {"path": ["aa"], "hops": 0, "cost": 0.0}
+
+
+def test_route_hops_match_bfs_on_random_graphs():
+    rng = random.Random(11)
+    for _ in range(20):
+        nodes = [f"{i:02x}" for i in range(rng.randint(2, 16))]
+        pairs = list(itertools.combinations(nodes, 2))
+        edges = rng.sample(pairs, rng.randint(1, min(len(pairs), 25)))
+        graph = graph_of(edges)
+        source = edges[0][0]
+        expected = bfs_hops(edges, source)
+        for target in {v for edge in edges for v in edge}:
+            route = graph.route(source, target)
+            if target not in expected:
+                assert route is None
+                continue
+            assert route["hops"] == expected[target]
+            # Every step of the returned path is a real link
+            assert all(graph.weight(a, b) for a, b in zip(route["path"], route["path"][1:]))
+
+
+def test_route_cache_is_invalidated_by_shortcuts():
+    graph = graph_of([("aa", "bb"), ("bb", "cc"), ("cc", "dd")])
+    assert graph.route("aa", "dd")["hops"] == 3
+    assert graph.route("aa", "cc")["hops"] == 2
+    assert graph.route_stats["hits"] == 1
+
+    graph.add_edge("xx", "yy")  # Unrelated link keeps the tree
+    assert graph.route("aa", "dd")["hops"] == 3
+    assert graph.route_stats["invalidations"] == 0
+
+    graph.add_edge("aa", "dd")
+    assert graph.route_stats["invalidations"] == 1
+    assert graph.route("aa", "dd")["path"] == ["aa", "dd"]
+
+
+def test_route_cache_is_bounded():
+    graph = LinkGraph(route_cache_size=2)
+    for a, b in (("aa", "bb"), ("bb", "cc"), ("cc", "dd")):
+        graph.add_edge(a, b)
+    for source in ("aa", "bb", "cc", "dd"):
+        graph.route(source, "aa")
+    assert graph.cached_routes() == 2
+
+
+def test_count_changes_keep_shortest_trees():
+    graph = graph_of([("aa", "bb"), ("bb", "cc")])
+    graph.route("aa", "cc")
+    graph.route("aa", "cc", "reliable")
+    graph.add_edge("aa", "bb", 50)  # Busier link, same topology
+    assert graph.route_stats["invalidations"] == 1  # Only the reliable tree
+    assert graph.route("aa", "cc")["hops"] == 2
+    assert graph.route_stats["hits"] == 1
+    assert graph.route("aa", "cc", "reliable")["cost"] == round(math.log1p(1 / 50) + math.log1p(1), 4)
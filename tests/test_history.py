@@ -0,0 +1,222 @@
+import json
+import os
+import types
+
+import pytest
+
+import meshcore_history
+from meshcore_history import (BINARY_MAX_ID, KIND_DIRECTLINKS, KIND_HEATMAP, SegmentStore, TieredHistory,
+                              binary_file, binary_header, decode_binary_segment, encode_binary_frame, merge_frame)
+
+DAY = 1_699_920_000  # Midnight UTC; the test clock is 22:13 the same day
+
+
+@pytest.fixture(autouse=True)
+def manual_time(monkeypatch, clock):
+    monkeypatch.setattr(meshcore_history, "time", types.SimpleNamespace(time=clock))
+
+
+def node(name, count, last_used, lat=50.0):
+    return {"name": name, "lat": lat, "lon": 1.0, "node_type": "Repeater", "pubkey": name.lower() * 3,
+            "use_count": count, "last_used": last_used}
+
+
+def heatmap_frame(ts, *nodes):
+    return {"timestamp": ts, "nodes": list(nodes) or [node("AB", 1, ts)], "paths": [], "threshold_hours": None}
+
+
+def every(minutes, hours, start=DAY):
+    return [heatmap_frame(start + t, node("AB", t // 60, start + t)) for t in range(0, hours * 3600, minutes * 60)]
+
+
+def test_segments_and_index(tmp_path):
+    store = SegmentStore(str(tmp_path), "heatmap")
+    store.extend(every(10, 3))
+    assert [s["start"] for s in store.segments] == [DAY, DAY + 3600, DAY + 7200]
+    assert [s["count"] for s in store.segments] == [6, 6, 6]
+    with open(tmp_path / "heatmap_index.json") as f:
+        index = json.load(f)
+    assert (index["count"], index["first"], index["last"]) == (18, DAY, DAY + 3 * 3600 - 600)
+
+    reloaded = SegmentStore(str(tmp_path), "heatmap")
+    assert reloaded.load()
+    assert len(reloaded) == 18
+    assert reloaded.last_frame()["timestamp"] == DAY + 3 * 3600 - 600
+
+
+def test_range_and_step_queries(tmp_path):
+    store = SegmentStore(str(tmp_path), "heatmap")
+    store.extend(every(10, 3))
+    frames = store.frames(DAY + 3000, DAY + 4800)
+    assert [f["timestamp"] - DAY for f in frames] == [3000, 3600, 4200, 4800]
+    # One frame (the last) per half hour
+    assert [f["timestamp"] - DAY for f in store.frames(step=1800)] == [t * 1800 + 1200 for t in range(6)]
+    assert store.frames(DAY + 4 * 3600) == []
+
+
+def test_old_segments_are_pruned(tmp_path, clock):
+    store = SegmentStore(str(tmp_path), "heatmap", retention=2 * 3600)
+    store.extend(every(30, 3, start=DAY + 19 * 3600))
+    store.prune()  # Clock is 22:13, so the 19:00 segment is out of the window
+    assert [s["start"] for s in store.segments] == [DAY + 20 * 3600, DAY + 21 * 3600]
+    assert not os.path.exists(tmp_path / f"heatmap_{DAY + 19 * 3600}.ndjson")
+
+
+def test_open_start_picks_the_finest_tier_with_frames(tmp_path):
+    history = TieredHistory(str(tmp_path), "heatmap")
+    assert history.tier_for_range() == 0
+    history.stores[1].extend([heatmap_frame(DAY - 40 * 86400)])
+    assert history.tier_for_range() == 1
+    history.extend(every(10, 1, start=DAY + 21 * 3600))
+    assert history.tier_for_range() == 0
+    assert history.tier_for_range(DAY - 2 * 86400) == 1  # 2 days back needs the hourly tier
+    assert history.tier_for_range(DAY - 60 * 86400) == 2
+    assert len(history.frames()) == 6
+
+
+def test_merge_frame_keeps_evicted_nodes_and_highest_counts():
+    merged = merge_frame(None, heatmap_frame(DAY, node("AB", 5, DAY), node("CD", 2, DAY)), 0)
+    merged = merge_frame(merged, heatmap_frame(DAY + 600, node("AB", 3, DAY + 600)), 0)
+    assert merged["merged"] == 2
+    assert merged["timestamp"] == DAY + 600
+    assert {n["name"]: (n["use_count"], n["last_used"]) for n in merged["nodes"]} == {
+        "AB": (5, DAY + 600), "CD": (2, DAY)}
+
+
+def test_tiers_downsample_incrementally(tmp_path):
+    history = TieredHistory(str(tmp_path), "heatmap")
+    for frame in every(10, 3):
+        history.append(frame)
+    hourly = history.stores[1].frames()
+    # The third hour is still being filled
+    assert [(f["bucket"], f["merged"], f["timestamp"] - DAY) for f in hourly] == [
+        (DAY // 3600, 6, 3000), (DAY // 3600 + 1, 6, 6600)]
+    assert history.pending[1]["merged"] == 6
+    assert history.pending[2]["merged"] == 2
+    assert history.stores[2].frames() == []
+
+
+def test_open_buckets_are_rebuilt_after_a_restart(tmp_path):
+    history = TieredHistory(str(tmp_path), "heatmap")
+    history.extend(every(10, 3))
+    expected = history.pending[1]
+
+    restarted = TieredHistory(str(tmp_path), "heatmap")
+    assert restarted.load()
+    assert restarted.pending[1] == expected
+    restarted.append(heatmap_frame(DAY + 3 * 3600))
+    assert [f["merged"] for f in restarted.stores[1].frames()] == [6, 6, 6]
+
+
+def test_added_tier_is_backfilled_from_the_tier_below(tmp_path):
+    TieredHistory(str(tmp_path), "heatmap", tiers=meshcore_history.TIERS[:1]).extend(every(10, 3))
+    history = TieredHistory(str(tmp_path), "heatmap")
+    history.load()
+    assert [f["merged"] for f in history.stores[1].frames()] == [6, 6]
+    assert history.pending[1]["merged"] == 6
+
+
+def link(a, b, count, last_seen):
+    return {"from_name": a["name"], "from_lat": a["lat"], "from_lon": a["lon"],
+            "to_name": b["name"], "to_lat": b["lat"], "to_lon": b["lon"], "count": count, "last_seen": last_seen}
+
+
+def read_binary(tmp_path, dataset, segment_start):
+    with open(tmp_path / binary_file(dataset, segment_start), "rb") as f:
+        return decode_binary_segment(f.read())
+
+
+def test_binary_heatmap_round_trip(tmp_path):
+    frames = [heatmap_frame(DAY + 60, node("AB", 3, DAY + 30), node("CD", 1, 0)),
+              heatmap_frame(DAY + 120, node("AB", 4, DAY + 90), node("EF", 7, DAY + 100, lat=51.5))]
+    store = SegmentStore(str(tmp_path), "heatmap", binary=True)
+    store.extend(frames)
+    assert store.segments[0]["bin"] == binary_file("heatmap", DAY)
+    decoded, dictionary = read_binary(tmp_path, "heatmap", DAY)
+    assert decoded == frames
+    assert len(dictionary) == 3  # Each node is described once per segment
+
+
+def test_binary_direct_links_round_trip():
+    ab = {"name": "AB", "lat": 50.0, "lon": 1.0, "node_type": "Repeater", "pubkey": "ababab",
+          "link_count": 3, "last_seen": DAY + 30}
+    cd = dict(ab, name="CD", pubkey="cdcdcd", lat=50.5, link_count=1, last_seen=DAY + 40)
+    gh = {"name": "GH", "lat": 52.0, "lon": 2.0}  # Link end that isn't in the node list
+    frame = {"timestamp": DAY + 60.5, "nodes": [ab, cd],
+             "links": [link(ab, cd, 9, DAY + 50.25), link(cd, gh, 1, None)]}
+    dictionary = {}
+    data = binary_header(KIND_DIRECTLINKS, DAY) + encode_binary_frame(frame, KIND_DIRECTLINKS, DAY, dictionary)
+    (decoded,), _ = decode_binary_segment(data)
+    assert decoded["timestamp"] == DAY + 60.5
+    assert decoded["nodes"] == [ab, cd]
+    assert decoded["links"] == [link(ab, cd, 9, DAY + 50.25), link(cd, gh, 1, 0)]
+
+
+def test_binary_truncated_record_is_ignored(tmp_path):
+    store = SegmentStore(str(tmp_path), "heatmap", binary=True)
+    store.extend(every(10, 1))
+    with open(tmp_path / binary_file("heatmap", DAY), "rb") as f:
+        data = f.read()
+    assert len(decode_binary_segment(data)[0]) == 6
+    assert len(decode_binary_segment(data[:-3])[0]) == 5
+    assert decode_binary_segment(b"XXXX" + data[4:]) == ([], {})
+
+
+def test_binary_appends_continue_after_a_restart(tmp_path):
+    SegmentStore(str(tmp_path), "heatmap", binary=True).extend(every(10, 1)[:3])
+    store = SegmentStore(str(tmp_path), "heatmap", binary=True)
+    store.load()
+    store.extend(every(10, 1)[3:])
+    decoded, dictionary = read_binary(tmp_path, "heatmap", DAY)
+    assert decoded == every(10, 1)
+    assert len(dictionary) == 1
+    assert not os.path.exists(tmp_path / (binary_file("heatmap", DAY) + ".tmp"))
+
+
+def test_binary_overflow_falls_back_to_ndjson(tmp_path):
+    store = SegmentStore(str(tmp_path), "heatmap", binary=True)
+    store.append(heatmap_frame(DAY))
+    assert os.path.exists(tmp_path / binary_file("heatmap", DAY))
+
+    big = heatmap_frame(DAY + 60, *(node(f"N{i}", 1, DAY) for i in range(BINARY_MAX_ID + 1)))
+    store.append(big)
+    store.append(heatmap_frame(DAY + 120))
+    assert store.segments[0]["bin"] is None
+    assert not os.path.exists(tmp_path / binary_file("heatmap", DAY))
+    assert [len(f["nodes"]) for f in store.frames()] == [1, BINARY_MAX_ID + 1, 1]
+    # The next segment gets its binary copy again
+    store.append(heatmap_frame(DAY + 3600))
+    assert store.segments[1]["bin"] == binary_file("heatmap", DAY + 3600)
+
+
+def test_binary_dictionary_overflow_raises():
+    dictionary = {f"n{i}": i for i in range(BINARY_MAX_ID + 1)}
+    with pytest.raises(OverflowError):
+        encode_binary_frame(heatmap_frame(DAY), KIND_HEATMAP, DAY, dictionary)
+
+
+def test_binary_unknown_kind():
+    data = bytearray(binary_header(KIND_HEATMAP, DAY) + encode_binary_frame(heatmap_frame(DAY), KIND_HEATMAP, DAY, {}))
+    data[6] = 9
+    assert decode_binary_segment(bytes(data)) == ([], {})
+    with pytest.raises(ValueError):
+        encode_binary_frame(heatmap_frame(DAY), 9, DAY, {})
+
+
+def test_binary_enabled_mid_segment_is_seeded_from_ndjson(tmp_path):
+    SegmentStore(str(tmp_path), "heatmap").extend(every(10, 1)[:3])
+    store = SegmentStore(str(tmp_path), "heatmap", binary=True)
+    store.load()
+    store.extend(every(10, 1)[3:])
+    assert read_binary(tmp_path, "heatmap", DAY)[0] == every(10, 1)
+
+
+def test_binary_missing_frames_after_a_pause_are_rebuilt(tmp_path):
+    SegmentStore(str(tmp_path), "heatmap", binary=True).extend(every(10, 1)[:2])
+    plain = SegmentStore(str(tmp_path), "heatmap")
+    plain.load()
+    plain.extend(every(10, 1)[2:4])
+    store = SegmentStore(str(tmp_path), "heatmap", binary=True)
+    store.load()
+    store.extend(every(10, 1)[4:])
+    assert read_binary(tmp_path, "heatmap", DAY)[0] == every(10, 1)
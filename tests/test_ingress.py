@@ -0,0 +1,106 @@
+import types
+
+import pytest
+
+import meshcore_ingress
+import meshcore_startup
+from meshcore_ingress import RAW_EVENT, RX_LOG_DATA, IngressQueue, reception_key
+
+
+@pytest.fixture(autouse=True)
+def manual_time(monkeypatch, clock):
+    fake_time = types.SimpleNamespace(monotonic=clock, time=clock)
+    monkeypatch.setattr(meshcore_ingress, "time", fake_time)
+    monkeypatch.setattr(meshcore_startup, "time", fake_time)
+    monkeypatch.setattr(meshcore_ingress, "_queues", {})
+    monkeypatch.setattr(meshcore_ingress, "_last_published", 0.0)
+
+
+def rx_log(text, path=("ab", "cd"), snr=5.0, timestamp=1000):
+    return {"event_type": RX_LOG_DATA, "payload": {
+        "snr": snr, "rssi": -90,
+        "parsed": {"path_nodes": list(path)},
+        "decrypted": {"decrypted": True, "channel_idx": 0, "timestamp": timestamp, "text": text}}}
+
+
+@pytest.fixture
+def handled():
+    return []
+
+
+def queue_for(app, handled, **settings):
+    return IngressQueue(app, lambda name, data, kwargs: handled.append(data), [RX_LOG_DATA], **settings)
+
+
+def test_reception_key():
+    assert reception_key(rx_log("hi")) == reception_key(rx_log("hi", snr=9.0))
+    assert reception_key(rx_log("hi"), with_signal=True) != reception_key(rx_log("hi", snr=9.0), with_signal=True)
+    assert reception_key(rx_log("hi")) != reception_key(rx_log("hi", path=("ab",)))
+    assert reception_key({"event_type": "EventType.CONTACT_MSG_RECV", "payload": {}}) is None
+    undecrypted = rx_log("hi")
+    undecrypted["payload"]["decrypted"] = {}
+    assert reception_key(undecrypted) is None
+
+
+def test_listens_per_event_type(app, handled):
+    queue_for(app, handled)
+    assert [(event, kwargs) for _, event, kwargs in app.listeners] == [(RAW_EVENT, {"event_type": RX_LOG_DATA})]
+
+
+def test_duplicate_receptions_collapse_and_drain_once(app, handled):
+    queue = queue_for(app, handled)
+    for snr in (1.0, 2.0, 3.0):
+        queue.on_event(RAW_EVENT, rx_log("hi", snr=snr), {})
+    queue.on_event(RAW_EVENT, rx_log("other"), {})
+    assert len(app.timers) == 1  # One debounced drain
+    app.run_timers()
+    assert [d["payload"]["decrypted"]["text"] for d in handled] == ["hi", "other"]
+    assert handled[0]["payload"]["snr"] == 1.0
+    assert queue.stats["collapsed"] == 2
+    assert queue.stats["processed"] == 2
+    # Collapsing only applies while the first copy is queued
+    queue.on_event(RAW_EVENT, rx_log("hi"), {})
+    app.run_timers()
+    assert len(handled) == 3
+
+
+def test_over_rate_events_are_sampled(app, handled):
+    queue = queue_for(app, handled, rate=2.0, sample_every=5, max_size=1000)
+    for i in range(24):
+        queue.on_event(RAW_EVENT, rx_log(f"m{i}"), {})
+    # Burst of 4 (2 x rate), then 1 in 5 of the 20 over-rate events
+    assert queue.stats["sampled_out"] == 16
+    app.run_timers()
+    assert len(handled) == 8
+    assert queue.dropped() == 16
+
+
+def test_non_rx_events_are_never_sampled_or_collapsed(app, handled):
+    queue = IngressQueue(app, lambda name, data, kwargs: handled.append(data), ["EventType.ADVERTISEMENT"],
+                         rate=1.0)
+    for _ in range(10):
+        queue.on_event(RAW_EVENT, {"event_type": "EventType.ADVERTISEMENT", "payload": {}}, {})
+    app.run_timers()
+    assert len(handled) == 10
+
+
+def test_overflow_drops_the_oldest(app, handled):
+    queue = queue_for(app, handled, max_size=3, rate=1000.0)
+    for i in range(5):
+        queue.on_event(RAW_EVENT, rx_log(f"m{i}"), {})
+    assert queue.stats["overflow"] == 2
+    app.run_timers()
+    assert [d["payload"]["decrypted"]["text"] for d in handled] == ["m2", "m3", "m4"]
+
+
+def test_drain_runs_in_batches_and_reports_lag(app, handled):
+    queue = queue_for(app, handled, rate=1000.0, batch_size=2, drain_delay=1)
+    for i in range(5):
+        queue.on_event(RAW_EVENT, rx_log(f"m{i}"), {})
+    assert app.run_timers() == 3
+    assert len(handled) == 5
+    assert queue.stats["max_lag_ms"] == 1000
+    assert queue.stats["max_depth"] == 5
+    sensor = app.states["sensor.meshcore_ingress"]
+    assert sensor["state"] == 0
+    assert sensor["attributes"]["apps"]["test_app"]["processed"] == 2  # Published after the first batch
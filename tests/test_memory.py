@@ -0,0 +1,64 @@
+import pytest
+
+import meshcore_memory
+from meshcore_memory import MemoryBudget, memory_report, publish_memory_sensor
+
+
+@pytest.fixture(autouse=True)
+def no_other_budgets(monkeypatch):
+    monkeypatch.setattr(meshcore_memory, "_budgets", {})
+    monkeypatch.setattr(meshcore_memory, "_last_published", 0.0)
+
+
+def nodes(*last_used):
+    return {f"n{i}": {"last_used": t} for i, t in enumerate(last_used)}
+
+
+def last_used(value):
+    return value["last_used"]
+
+
+def test_enforce_drops_expired_then_least_recently_used():
+    budget = MemoryBudget("paths")
+    data = nodes(100, 900, 500, 50, 700)
+    evicted = budget.enforce("hop_nodes", data, 2, recency=last_used, max_age=600, now=1000)
+    # n0 and n3 are past max_age; of the rest, n2 is the least recently used
+    assert sorted(evicted) == ["n0", "n2", "n3"]
+    assert sorted(data) == ["n1", "n4"]
+    assert budget.structures["hop_nodes"] == {"size": 2, "limit": 2, "evicted": 3}
+
+
+def test_enforce_without_recency_drops_oldest_inserted():
+    budget = MemoryBudget("paths")
+    data = {k: None for k in "abcde"}
+    assert budget.enforce("features", data, 3, max_age=1) == ["a", "b"]
+    assert list(data) == ["c", "d", "e"]
+
+
+def test_configured_limits_override_defaults_and_zero_is_unbounded():
+    budget = MemoryBudget("paths", {"hop_nodes": "1", "features": 0})
+    data = nodes(1, 2, 3)
+    assert budget.enforce("hop_nodes", data, 100, recency=last_used) == ["n0", "n1"]
+    data = nodes(1, 2, 3)
+    assert budget.enforce("features", data, 1, recency=last_used) == []
+    assert len(data) == 3
+
+
+def test_eviction_counts_accumulate():
+    budget = MemoryBudget("paths")
+    for _ in range(3):
+        budget.enforce("hop_nodes", nodes(1, 2, 3), 2, recency=last_used)
+    assert budget.structures["hop_nodes"]["evicted"] == 3
+
+
+def test_memory_sensor_reports_every_app(app, monkeypatch):
+    monkeypatch.setattr(meshcore_memory, "process_rss_kb", lambda: 204800)
+    MemoryBudget("paths").enforce("hop_nodes", nodes(1, 2, 3), 1, recency=last_used)
+    MemoryBudget("hops").track("sensors", 12, 500)
+    assert memory_report()["apps"]["hops"] == {"sensors": {"size": 12, "limit": 500, "evicted": 0}}
+
+    publish_memory_sensor(app)
+    sensor = app.states["sensor.meshcore_memory_usage"]
+    assert sensor["state"] == 200.0
+    assert sensor["attributes"]["total_evicted"] == 2
+    assert set(sensor["attributes"]["apps"]) == {"paths", "hops"}
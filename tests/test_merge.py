@@ -0,0 +1,106 @@
+import json
+import os
+
+from meshcore_merge import merge_directlinks, merge_heatmap, merge_nodemap, node_key, refresh_sources
+
+T0 = 1_700_000_000
+
+
+def test_node_key_prefers_the_pubkey():
+    assert node_key({"pubkey": "AB11CC", "name": "Hill"}) == "ab11cc"
+    assert node_key({"name": "Hill", "lat": 52.123456, "lon": 4.3}) == "Hill@52.12346,4.3"
+    assert node_key({"to_pubkey": "", "to_name": "Hill", "to_lat": 52.1, "to_lon": 4.3}, "to_") == "Hill@52.1,4.3"
+
+
+def test_heatmap_keeps_the_highest_counts_per_node():
+    merged = merge_heatmap({
+        "home": {"threshold_hours": 24, "recent_hours": 24, "nodes": [
+            {"pubkey": "ab11cc", "name": "Hill", "use_count": 10, "recent_use_count": 1, "activity": 0.5},
+            {"name": "Old", "lat": 52.1, "lon": 4.3, "use_count": 2}],
+            "paths": [{"sender": "Alice", "coords": [{"lat": 52.1, "lon": 4.3}, {"lat": 52.2, "lon": 4.4}]}]},
+        "north": {"threshold_hours": 48, "nodes": [
+            {"pubkey": "AB11CC", "name": "Hill", "use_count": 7, "recent_use_count": 5, "activity": 2.0},
+            {"name": "Old", "lat": 52.1, "lon": 4.3, "use_count": 3}],
+            "paths": [{"sender": "Alice", "coords": [{"lat": 52.1, "lon": 4.3}, {"lat": 52.2, "lon": 4.4}]},
+                      {"sender": "Bob", "coords": [{"lat": 52.1, "lon": 4.3}, {"lat": 52.3, "lon": 4.4}]}]},
+    })
+    assert merged["node_count"] == 2 and merged["threshold_hours"] == 48 and merged["recent_hours"] == 24
+    hill, old = merged["nodes"]
+    assert (hill["use_count"], hill["recent_use_count"], hill["activity"]) == (10, 5, 2.0)
+    assert hill["sites"] == ["home", "north"]
+    assert (old["use_count"], old["sites"]) == (3, ["home", "north"])
+    assert [(p["sender"], p["site"]) for p in merged["paths"]] == [("Alice", "home"), ("Bob", "north")]
+
+
+def test_nodemap_keeps_the_latest_advert():
+    merged = merge_nodemap({
+        "home": {"nodes": [{"pubkey": "ab11cc", "name": "Hill", "node_type": "repeater", "last_advert": T0 - 7200}]},
+        "north": {"nodes": [{"pubkey": "AB11CC", "name": "Hill 2", "node_type": "repeater", "last_advert": T0 - 3600},
+                            {"pubkey": "dd22ee", "name": "Alice", "node_type": "client"}]},
+    }, T0)
+    assert merged["node_count"] == 2
+    assert merged["type_counts"] == {"client": 1, "repeater": 1}
+    alice, hill = merged["nodes"]
+    assert (hill["name"], hill["age_hours"], hill["sites"]) == ("Hill 2", 1.0, ["home", "north"])
+    assert alice["sites"] == ["north"] and "age_hours" not in alice
+
+
+def test_directlinks_merge_both_directions_into_one_link():
+    def link(a, b, count, last_seen, distance_km=5):
+        return {"from_pubkey": a, "from_name": a, "from_lat": 52.1, "from_lon": 4.3,
+                "to_pubkey": b, "to_name": b, "to_lat": 52.2, "to_lon": 4.4,
+                "count": count, "last_seen": last_seen, "distance_km": distance_km}
+
+    merged = merge_directlinks({
+        "home": {"nodes": [{"pubkey": "aa", "node_type": "repeater"}],
+                 "links": [link("aa", "bb", 4, T0), link("aa", "cc", 1, T0, distance_km=900)]},
+        "north": {"links": [link("BB", "AA", 9, T0 - 60)]},
+    }, max_link_km=300)
+    assert merged["link_count"] == 2 and merged["implausible_link_count"] == 1
+    ab = merged["links"][0]
+    assert (ab["count"], ab["last_seen"], ab["sites"]) == (9, T0, ["home", "north"])
+    nodes = {n["pubkey"]: n for n in merged["nodes"]}
+    assert nodes["aa"]["link_count"] == 2 and nodes["aa"]["node_type"] == "repeater"
+    assert nodes["bb"]["node_type"] == "unknown"
+
+
+def write_export(path, data, mtime_ns=None):
+    with open(path, "w") as f:
+        json.dump(data, f)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_unchanged_sources_are_not_read_again(tmp_path):
+    home, north = str(tmp_path / "home.json"), str(tmp_path / "north.json")
+    write_export(home, {"nodes": [1]}, T0 * 10**9)
+    write_export(north, {"nodes": [2]}, T0 * 10**9)
+    files = {("home", "heatmap"): home, ("north", "nodemap"): north}
+    cache = {}
+    assert refresh_sources(cache, files) == ({"heatmap", "nodemap"}, [])
+
+    # Same mtime and size: the cached export is kept without parsing the file
+    write_export(home, {"nodes": [3]}, T0 * 10**9)
+    assert refresh_sources(cache, files) == (set(), [])
+    assert cache[("home", "heatmap")]["data"] == {"nodes": [1]}
+
+    write_export(home, {"nodes": [3]}, (T0 + 1) * 10**9)
+    assert refresh_sources(cache, files) == ({"heatmap"}, [])
+    assert cache[("home", "heatmap")]["data"] == {"nodes": [3]}
+
+    # A source that went away changes its export
+    del files[("north", "nodemap")]
+    assert refresh_sources(cache, files) == ({"nodemap"}, [])
+    assert list(cache) == [("home", "heatmap")]
+
+
+def test_unreadable_sources_are_retried(tmp_path):
+    path = str(tmp_path / "home.json")
+    with open(path, "w") as f:
+        f.write('{"nodes": [')
+    cache = {}
+    changed, errors = refresh_sources(cache, {("home", "heatmap"): path})
+    assert changed == set() and cache == {}
+    assert [key for key, e in errors] == [("home", "heatmap")]
+    write_export(path, {"nodes": []})
+    assert refresh_sources(cache, {("home", "heatmap"): path}) == ({"heatmap"}, [])
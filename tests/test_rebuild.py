@@ -0,0 +1,107 @@
+import gzip
+import json
+import os
+
+import pytest
+
+import meshcore_rebuild
+from meshcore_rebuild import index_log, plan_partitions, read_events
+
+T0 = 1_700_000_000
+NODES = {"aa": (50.00, 1.00), "bb": (50.10, 1.10), "cc": (50.20, 1.20), "dd": (50.30, 1.30)}
+PATHS = [(), ("aa",), ("aa", "bb"), ("bb", "cc", "dd"), ("dd", "cc")]
+
+
+def states():
+    return {f"binary_sensor.meshcore_{prefix}_contact": {"state": "on", "attributes": {
+        "pubkey_prefix": prefix * 3, "adv_lat": lat, "adv_lon": lon, "adv_name": prefix.upper(),
+        "node_type_str": "Repeater"}} for prefix, (lat, lon) in NODES.items()}
+
+
+def reception(ts, i, path):
+    return {"event_type": "EventType.RX_LOG_DATA", "timestamp": ts, "payload": {
+        "snr": float(i % 7), "rssi": -80 - i % 11,
+        "parsed": {"path_len": len(path), "path": ",".join(path), "path_nodes": list(path)},
+        "decrypted": {"decrypted": True, "channel_idx": 0, "timestamp": T0 + i, "text": f"Node{i % 20}: msg {i}"}}}
+
+
+def events(messages):
+    """A message a second, each heard over 3 paths spread across 4 seconds"""
+    lines = []
+    for i in range(messages):
+        for delay, path in zip((0, 1.5, 4), PATHS[i % 3:i % 3 + 3]):
+            lines.append(reception(T0 + i + delay, i, path))
+    return sorted(lines, key=lambda e: e["timestamp"])
+
+
+def write_logs(directory, lines):
+    """First half plain NDJSON, second half gzipped"""
+    half = len(lines) // 2
+    paths = [os.path.join(directory, "a.ndjson"), os.path.join(directory, "b.ndjson.gz")]
+    for path, chunk in zip(paths, (lines[:half], lines[half:])):
+        with (gzip.open(path, "wt") if path.endswith(".gz") else open(path, "w")) as f:
+            for line in chunk:
+                f.write(json.dumps(line) + "\n")
+    return paths
+
+
+def test_index_and_offsets(tmp_path):
+    (path,) = write_logs(str(tmp_path), events(300))[:1]
+    _, samples, size = index_log(path, step=4096)
+    assert size == os.path.getsize(path)
+    assert samples[0] == (0, T0)
+    assert [ts for _, ts in samples] == sorted(ts for _, ts in samples)
+    offset, ts = samples[3]
+    assert next(read_events(path, offset))[0] == ts
+
+
+def test_plan_partitions_splits_inside_files():
+    logs = [("a", [(0, 1000), (100, 1100), (200, 1200), (300, 1300)], 400),
+            ("b", [(0, 1400), (100, 1500), (200, 1600), (300, 1700)], 400)]
+    assert plan_partitions(logs, 1, 50) == [(None, None, [("a", 0), ("b", 0)])]
+
+    partitions = plan_partitions(logs, 4, 50)
+    assert [(start, end) for start, end, _ in partitions] == [
+        (None, 1200), (1200, 1400), (1400, 1600), (1600, None)]
+    reads = [dict(files) for _, _, files in partitions]
+    # Reads start at the last sample at least ttl before the range, and skip files outside it
+    assert reads == [{"a": 0}, {"a": 100, "b": 0}, {"b": 0}, {"b": 100}]
+
+
+def rebuild(logs, output, workers, capsys):
+    assert meshcore_rebuild.main(logs + ["--states", str(output.parent / "states.json"), "--output", str(output),
+                                         "--workers", str(workers), "--history-hours", "1"]) == 0
+    summary = capsys.readouterr().out
+    outputs = {}
+    for name in ("meshcore_directlinks_persist.json", "meshcore_hops_data.json", "meshcore_hops_sensors.json",
+                 "meshcore_last_messages.json", "meshcore_hops_rollups_persist.json"):
+        with open(output / name) as f:
+            data = json.load(f)
+        # The learned adjacency is per worker by design
+        for key in ("saved_at", "saved_at_formatted", "adjacency"):
+            data.pop(key, None)
+        outputs[name] = data
+    return summary, outputs
+
+
+def test_workers_agree_and_count_boundary_messages_once(tmp_path, capsys, monkeypatch):
+    # Sample often enough that 4 workers really get 4 time ranges
+    monkeypatch.setattr(index_log, "__defaults__", (8192,))
+    with open(tmp_path / "states.json", "w") as f:
+        json.dump(states(), f)
+    logs = write_logs(str(tmp_path), events(400))
+
+    single_summary, single = rebuild(logs, tmp_path / "single", 1, capsys)
+    multi_summary, multi = rebuild(logs, tmp_path / "multi", 4, capsys)
+    assert "in 1 partitions" in single_summary
+    assert "in 4 partitions" in multi_summary
+    for summary in (single_summary, multi_summary):
+        assert summary.startswith("Replayed 1200 receptions of 400 messages")
+
+    hop_nodes = multi["meshcore_hops_data.json"].pop("hop_nodes_used")
+    for key, node in single["meshcore_hops_data.json"].pop("hop_nodes_used").items():
+        assert hop_nodes[key]["use_count"] == node["use_count"]
+        assert hop_nodes[key]["activity"] == pytest.approx(node["activity"])
+    assert multi == single
+    assert sum(c["count"] for links in single["meshcore_directlinks_persist.json"]["direct_links"].values()
+               for c in links.values()) > 0
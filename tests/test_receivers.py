@@ -0,0 +1,101 @@
+import pytest
+
+from meshcore_contacts import ContactIndex
+from meshcore_ingress import RX_LOG_DATA, reception_key
+from meshcore_receivers import DEFAULT_RECEIVER, ReceiverRegistry, receiver_of
+from meshcore_receptions import ReceptionCollector
+
+NORTH = "ee1100"
+SOUTH = "ee2200"
+
+
+def contact_state(pubkey, lat, lon):
+    return {"attributes": {"pubkey_prefix": pubkey, "adv_lat": lat, "adv_lon": lon, "adv_name": pubkey[:4],
+                           "node_type_str": "Repeater"}}
+
+
+@pytest.fixture
+def receivers():
+    registry = ReceiverRegistry()
+    registry.configure([{"id": "north_entry", "name": "North", "pubkey": NORTH.upper()},
+                        {"id": "south_entry", "name": "South", "pubkey": SOUTH}], my_pubkey=NORTH)
+    return registry
+
+
+@pytest.fixture
+def index(receivers):
+    located = [(NORTH, 50.3, 1.0), (SOUTH, 40.3, 1.0),
+               ("aa1100", 50.0, 1.0), ("aa2200", 40.0, 1.0), ("bb1100", 50.1, 1.0), ("bb2200", 40.1, 1.0)]
+    index = ContactIndex(NORTH)
+    index.update({f"binary_sensor.meshcore_{pk}_contact": contact_state(pk, lat, lon) for pk, lat, lon in located})
+    index.set_receivers(receivers.pubkeys())
+    return index
+
+
+def rx_log(receiver=None, path=("aa", "bb"), snr=5.0):
+    data = {"event_type": RX_LOG_DATA, "payload": {
+        "snr": snr, "rssi": -90, "parsed": {"path_len": len(path), "path_nodes": list(path)},
+        "decrypted": {"decrypted": True, "channel_idx": 0, "timestamp": 1000, "text": "Bob: hi"}}}
+    if receiver:
+        data["entry_id"] = receiver
+    return data
+
+
+def test_receiver_of_reads_the_first_tag():
+    assert receiver_of({"receiver": "r1", "entry_id": "e1"}) == "r1"
+    assert receiver_of({"device_id": 42}) == "42"
+    assert receiver_of({"receiver": ""}) == DEFAULT_RECEIVER
+
+
+def test_registry_configuration(receivers):
+    assert receivers.multiple()
+    assert receivers.name("south_entry") == "South"
+    assert receivers.name("unknown_entry") == "unknown_entry"
+    assert receivers.pubkey("north_entry") == NORTH
+    assert receivers.pubkey(DEFAULT_RECEIVER) == NORTH  # my_pubkey is the default receiver
+    assert sorted(receivers.pubkeys()) == [NORTH, NORTH, SOUTH]
+
+    single = ReceiverRegistry()
+    single.configure(None, my_pubkey=NORTH)
+    assert not single.multiple()
+    single.configure({"r2": {"pubkey": SOUTH}})
+    assert single.multiple() and single.name("r2") == "r2"
+
+
+def test_origin_is_the_receiving_radio(receivers, index):
+    assert receivers.origin("south_entry", index)["pubkey"] == SOUTH
+    assert receivers.origin(DEFAULT_RECEIVER, index)["pubkey"] == NORTH
+    assert receivers.origin("unknown_entry", index) is None
+
+
+def test_every_radio_wins_its_own_prefix(index):
+    assert [c["pubkey"] for c in index.lookup("ee")] == [NORTH]
+    assert [c["pubkey"] for c in index.lookup("ee22")] == [SOUTH]
+
+
+def test_paths_resolve_from_the_radio_that_heard_them(receivers, index):
+    # Both hops collide; each radio resolves them to the copies near itself
+    north = index.resolve_path(["aa", "bb"], origin=receivers.origin("north_entry", index))
+    south = index.resolve_path(["aa", "bb"], origin=receivers.origin("south_entry", index))
+    assert [c["pubkey"] for c in north] == ["aa1100", "bb1100"]
+    assert [c["pubkey"] for c in south] == ["aa2200", "bb2200"]
+
+
+def test_one_packet_heard_by_two_radios_is_one_message(app):
+    collector = ReceptionCollector()
+    delivered = []
+    collector.subscribe(app, lambda record, new: delivered.append([r["receiver"] for r in new]))
+    for receiver in ("north_entry", "south_entry", "north_entry"):
+        data = rx_log(receiver)
+        collector.add(data["payload"], receiver_of(data))
+    app.run_timers()
+    assert delivered == [["north_entry", "south_entry"]]
+    assert collector.stats["messages"] == 1
+    assert collector.stats["duplicates"] == 1
+
+
+def test_ingress_collapses_across_radios_unless_signal_matters():
+    north, south = rx_log("north_entry"), rx_log("south_entry")
+    assert reception_key(north) == reception_key(south)
+    assert reception_key(north, with_signal=True) != reception_key(south, with_signal=True)
+    assert reception_key(north, with_signal=True) == reception_key(rx_log("north_entry"), with_signal=True)
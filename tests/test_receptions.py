@@ -0,0 +1,88 @@
+import types
+
+import pytest
+
+import meshcore_receptions
+from meshcore_receptions import ReceptionCollector, message_fingerprint, split_sender
+
+
+@pytest.fixture(autouse=True)
+def manual_time(monkeypatch, clock):
+    monkeypatch.setattr(meshcore_receptions, "time", types.SimpleNamespace(time=clock))
+
+
+def payload(text, path=("ab", "cd"), snr=5.0, timestamp=1000, channel_idx=0):
+    return {"snr": snr, "rssi": -90,
+            "parsed": {"path_len": len(path), "path": ",".join(path), "path_nodes": list(path)},
+            "decrypted": {"decrypted": True, "channel_idx": channel_idx, "timestamp": timestamp, "text": text}}
+
+
+@pytest.fixture
+def delivered():
+    return []
+
+
+@pytest.fixture
+def collector(app, delivered):
+    collector = ReceptionCollector(ttl=300, max_size=10)
+    collector.subscribe(app, lambda record, new: delivered.append((record["fingerprint"], len(new))), window=3)
+    return collector
+
+
+def test_fingerprint_and_sender():
+    assert message_fingerprint(0, 1000, "Bob: hi") == message_fingerprint(0, 1000, "Bob: hi")
+    assert message_fingerprint(0, 1000, "Bob: hi") != message_fingerprint(1, 1000, "Bob: hi")
+    assert split_sender("Bob: hi: there") == ("Bob", "hi: there")
+    assert split_sender("no sender") == ("Unknown", "no sender")
+
+
+def test_receptions_aggregate_into_one_delivery(app, collector, delivered):
+    record = collector.add(payload("Bob: hi"))
+    collector.add(payload("Bob: hi", path=("ef",)))
+    collector.add(payload("Bob: hi"))  # Same reception reported by another app
+    collector.add(payload("Bob: hi"), receiver="radio2")
+    assert record["sender_name"] == "Bob"
+    assert len(record["receptions"]) == 3
+    assert collector.stats["duplicates"] == 1
+    assert len(app.timers) == 1
+    app.run_timers()
+    assert delivered == [(record["fingerprint"], 3)]
+
+
+def test_late_receptions_get_a_follow_up_delivery(app, collector, delivered):
+    record = collector.add(payload("Bob: hi"))
+    app.run_timers()
+    collector.add(payload("Bob: hi", path=("ef",)))
+    app.run_timers()
+    assert delivered == [(record["fingerprint"], 1), (record["fingerprint"], 1)]
+
+
+def test_undecrypted_payloads_are_ignored(collector):
+    undecrypted = payload("Bob: hi")
+    undecrypted["decrypted"]["decrypted"] = False
+    assert collector.add(undecrypted) is None
+    assert len(collector) == 0
+
+
+def test_records_expire_after_ttl(app, clock, collector):
+    record = collector.add(payload("Bob: hi"))
+    app.run_timers()
+    clock.now += 301
+    assert collector.get(record["fingerprint"]) is None
+    assert collector.stats["expired"] == 1
+    assert collector.stats["dropped"] == 0
+
+
+def test_eviction_never_drops_pending_deliveries(app, collector, delivered):
+    for i in range(50):
+        collector.add(payload(f"Bob: m{i}", timestamp=i))
+    # Every record is waiting for its delivery, so none can be evicted yet
+    assert len(collector) == 50
+    assert collector.stats["evicted"] == 0
+    app.run_timers()
+    assert len(delivered) == 50
+
+    collector.add(payload("Bob: next", timestamp=99))
+    assert len(collector) == 10
+    assert collector.stats["evicted"] == 41
+    assert collector.stats["dropped"] == 0
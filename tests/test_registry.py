@@ -0,0 +1,111 @@
+import pytest
+
+from meshcore_registry import CopyOnWriteMap, SnapshotRegistry
+
+
+@pytest.fixture
+def registry():
+    return SnapshotRegistry()
+
+
+def test_publish_versions_snapshots(registry):
+    assert registry.get("hop_nodes") is None
+    first = registry.publish("hop_nodes", {"a": 1})
+    second = registry.publish("hop_nodes", {"a": 2})
+    assert (first.version, second.version) == (1, 2)
+    assert registry.get("hop_nodes") is second
+    assert first.data == {"a": 1}
+
+
+def test_subscribers_get_one_call_per_burst(registry, app):
+    seen = []
+    registry.subscribe(app, "hop_nodes", lambda snapshot: seen.append(snapshot.version))
+    for i in range(3):
+        registry.publish("hop_nodes", {"a": i})
+    registry.publish("direct_links", {})
+    assert app.run_timers() == 1
+    assert seen == [3]  # The latest snapshot at the time of the call
+
+    registry.unsubscribe(app.name)
+    registry.publish("hop_nodes", {})
+    app.run_timers()
+    assert seen == [3]
+
+
+def test_subscriber_errors_are_logged(registry, app):
+    registry.subscribe(app, "hop_nodes", lambda snapshot: snapshot.data["missing"])
+    registry.publish("hop_nodes", {})
+    app.run_timers()
+    assert app.errors() == ["Error handling hop_nodes snapshot: 'missing'"]
+
+
+def test_copy_on_write_map_never_changes_a_published_snapshot(registry):
+    view = CopyOnWriteMap(registry, "hop_nodes")
+    view.set("a", 1)
+    view.set("b", 2)
+    first = view.commit()
+    assert dict(first.data) == {"a": 1, "b": 2}
+
+    view.set("a", 10)
+    view.discard("b")
+    view.set("c", 3)
+    second = view.commit()
+    assert dict(second.data) == {"a": 10, "c": 3}
+    assert dict(first.data) == {"a": 1, "b": 2}
+    with pytest.raises(TypeError):
+        second.data["d"] = 4  # Read-only view
+
+
+def test_commit_without_changes_publishes_nothing(registry):
+    view = CopyOnWriteMap(registry, "hop_nodes")
+    assert view.commit() is None
+    view.set("a", 1)
+    view.discard("a")
+    assert dict(view.commit().data) == {}
+    assert view.commit() is None
+
+
+def test_replace_stages_a_whole_mapping(registry):
+    view = CopyOnWriteMap(registry, "hop_nodes")
+    view.set("a", 1)
+    view.commit()
+    view.set("b", 2)
+    view.replace({"c": 3})
+    assert dict(view.commit().data) == {"c": 3}
+
+
+def test_schedule_debounces_commits(registry, app):
+    view = CopyOnWriteMap(registry, "hop_nodes", app=app, commit_delay=5)
+    for i in range(100):
+        view.set(f"n{i}", i)
+        view.schedule()
+    assert len(app.timers) == 1
+    assert registry.get("hop_nodes") is None
+    app.run_timers()
+    snapshot = registry.get("hop_nodes")
+    assert snapshot.version == 1
+    assert len(snapshot.data) == 100
+
+    view.set("n0", -1)
+    view.schedule()
+    assert len(app.timers) == 1  # A new window after the last commit
+    app.run_timers()
+    assert registry.get("hop_nodes").data["n0"] == -1
+
+
+def test_reload_commits_bypass_the_pending_timer(registry, app):
+    view = CopyOnWriteMap(registry, "hop_nodes", app=app)
+    view.set("a", 1)
+    view.schedule()
+    view.replace({"b": 2})
+    view.commit()
+    assert dict(registry.get("hop_nodes").data) == {"b": 2}
+    app.run_timers()  # Nothing left to publish
+    assert registry.get("hop_nodes").version == 1
+
+
+def test_schedule_without_an_app_commits_at_once(registry):
+    view = CopyOnWriteMap(registry, "hop_nodes")
+    view.set("a", 1)
+    view.schedule()
+    assert registry.get("hop_nodes").version == 1
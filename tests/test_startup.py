@@ -0,0 +1,77 @@
+import types
+
+import pytest
+
+import meshcore_startup
+from meshcore_startup import RestoreScheduler, TokenBucket
+
+
+@pytest.fixture(autouse=True)
+def manual_time(monkeypatch, clock):
+    monkeypatch.setattr(meshcore_startup, "time", types.SimpleNamespace(monotonic=clock))
+
+
+def test_bucket_grants_the_burst_then_refills_at_rate(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+    assert bucket.take(8) == 5
+    assert bucket.take(1) == 0
+    assert bucket.wait_time() == pytest.approx(0.1)
+    clock.now += 0.35
+    assert bucket.take(8) == 3
+    clock.now += 60
+    assert bucket.take(8) == 5  # Never banks more than burst
+
+
+def test_bucket_give_back_is_capped_at_burst():
+    bucket = TokenBucket(rate=1, burst=4)
+    assert bucket.take(3) == 3
+    bucket.give_back(10)
+    assert bucket.tokens == 4
+    assert bucket.wait_time() == 0.0
+
+
+def test_scheduler_restores_newest_first_within_the_rate(app):
+    scheduler = RestoreScheduler(rate=2, burst=2)
+    applied = []
+    done = []
+    items = [(f"sensor.{t}", {"t": t}) for t in (10, 50, 30, 40, 20)]
+    scheduler.submit(app, "sensors", items, lambda k, v: applied.append(k) or True,
+                     lambda v: v["t"], on_done=lambda a, s: done.append((a, s)))
+
+    start = app.clock.now
+    app.run_timers()
+    assert applied == ["sensor.50", "sensor.40", "sensor.30", "sensor.20", "sensor.10"]
+    assert done == [(5, 0)]
+    # The burst goes out on the first drain, the other 3 at 2 per second
+    assert app.clock.now - start >= 2
+    assert scheduler.pending() == 0
+
+
+def test_skipped_and_failed_items_use_no_tokens(app):
+    scheduler = RestoreScheduler(rate=1, burst=1)
+    done = []
+
+    def apply(key, value):
+        if key == "bad":
+            raise ValueError("boom")
+        return key == "pushed"
+
+    items = [("same", 3), ("bad", 2), ("pushed", 1)]
+    scheduler.submit(app, "markers", items, apply, lambda v: v, on_done=lambda a, s: done.append((a, s)))
+    assert app.run_timers() == 1
+    assert done == [(1, 1)]
+    assert scheduler.stats == {"applied": 1, "skipped": 1, "errors": 1}
+    assert app.errors() == ["Error restoring markers bad: boom"]
+
+
+def test_cancel_hands_the_drain_to_another_app(app, make_app):
+    other = make_app("other_app")
+    scheduler = RestoreScheduler(rate=100, burst=100)
+    applied = []
+    scheduler.submit(app, "a", [("a1", 1)], lambda k, v: applied.append(k) or True, lambda v: v)
+    scheduler.submit(other, "b", [("b1", 2)], lambda k, v: applied.append(k) or True, lambda v: v)
+    scheduler.cancel(app.name)
+    assert scheduler.pending() == 1
+    app.timers.clear()  # AppDaemon drops a terminated app's timers
+    other.run_timers()
+    assert applied == ["b1"]